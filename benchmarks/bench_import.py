@@ -0,0 +1,51 @@
+""" Import-time breakdown of the dashboard entry points.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter
+for each entry point and prints the total plus the slowest modules.
+
+    python benchmarks/bench_import.py [top_n]
+"""
+import subprocess
+import sys
+
+ENTRY_POINTS = [
+    'dashboard.cli',
+    'dashboard.models',
+    'dashboard.celery_worker',
+]
+
+
+def import_times(module):
+    """ [(module, self_us, cumulative_us)] in import order """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def main(top_n=10):
+    for module in ENTRY_POINTS:
+        times = import_times(module)
+        total = [c for name, _, c in times if name == module][-1]
+        print("{}: {:.1f} ms".format(module, total / 1000.))
+        by_package = {}
+        for name, self_us, _ in times:
+            package = name.split('.')[0]
+            by_package[package] = by_package.get(package, 0) + self_us
+        for package, us in sorted(by_package.items(),
+                key=lambda kv: -kv[1])[:top_n]:
+            print("    {:<30} {:8.1f} ms".format(package, us / 1000.))
+        heavy = [name for name in ('pandas', 'numpy', 'pyodbc', 'flask')
+                 if name in by_package]
+        if heavy:
+            print("    heavy imports: {}".format(", ".join(heavy)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
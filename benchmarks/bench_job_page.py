@@ -0,0 +1,107 @@
+""" Count sql statements and time RequestHandler.info_job.
+
+Compares the old loader (job, tags, tasks and alerts queried one by
+one, then one more query per is_subscribed_to call from the template)
+with the joined two-query loader. The webserver db is swapped for
+in-memory sqlite.
+
+    python benchmarks/bench_job_page.py [num_tasks]
+"""
+from datetime import datetime, timedelta
+import sys
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from dashboard.utils import db
+
+# replaces the configured webserver db, get_engine() returns it
+db.engine = create_engine('sqlite://', poolclass=StaticPool,
+                connect_args={'check_same_thread': False})
+db.session_factory = scoped_session(sessionmaker(
+                autocommit=False, autoflush=False, bind=db.engine))
+
+from dashboard.models import (Job, JobAlert, RequestHandler, Tag,
+        TaskInstance, User, init_db)
+
+JOB_NAME = 'bench_job'
+EMAIL = 'user@example.com'
+
+statements = []
+
+
+@event.listens_for(db.engine, 'before_cursor_execute')
+def count_statement(conn, cursor, statement, *args):
+    statements.append(statement)
+
+
+def setup(num_tasks):
+    session = db.session_factory()
+    job = Job(name=JOB_NAME, timezone='US/Eastern', start_dt='',
+            end_dt='', schedule_interval='@hourly', weekday_to_run=None,
+            schedule_interval_crontab='', reset_status_at='0:00',
+            operator='bash', database=None, command='echo 1')
+    session.add(job)
+    session.flush()
+    for i in range(num_tasks):
+        session.add(TaskInstance(job,
+                execution_date=datetime.now() - timedelta(hours=i)))
+    for tag in ('tag_a', 'tag_b', 'tag_c'):
+        session.add(Tag(tag, JOB_NAME))
+    for i in range(5):
+        session.add(JobAlert(job_name=JOB_NAME,
+                email='user{}@example.com'.format(i)))
+    session.add(User(email=EMAIL, password='x'))
+    session.commit()
+    session.close()
+
+
+def legacy_info_job(job_name, max_task_num=20):
+    session = db.session_factory()
+    job = session.query(Job).filter(Job.name==job_name).first()
+    tags = [t[0] for t in session.query(Tag.name).filter(
+            Tag.job_name==job_name).all()]
+    tasks = sorted(session.query(TaskInstance).filter(
+            TaskInstance.job_id==job.id).order_by(
+            TaskInstance.execution_date.desc()).limit(max_task_num).all())
+    alerts = [a[0] for a in session.query(JobAlert.email).filter(
+            JobAlert.job_name==job_name).order_by(JobAlert.email).all()]
+    session.close()
+    return job, tags, tasks, alerts
+
+
+def measure(label, load, repeat=200):
+    del statements[:]
+    load()
+    per_call = len(statements)
+    start = time.time()
+    for _ in range(repeat):
+        load()
+    elapsed = (time.time() - start) / repeat
+    print("{:<10} {:2d} statements  {:7.2f} ms".format(
+                label, per_call, elapsed * 1000))
+
+
+def main(num_tasks=1000):
+    init_db()
+    setup(num_tasks)
+    user = RequestHandler.get_user(EMAIL)
+
+    def legacy():
+        job, tags, tasks, alerts = legacy_info_job(JOB_NAME)
+        # the template asked the db once more
+        user.is_subscribed_to(name=job.name, job=True)
+
+    def joined():
+        job, tags, tasks, alerts = RequestHandler.info_job(JOB_NAME)
+        # the view checks the loaded alerts
+        EMAIL in alerts
+
+    measure('legacy', legacy)
+    measure('joined', joined)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,58 @@
+""" Time open_sql_server_session with and without the connection pool.
+
+Uses the sqlite3 stand-in driver on a temporary file, so it measures
+the pool bookkeeping against a cheap connect; with pyodbc and a remote
+server the connect saved per task is far more expensive.
+
+    python benchmarks/bench_sql_pool.py [num_tasks]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from dashboard.configuration import conf
+
+DB = 'BENCHDB'
+path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+conf.set('sql_pool', 'driver', 'sqlite3')
+conf.set('database', DB, path)
+
+from dashboard.utils import sql_pool
+from dashboard.utils.db import open_sql_server_session
+
+QUERY = "SELECT count(*) FROM checks WHERE ok = 0"
+
+
+def unpooled_check():
+    conn = sql_pool.connect(DB, 'sqlite3')
+    try:
+        return conn.cursor().execute(QUERY).fetchall()
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def pooled_check():
+    with open_sql_server_session(DB) as cursor:
+        return cursor.execute(QUERY).fetchall()
+
+
+def main(num_tasks=5000):
+    with open_sql_server_session(DB, commit=True) as cursor:
+        cursor.execute("CREATE TABLE checks (id INTEGER, ok INTEGER)")
+        cursor.executemany("INSERT INTO checks VALUES (?, ?)",
+                [(i, i % 2) for i in range(1000)])
+    for label, check in (('connect', unpooled_check),
+                         ('pooled', pooled_check)):
+        start = time.time()
+        for _ in range(num_tasks):
+            check()
+        elapsed = time.time() - start
+        print("{:<8} {:8.1f} us/task".format(
+                    label, elapsed / num_tasks * 1e6))
+    print(sql_pool.pool_stats())
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,107 @@
+""" Benchmark ScheduleManager.check_tasks_state with 1k outstanding tasks.
+
+Compares the old per-task path (one AsyncResult round trip, one job
+lookup and one commit per task) with the batched path (one MGET, one
+job lookup, one commit). Needs the redis result backend from the
+[celery] config; the webserver db is swapped for in-memory sqlite.
+
+    python benchmarks/bench_task_state.py [num_tasks]
+"""
+from datetime import datetime
+import sys
+import time
+import uuid
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from dashboard.utils import db
+
+# replaces the configured webserver db, get_engine() returns it
+db.engine = create_engine('sqlite://', poolclass=StaticPool,
+                connect_args={'check_same_thread': False})
+db.session_factory = scoped_session(sessionmaker(
+                autocommit=False, autoflush=False, bind=db.engine))
+
+from dashboard.celery_worker import execute_command, get_task_metas, worker
+from dashboard.models import Job, ScheduleManager, TaskInstance, init_db
+
+
+def setup(num_tasks):
+    session = db.session_factory()
+    task_ids = []
+    for i in range(num_tasks):
+        job = Job(name='bench_job_{}'.format(i), timezone='US/Eastern',
+                start_dt='', end_dt='', schedule_interval='@hourly',
+                weekday_to_run=None, schedule_interval_crontab='',
+                reset_status_at='0:00', operator='bash', database=None,
+                command='echo 1')
+        session.add(job)
+        session.flush()
+        task = TaskInstance(job, execution_date=datetime.now())
+        task.task_id = str(uuid.uuid4())
+        session.add(task)
+        task_ids.append(task.task_id)
+        worker.backend.store_result(task.task_id, '1', 'SUCCESS')
+    session.commit()
+    session.close()
+    return task_ids
+
+
+def reset_tasks():
+    session = db.session_factory()
+    session.query(TaskInstance).update({TaskInstance.state: 'PENDING'})
+    session.commit()
+    session.close()
+
+
+def legacy_check_tasks_state():
+    session = db.session_factory()
+    tasks = session.query(TaskInstance).filter(
+            TaskInstance.state.in_(("PENDING", "STARTED"))
+            ).with_for_update().all()
+    for task in tasks:
+        celery_task = execute_command.AsyncResult(task.task_id)
+        task.state = celery_task.status
+        task.result = celery_task.result
+        job = session.query(Job).filter(Job.name==task.job_name
+                ).with_for_update().first()
+        job.last_execution_ts = task.execution_date
+        job.last_task_result = task.result
+        job.set_status(session, 'success')
+        session.commit()
+    session.commit()
+    session.close()
+
+
+def timed(label, func):
+    start = time.time()
+    func()
+    print("{:<40} {:8.3f}s".format(label, time.time() - start))
+
+
+def main(num_tasks=1000):
+    init_db()
+    task_ids = setup(num_tasks)
+    print("{} outstanding tasks".format(num_tasks))
+    timed("fetch: sequential AsyncResult",
+        lambda: [execute_command.AsyncResult(t).status for t in task_ids])
+    timed("fetch: get_task_metas (MGET)",
+        lambda: get_task_metas(task_ids))
+
+    reset_tasks()
+    timed("check_tasks_state: per-task commit", legacy_check_tasks_state)
+    reset_tasks()
+    # __init__ only builds the lease and the shard membership, the
+    # lease is taken in start(); time the unsharded path
+    manager = ScheduleManager()
+    manager.shards = None
+    timed("check_tasks_state: batched", manager.check_tasks_state)
+
+    for task_id in task_ids:
+        worker.backend.forget(task_id)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
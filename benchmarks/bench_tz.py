@@ -0,0 +1,63 @@
+""" Microbenchmark timezone conversion: pandas vs dashboard.utils.date.
+
+    python benchmarks/bench_tz.py [num_timestamps]
+"""
+from datetime import datetime, timedelta
+import random
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from dashboard.utils.date import (convert_to_local, convert_to_utc,
+        convert_to_utc_batch)
+
+TIMEZONE = 'US/Eastern'
+
+
+def pandas_to_utc(ts, timezone):
+    # same DST resolution as convert_to_utc, plain tz_localize raises
+    return pd.to_datetime(ts).tz_localize(timezone, ambiguous=True,
+            nonexistent='shift_forward').astimezone(
+            'UTC').replace(tzinfo=None)
+
+
+def pandas_to_local(ts, timezone):
+    return pd.to_datetime(ts).tz_localize('UTC').astimezone(
+            timezone).replace(tzinfo=None)
+
+
+def report(label, seconds, n):
+    print("{:<32} {:10.2f} us/ts".format(label, seconds / n * 1e6))
+
+
+def main(num_timestamps=10000):
+    random.seed(0)
+    # next runs of many jobs, spread over two weeks around a DST change
+    timestamps = [datetime(2017, 3, 5) + timedelta(
+            minutes=random.randint(0, 14 * 24 * 60))
+            for _ in range(num_timestamps)]
+    n = len(timestamps)
+
+    report("to utc: pandas", timeit.timeit(lambda: [
+        pandas_to_utc(ts, TIMEZONE) for ts in timestamps], number=1), n)
+    report("to utc: zoneinfo", timeit.timeit(lambda: [
+        convert_to_utc(ts, TIMEZONE) for ts in timestamps], number=1), n)
+    report("to utc: pandas vectorized", timeit.timeit(lambda:
+        pd.DatetimeIndex(timestamps).tz_localize(TIMEZONE,
+            ambiguous=np.ones(n, dtype=bool), nonexistent='shift_forward'
+            ).tz_convert('UTC'), number=1), n)
+    report("to utc: batch", timeit.timeit(lambda:
+        convert_to_utc_batch(timestamps, TIMEZONE), number=1), n)
+    array = np.array(timestamps, dtype='datetime64[us]')
+    report("to utc: batch datetime64", timeit.timeit(lambda:
+        convert_to_utc_batch(array, TIMEZONE), number=1), n)
+    report("to local: pandas", timeit.timeit(lambda: [
+        pandas_to_local(ts, TIMEZONE) for ts in timestamps], number=1), n)
+    report("to local: zoneinfo", timeit.timeit(lambda: [
+        convert_to_local(ts, TIMEZONE) for ts in timestamps], number=1), n)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
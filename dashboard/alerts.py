@@ -0,0 +1,171 @@
+""" Failure alerts, queued in redis and mailed by a separate dispatcher.
+
+The scheduler only pushes an alert (job, output, recipients) onto
+ALERT_QUEUE and never talks to the mail server. `AlertDispatcher`
+(cli.py alerts) waits for the first alert, collects everything queued
+during the next digest_window seconds and sends every recipient one
+mail with all their alerts, over one smtp connection kept open between
+rounds. Recipients whose digests are identical share one message.
+
+Alerts being sent sit in ALERT_PROCESSING until their mails are out,
+a dispatcher that dies mid-round re-sends them on restart. The alerts
+of a digest that could not be sent go back onto ALERT_QUEUE for its
+recipients only, for up to max_attempts rounds.
+"""
+from datetime import datetime
+import json
+import logging
+import time
+
+from dashboard.configuration import conf
+from dashboard.utils.cache import GLOBAL_ENTITY, get_versions
+from dashboard.utils.db import get_redis_conn
+from dashboard.utils.emails import SMTPConnection
+
+logger = logging.getLogger(__name__)
+
+ALERT_QUEUE = "alerts/queue"
+ALERT_PROCESSING = "alerts/processing"
+ALERT_STATS = "alerts/stats"
+
+# version bumped whenever job or tag followers may have changed
+RECIPIENTS_ENTITY = "recipients"
+
+SUBJECT = "Dashboard - Job Failure Alert"
+DIGEST_SUBJECT = "Dashboard - {} Job Failure Alerts"
+BODY = "Job {job_name} (command {command}) status: \nfailed with sysout {result}"
+
+
+def enqueue_alert(job_name, command, result, recipients):
+    """ queue a failure alert, never blocks on mail """
+    if not recipients:
+        return
+    alert = {'job_name': job_name,
+             'command': command,
+             'result': result,
+             'recipients': sorted(set(recipients)),
+             'ts': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    try:
+        get_redis_conn().lpush(ALERT_QUEUE, json.dumps(alert))
+    except Exception:
+        logger.exception("Cannot queue alert for job {}".format(job_name))
+
+
+class RecipientsMap(object):
+    """ job name -> alert recipients (job and tag followers), held in
+    memory and reloaded only when the recipients version changed """
+
+    def __init__(self, load):
+        # load(session) -> {job name: set of emails}
+        self.load = load
+        self.version = None
+        self.recipients = {}
+
+    def refresh(self, session):
+        try:
+            version = get_versions([GLOBAL_ENTITY, RECIPIENTS_ENTITY])
+        except Exception:
+            logger.exception("Cannot read recipients version, reload")
+            version = None
+        if version is None or version != self.version:
+            self.recipients = self.load(session)
+            self.version = version
+
+    def get(self, job_name):
+        return self.recipients.get(job_name, ())
+
+
+def build_digests(alerts):
+    """ [(recipients, subject, body, alert indexes)], one entry per
+    distinct digest """
+    by_recipient = {}
+    for i, alert in enumerate(alerts):
+        for email in alert['recipients']:
+            by_recipient.setdefault(email, []).append(i)
+    by_digest = {}
+    for email, indexes in by_recipient.items():
+        by_digest.setdefault(tuple(indexes), []).append(email)
+
+    digests = []
+    for indexes, recipients in by_digest.items():
+        user_alerts = [alerts[i] for i in indexes]
+        if len(user_alerts) == 1:
+            subject = SUBJECT
+            body = BODY.format(**user_alerts[0])
+        else:
+            subject = DIGEST_SUBJECT.format(len(user_alerts))
+            body = "\n\n".join("[{}] {}".format(a['ts'], BODY.format(**a))
+                               for a in user_alerts)
+        digests.append((sorted(recipients), subject, body, indexes))
+    return digests
+
+
+class AlertDispatcher(object):
+
+    def __init__(self):
+        self.digest_window = conf.getfloat('alerts', 'digest_window')
+        self.max_batch = conf.getint('alerts', 'max_batch')
+        self.max_attempts = conf.getint('alerts', 'max_attempts')
+        self.smtp = SMTPConnection(
+                idle_timeout=conf.getint('alerts', 'smtp_idle_timeout'),
+                retries=conf.getint('alerts', 'smtp_retries'),
+                retry_delay=conf.getfloat('alerts', 'smtp_retry_delay'))
+        self.redis_conn = get_redis_conn()
+
+    def start(self):
+        logger.info("Start alert dispatcher")
+        try:
+            while True:
+                self.run_once()
+        finally:
+            self.smtp.close()
+
+    def run_once(self, block_timeout=0):
+        """ one digest round, returns the number of alerts processed """
+        if not self.redis_conn.llen(ALERT_PROCESSING):
+            # wait for the first alert, then let the storm gather
+            if self.redis_conn.brpoplpush(ALERT_QUEUE, ALERT_PROCESSING,
+                    timeout=block_timeout) is None:
+                return 0
+            time.sleep(self.digest_window)
+        tx = self.redis_conn.pipeline()
+        for _ in range(self.max_batch):
+            tx.rpoplpush(ALERT_QUEUE, ALERT_PROCESSING)
+        tx.execute()
+
+        # newest first in the list, digests read oldest first
+        alerts = [json.loads(a) for a in reversed(
+                  self.redis_conn.lrange(ALERT_PROCESSING, 0, -1))]
+        digests = build_digests(alerts)
+        retry, dropped, sent = [], 0, 0
+        for recipients, subject, body, indexes in digests:
+            try:
+                self.smtp.send(subject, recipients, body)
+                sent += 1
+                continue
+            except Exception:
+                # one bad recipient must not hold back the others
+                logger.exception("Cannot mail alert digest to {}".format(
+                            ", ".join(recipients)))
+            for i in indexes:
+                alert = dict(alerts[i], recipients=recipients,
+                        attempts=alerts[i].get('attempts', 0) + 1)
+                if alert['attempts'] >= self.max_attempts:
+                    logger.error("Drop alert of job {} to {}".format(
+                                alert['job_name'], ", ".join(recipients)))
+                    dropped += 1
+                else:
+                    retry.append(json.dumps(alert))
+        # requeued and removed from processing in one transaction
+        tx = self.redis_conn.pipeline()
+        if retry:
+            tx.lpush(ALERT_QUEUE, *retry)
+        tx.delete(ALERT_PROCESSING)
+        tx.hincrby(ALERT_STATS, 'alerts', len(alerts))
+        tx.hincrby(ALERT_STATS, 'mails', sent)
+        tx.hincrby(ALERT_STATS, 'failed_mails', len(digests) - sent)
+        tx.hincrby(ALERT_STATS, 'dropped', dropped)
+        tx.execute()
+        logger.info("Processed {} alerts, sent {} mails, {} failed".format(
+                    len(alerts), sent, len(digests) - sent))
+        return len(alerts)
@@ -4,7 +4,6 @@ from flask.ext.wtf import Form
 from flask_login import login_user, logout_user, login_required, current_user
 from functools import partial
 import json
-from pandas import to_datetime
 from wtforms import (BooleanField, DateTimeField, PasswordField, SelectField, 
                     StringField, SubmitField, TextAreaField, TextField)
 from wtforms.validators import (DataRequired, Email, EqualTo, 
@@ -12,9 +11,15 @@ from wtforms.validators import (DataRequired, Email, EqualTo,
 
 
 from app import main, auth, login_manager
-from models import RequestHandler
-from dashboard.utils.date import (cron_presets, valid_crontab_string)
+from models import Job, Monitor, RequestHandler
+from dashboard.retention import archived_months, valid_month
+from dashboard.utils.cache import cache_stats, page_cache
+from dashboard.utils.date import (cron_presets, get_next_n_runs,
+                    parse_datetime, valid_crontab_string)
 from dashboard.utils.emails import valid_email
+from dashboard.utils.python_pool import parse_python_command
+from dashboard.utils.queues import queue_names
+from dashboard.utils.sql_slots import slot_stats
 
 
 
@@ -53,12 +58,25 @@ class JobForm(Form):
                     ('VENDOR', 'Vendor'),
                     ('VENDORQS', 'Vendor QS'),
                     ('STATARB', 'StatArb')])
+    queue = SelectField('Queue', coerce=str, choices=[], default='')
+    timeout = TextField('Timeout in seconds (bash, empty for the default)',
+            default='')
+    catchup = SelectField('Missed runs', coerce=str, default='',
+            choices=[('', 'Default'),
+                     ('all', 'Run all'),
+                     ('latest_only', 'Run the latest only'),
+                     ('skip', 'Skip the older runs')])
     tags = TextField('Tags', default='')
     subscriptions = TextField('Subscribe to Alert', default='')
     command = TextAreaField('Command', validators=[DataRequired()],
                 render_kw={"rows":5, "cols":80})
     submit = SubmitField('submit', render_kw={"class":"btn btn-primary"})
 
+    def __init__(self, *args, **kwargs):
+        Form.__init__(self, *args, **kwargs)
+        self.queue.choices = [('', 'Automatic (by tag/operator)')] + [
+                (q, q) for q in queue_names()]
+
     def add_placeholder(self, job, tags, subscriptions):
         for field in self:
             if field.type in ('CSRFTokenField', 'HiddenField'):
@@ -73,6 +91,12 @@ class JobForm(Form):
                 setattr(field, 'data', '')
             elif field.name == 'schedule_interval_crontab':
                 setattr(field, 'data', job.schedule_interval)
+            elif field.name == 'queue':
+                setattr(field, 'data', job.queue or '')
+            elif field.name == 'timeout':
+                setattr(field, 'data', job.timeout or '')
+            elif field.name == 'catchup':
+                setattr(field, 'data', job.catchup or '')
             elif field.name == 'submit':
                 continue
             else:
@@ -111,6 +135,21 @@ class JobForm(Form):
 
             job_args['weekday_to_run'] = weekday_to_run
         
+        if job_args.get('operator') == 'python':
+            try:
+                parse_python_command(job_args['command'])
+            except ValueError as e:
+                flash("Python command must be module:function followed "
+                      "by optional JSON arguments ({})".format(e))
+                return False
+
+        if job_args.get('timeout', '').strip():
+            try:
+                assert int(job_args['timeout']) > 0
+            except:
+                flash('Timeout has to be a positive number of seconds')
+                return False
+
         # validate
         for sub in subscriptions:
             if not valid_email(sub):
@@ -118,13 +157,13 @@ class JobForm(Form):
                 return False
         if len(request.form['start_dt']):
             try:
-                to_datetime(request.form['start_dt'])
+                parse_datetime(request.form['start_dt'])
             except:
                 flash("Not valid start datetime.")
                 return False
         if len(request.form['end_dt']):
             try:
-                to_datetime(request.form['end_dt'])
+                parse_datetime(request.form['end_dt'])
             except:
                 flash("Not valid end datetime")
                 return False
@@ -149,6 +188,13 @@ class RegistrationForm(Form):
             raise ValidationError('Email already registered.')
 
 
+JOB_STATUSES = sorted(Job.status_enum)
+
+def is_subscribed(emails):
+    """ whether the current user is among the already loaded
+    subscriber emails, saves a query per page """
+    return current_user.is_authenticated() and current_user.email in emails
+
 def redirect_url():
     return request.args.get('next') or \
            request.referrer or \
@@ -157,18 +203,50 @@ def redirect_url():
 @main.route('/', methods=['GET', 'POST'])
 @main.route('/index', methods=['GET', 'POST'])
 def index():
-    all_tags = [item[0] for item in RequestHandler.get_tags()]
-    all_active_jobs = RequestHandler.get_jobs(only_active=False)
-    running_tasks = RequestHandler.info_tasks(only_running=True)
-    for job in all_active_jobs:
-        job.initialize_shortcommand()
-        job.initialize_short_result()
+    # the job list itself is paged in from /api/jobs
+    all_tags = page_cache.get_or_set('tags', ['jobs'], 
+                lambda: [item[0] for item in RequestHandler.get_tags()])
+    running_tasks = page_cache.get_or_set('running_tasks', ['tasks'],
+                lambda: RequestHandler.info_tasks(only_running=True))
     return render_template('index.html', 
                 all_tags=all_tags,
-                all_active_jobs=all_active_jobs,
                 running_tasks=running_tasks)
 
 
+@main.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    """ one page of jobs, filters: tag, status, active, prefix;
+    pass after_name/after_id from `next` for the following page """
+    status = request.args.get('status') or None
+    if status is not None and status not in JOB_STATUSES:
+        return jsonify(success=False, 
+                message="status must be one of {}".format(
+                ", ".join(JOB_STATUSES))), 400
+    active = request.args.get('active')
+    if active is not None:
+        active = active.lower() in ('1', 'true', 'yes')
+    after = None
+    if request.args.get('after_name') is not None:
+        after = (request.args.get('after_name'), 
+                 request.args.get('after_id', 0, type=int))
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    tag = request.args.get('tag') or None
+    name_prefix = request.args.get('prefix') or None
+    jobs, next_page = page_cache.get_or_set(
+                'api_jobs:{}'.format(json.dumps([tag, status, active, 
+                            name_prefix, after, limit])),
+                ['jobs'],
+                lambda: RequestHandler.list_jobs(tag=tag, 
+                    status=status, active=active, name_prefix=name_prefix,
+                    after=after, limit=limit))
+    for job in jobs:
+        if job['next_run_local_ts'] is not None:
+            job['next_run_local_ts'] = str(job['next_run_local_ts'])
+    if next_page is not None:
+        next_page = {'after_name': next_page[0], 'after_id': next_page[1]}
+    return jsonify(success=True, jobs=jobs, next=next_page)
+
+
 @main.route('/jobs/new', methods=['GET', 'POST'])
 @login_required
 def add_job():
@@ -275,25 +353,108 @@ def job_operation():
 
 @main.route('/jobs/<job_name>', methods=['GET', 'POST'])
 def info_job(job_name):
-    job, tags, tasks, alerts = RequestHandler.info_job(job_name)
+    def load():
+        job, tags, tasks, alerts = RequestHandler.info_job(job_name)
+        months = archived_months(job.id) if job is not None else []
+        return job, tags, tasks, alerts, months
+    job, tags, tasks, alerts, months = page_cache.get_or_set(
+                'job:{}'.format(job_name), ['job:{}'.format(job_name)], load)
     job.initialize_shortcommand()
     job.initialize_short_result()
+    next_runs = []
+    if job.next_run_local_ts is not None:
+        next_runs = get_next_n_runs(job.schedule_interval, 
+                    job.next_run_local_ts, n=4)
     return render_template('job.html', job=job, 
                     tags=tags, tasks=tasks,
-                    alerts=alerts, 
+                    alerts=alerts, next_runs=next_runs,
+                    archived_months=months,
+                    subscribed=is_subscribed(alerts),
                     isinstance=isinstance,
                     str=unicode)
 
+@main.route('/tasks/<int:task_id>/result', methods=['GET'])
+def task_result(task_id):
+    result = RequestHandler.get_task_result(task_id)
+    if result is None:
+        return "Task {} has no result".format(task_id), 404
+    return result, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@main.route('/tasks/<int:task_id>/log', methods=['GET'])
+def tail_task_log(task_id):
+    """ poll with ?offset=<next_offset of the previous response> """
+    offset = request.args.get('offset', 0, type=int)
+    max_bytes = request.args.get('max_bytes', 64 * 1024, type=int)
+    log = RequestHandler.tail_task_log(task_id, offset, max_bytes)
+    if log is None:
+        return jsonify(success=False, 
+                message="Task {} does not exist".format(task_id)), 404
+    return jsonify(success=True, **log)
+
+@main.route('/jobs/<job_name>/archive', methods=['GET'])
+def archived_tasks(job_name):
+    """ ?month=YYYY-MM for the tasks, else the archived months """
+    month = request.args.get('month')
+    if month is not None and not valid_month(month):
+        return jsonify(success=False, 
+                message="month must be YYYY-MM"), 404
+    res = RequestHandler.get_archived_tasks(job_name, month)
+    if res is None:
+        return jsonify(success=False, 
+                message="Job {} does not exist".format(job_name)), 404
+    if month is None:
+        return jsonify(success=True, months=res)
+    return jsonify(success=True, month=month, tasks=res)
+
+@main.route('/api/cache_stats', methods=['GET'])
+def api_cache_stats():
+    """ page cache hit/miss counters """
+    return jsonify(success=True, stats=cache_stats())
+
+@main.route('/api/sql_slots', methods=['GET'])
+def api_sql_slots():
+    """ per database slot limit, slots in use and counters """
+    return jsonify(success=True, slots=slot_stats())
+
+@main.route('/api/scheduler', methods=['GET'])
+def api_scheduler():
+    """ scheduler leader, heartbeat age, lag and open problems """
+    return jsonify(success=True, scheduler=Monitor().status())
+
+@main.route('/api/shards', methods=['GET'])
+def api_shards():
+    """ live scheduler shards and the jobs each one owns """
+    return jsonify(success=True, **RequestHandler.get_shard_assignment())
+
+@main.route('/api/workers', methods=['GET'])
+def api_workers():
+    """ busy slot and task/timeout counters per worker process """
+    from dashboard.celery_worker import worker_metrics
+    return jsonify(success=True, workers=worker_metrics())
+
+@main.route('/api/tags/<tag_name>/status', methods=['GET'])
+def api_tag_status(tag_name):
+    """ number of jobs with the tag per status """
+    return jsonify(success=True, tag=tag_name, 
+                counts=RequestHandler.get_tag_status_counts(tag_name))
+
 @main.route('/tags/<tag_name>', methods=['GET', 'POST'])
 def info_tag(tag_name):
     email = request.args.get('email')
     if email is None:
-        jobs = RequestHandler.get_jobs_by_tag(only_active=False, tag_name=tag_name)
-        subscribe = RequestHandler.get_subscribed(inst_type='tag', name=tag_name)
+        jobs, subscribe = page_cache.get_or_set('tag:{}'.format(tag_name), 
+                ['jobs', 'tag:{}'.format(tag_name)],
+                lambda: (RequestHandler.get_jobs_by_tag(only_active=False, 
+                            tag_name=tag_name),
+                         RequestHandler.get_subscribed(inst_type='tag', 
+                            name=tag_name)))
         for job in jobs:
             job.initialize_shortcommand()
+        status_counts = RequestHandler.get_tag_status_counts(tag_name)
         return render_template('tag.html', tag_name=tag_name, 
-                    jobs=jobs, emails=subscribe)
+                    jobs=jobs, emails=subscribe, 
+                    subscribed=is_subscribed(subscribe),
+                    status_counts=status_counts)
     else:
         return redirect(url_for('main.edit_tag_subscription',
             action='add', name=tag_name, email=email))
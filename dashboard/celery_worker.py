@@ -1,10 +1,31 @@
 from celery import Celery
 from celery import states as celery_states
-import shlex
+from celery.signals import (task_failure, task_postrun, task_prerun,
+        task_success, worker_process_init, worker_process_shutdown)
+from datetime import datetime
+import logging
+import os
+import random
+import socket
 import subprocess
+import time
 
 from dashboard.configuration import conf
-from dashboard.utils.db import open_sql_server_session
+from dashboard.utils.db import get_redis_conn, open_sql_server_session
+from dashboard.utils.process import (TIMEOUT, CommandTimeout,
+        kill_process_group, read_output, start_command, wait_command)
+from dashboard.utils.sql_slots import sql_slot
+from dashboard.utils.task_log import TaskLogWriter
+
+logger = logging.getLogger(__name__)
+
+# workers push task state transitions here,
+# the scheduler applies them to task_instances
+TASK_EVENTS_STREAM = "dashboard/task_events"
+TASK_EVENTS_MAXLEN = 100000
+# one hash per worker process: busy slot, counters
+WORKER_METRICS_KEY = "workers/{}"
+WORKER_METRICS_EXPIRE = 24 * 3600
 
 
 
@@ -25,34 +46,242 @@ worker = Celery('dashboard', broker=conf.get('celery', 'celery_broker_url'))
 worker.conf.update(CELERY_TRACK_STARTED=True)
 worker.conf.update(CELERY_RESULT_BACKEND='redis')
 
-@worker.task
-def execute_command(command):
+# bytes read from the child per os.read
+READ_SIZE = 64 * 1024
+
+@worker.task(bind=True)
+def execute_command(self, command, timeout=None):
+    """ Run command and stream its output to the task log in chunks,
+    only the head and tail are kept in memory and returned.
+
+    The command's process group is killed after timeout seconds (the
+    job's, else [bash_operator] timeout, 0 for none) and the task
+    ends in the TIMEOUT state. """
+    timeout = timeout or conf.getint('bash_operator', 'timeout')
+    deadline = time.time() + timeout if timeout else None
+    log = TaskLogWriter(self.request.id)
+    proc = start_command(command, shell=True,
+            max_memory_mb=conf.getint('bash_operator', 'max_memory_mb'),
+            max_cpu_seconds=conf.getint('bash_operator', 'max_cpu_seconds'))
     try:
-        # WARNING! 
-        # may not migrate to linux
-        cmd_lst = shlex.split(command, posix=False)
-        return subprocess.check_output(cmd_lst, shell=True)
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError('Celery command failed\n{}'.format(e))
+        while True:
+            data = read_output(proc, READ_SIZE, deadline)
+            if not data:
+                break
+            log.write(data)
+        # stdout can close before the command exits
+        returncode = wait_command(proc, deadline)
+    except CommandTimeout:
+        kill_process_group(proc,
+                grace=conf.getint('bash_operator', 'kill_grace'))
+        _count_worker_metric('timeouts')
+        raise CommandTimeout('Celery command timed out after {} seconds'
+                '\n{}'.format(timeout, log.summary()))
+    finally:
+        proc.stdout.close()
+        log.close()
+    if returncode:
+        e = subprocess.CalledProcessError(returncode, command)
+        raise RuntimeError('Celery command failed\n{}\n{}'.format(
+                    e, log.summary()))
+    return log.summary()
 
 @worker.task
-def execute_sql(sql, database):
+def execute_python(command):
+    """ Run a `module:function [json args]` command in this worker's
+    pool of warm interpreter processes. """
+    from dashboard.utils.python_pool import get_python_pool
+    result = get_python_pool().run(command,
+            timeout=conf.getint('python_operator', 'timeout'))
+    # same pass convention as sql checks
+    return "1" if result is None else result
+
+
+def summarize_query(cursor, preview_rows=20, max_bytes=65536, 
+                fetch_size=500):
+    """ Read a check query's rows with fetchmany and summarize them.
+
+    No row means the check passed ("1"), a single row is returned
+    as its values joined by ", ". With more rows the check failed:
+    reading stops once preview_rows rows or max_bytes characters are
+    in, and the summary has the row count (with '+' when rows were
+    left unread), the column names and the preview rows. Every
+    summary is cut to max_bytes characters.
+    """
+    lines = []
+    size = 0
+    more = False
+    while not more:
+        chunk = cursor.fetchmany(min(fetch_size, preview_rows + 1 - len(lines)))
+        if not chunk:
+            break
+        for row in chunk:
+            if len(lines) == preview_rows or size > max_bytes:
+                # failed either way, leave the rest on the server
+                more = True
+                break
+            lines.append(", ".join(str(i) for i in row))
+            size += len(lines[-1]) + 1
+    if len(lines) == 0:
+        return "1"
+    if len(lines) == 1 and not more:
+        summary = lines[0]
+    else:
+        columns = [c[0] for c in cursor.description or ()]
+        summary = "sql query output ({}{} rows, columns: {}):\n{}".format(
+                len(lines), '+' if more else '', ", ".join(columns),
+                "\n".join(lines))
+    if len(summary) > max_bytes:
+        summary = summary[:max_bytes - 3] + '...'
+    return summary
+
+
+@worker.task(bind=True, max_retries=None)
+def execute_sql(self, sql, database):
+    database = database.upper()
+    with sql_slot(database, self.request.id) as acquired:
+        if not acquired:
+            # the server is busy, come back later instead of piling on
+            if self.request.retries >= conf.getint('sql_slots', 'max_defers'):
+                raise RuntimeError('Celery sql query failed\n'
+                        'no free slot for database {} after {} tries'.format(
+                        database, self.request.retries))
+            defer = conf.getint('sql_slots', 'defer')
+            raise self.retry(countdown=defer + random.uniform(0, defer))
+        return _run_sql(sql, database)
+
+
+def _run_sql(sql, database):
     try:
         # this is dev 
-        with open_sql_server_session(database.upper()) as cursor:
-            res = cursor.execute(sql).fetchall()
-            if len(res) == 1:
-                res = ", ".join([str(i) for i in res[0]])
-                return res
-            elif len(res) == 0:
-                return "1"
-            else:
-                return "sql query output: {}".format(res)
+        with open_sql_server_session(database) as cursor:
+            cursor.execute(sql)
+            return summarize_query(cursor, 
+                    preview_rows=conf.getint('sql_check', 'preview_rows'),
+                    max_bytes=conf.getint('sql_check', 'max_bytes'),
+                    fetch_size=conf.getint('sql_check', 'fetch_size'))
     except Exception as e:
         e = "passed sql query {}\n".format(sql) + str(e)
         raise RuntimeError('Celery sql query failed\n{}'.format(e))
 
 
+def get_task_metas(task_ids):
+    """ Fetch status and result for many tasks at once.
+
+    Uses a single MGET on the result backend when it supports it,
+    otherwise falls back to one AsyncResult per task. Returns
+    {task_id: {'status': ..., 'result': ...}}.
+    """
+    backend = worker.backend
+    metas = {}
+    if not task_ids:
+        return metas
+    if not hasattr(backend, 'mget'):
+        for task_id in task_ids:
+            res = worker.AsyncResult(task_id)
+            metas[task_id] = {'status': res.status, 'result': res.result}
+        return metas
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    for task_id, value in zip(task_ids, backend.mget(keys)):
+        if value is None:
+            metas[task_id] = {'status': celery_states.PENDING, 'result': None}
+        else:
+            meta = backend.decode_result(value)
+            metas[task_id] = {'status': meta['status'], 
+                              'result': meta['result']}
+    return metas
+
+
+def publish_task_event(task_id, state, result=None):
+    fields = {'task_id': task_id,
+              'state': state,
+              'ts': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')}
+    if result is not None:
+        if isinstance(result, bytes):
+            result = result.decode(errors='replace')
+        fields['result'] = str(result)[:conf.getint('task_result', 'max_size')]
+    try:
+        get_redis_conn().xadd(TASK_EVENTS_STREAM, fields,
+                maxlen=TASK_EVENTS_MAXLEN, approximate=True)
+    except Exception:
+        # scheduler falls back to polling the result backend
+        logger.exception("Cannot publish {} event for task {}".format(
+                    state, task_id))
+
+
+@task_prerun.connect
+def _publish_task_started(task_id=None, **kwargs):
+    publish_task_event(task_id, celery_states.STARTED)
+    _set_worker_metrics(busy=1, task_id=task_id)
+
+
+@task_postrun.connect
+def _free_worker_slot(task_id=None, **kwargs):
+    _set_worker_metrics(busy=0, task_id='')
+    _count_worker_metric('tasks')
+
+
+@task_success.connect
+def _publish_task_succeeded(sender=None, result=None, **kwargs):
+    publish_task_event(sender.request.id, celery_states.SUCCESS, result)
+
+
+@task_failure.connect
+def _publish_task_failed(task_id=None, exception=None, **kwargs):
+    state = celery_states.FAILURE
+    if isinstance(exception, CommandTimeout):
+        state = TIMEOUT
+    publish_task_event(task_id, state, exception)
+
+
+def _worker_field():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def _set_worker_metrics(**values):
+    """ this process's slot in the WORKER_METRICS_KEY hash """
+    key = WORKER_METRICS_KEY.format(_worker_field())
+    values['last_seen'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
+    try:
+        tx = get_redis_conn().pipeline()
+        for k, v in values.items():
+            tx.hset(key, k, v)
+        tx.expire(key, WORKER_METRICS_EXPIRE)
+        tx.execute()
+    except Exception:
+        logger.exception("Cannot update worker metrics")
+
+
+def _count_worker_metric(name):
+    try:
+        get_redis_conn().hincrby(WORKER_METRICS_KEY.format(_worker_field()),
+                name, 1)
+    except Exception:
+        logger.exception("Cannot update worker metrics")
+
+
+def worker_metrics():
+    """ {'<host>:<pid>': {'busy', 'task_id', 'tasks', 'timeouts',
+    'last_seen'}} of worker processes seen in the last day """
+    redis_conn = get_redis_conn()
+    prefix = WORKER_METRICS_KEY.format('')
+    return {key.decode()[len(prefix):]: redis_conn.hgetall(key)
+            for key in redis_conn.scan_iter(match=prefix + '*')}
+
+
+@worker_process_init.connect
+def _warm_up_sql_pools(**kwargs):
+    from dashboard.utils.sql_pool import warm_up
+    warm_up()
+
+
+@worker_process_shutdown.connect
+def _close_sql_pools(**kwargs):
+    from dashboard.utils.sql_pool import close_all, remove_stats
+    close_all()
+    remove_stats()
+
+
 # @worker.task
 # def execute_func(func, args):
 #     return func(args)
\ No newline at end of file
@@ -3,9 +3,7 @@ from datetime import datetime, timedelta
 import logging
 import sys
 
-from dashboard.utils.db import get_redis_conn
-from dashboard.manager import manager
-from dashboard.models import RequestHandler, ScheduleManager 
+from dashboard.models import Monitor, RequestHandler, ScheduleManager 
 
 logger = logging.getLogger('dashboard')
 logger.setLevel(logging.DEBUG)
@@ -20,18 +18,41 @@ logger.addHandler(ch)
 
 def start_schedule_manager(args):
     logger.info("start scheduler")
-    sched = ScheduleManager()
-    # should have a graceful interrupt handler
-    # to catch sigint...
+    sched = ScheduleManager(shard_name=args.shard)
     try:
-        sched.start()
-    except:
-        conn = get_redis_conn()
-        conn.delete(ScheduleManager.name)
-        raise
+        if args.mode == 'timer':
+            sched.start_timer(poll_interval=args.poll_interval)
+        else:
+            sched.start(poll_interval=args.poll_interval)
+    finally:
+        # others take over now instead of when the leases expire
+        sched.lease.release()
+        if sched.shards is not None:
+            sched.shards.leave()
+
+def start_worker(args):
+    from dashboard.celery_worker import worker
+    from dashboard.utils.queues import worker_options
+    queues = [q.strip() for q in args.queues.split(',')]
+    concurrency, prefetch, pool = worker_options(queues[0])
+    worker.worker_main(['worker', '-Q', ','.join(queues),
+            '-c', str(args.concurrency or concurrency),
+            '--prefetch-multiplier', str(args.prefetch or prefetch),
+            '-P', args.pool or pool,
+            '-n', '{}@%h'.format('+'.join(queues)),
+            '-l', args.loglevel])
+
+def start_monitor(args):
+    Monitor().start()
+
+def start_alert_dispatcher(args):
+    from dashboard.alerts import AlertDispatcher
+    AlertDispatcher().start()
 
 # # will have to add command...
 def start_web_server(args):
+    # deferred, builds the flask app
+    from dashboard.manager import manager
     # manager.run() 
     pass
 
@@ -61,6 +82,32 @@ def clear_db_func(args):
         else:
             logger.info("Clear db aborted.")
 
+def init_db_func(args):
+    from dashboard.migrations import upgrade
+    from dashboard.models import init_db
+    init_db()
+    upgrade()
+
+def migrate_db_func(args):
+    from dashboard.migrations import upgrade
+    upgrade()
+
+def prune_func(args):
+    from dashboard.retention import prune_task_history
+    prune_task_history()
+
+def reindex_func(args):
+    RequestHandler.rebuild_live_indexes()
+
+def backfill_func(args):
+    RequestHandler.backfill_job(args.job, args.start, args.end)
+
+def shards_func(args):
+    logger.info(RequestHandler.get_shard_assignment())
+
+def retention_func(args):
+    RequestHandler.set_retention_policy(args.scope, args.name, args.days)
+
 def main():
     parser = argparse.ArgumentParser()
     subparser = parser.add_subparsers()
@@ -89,6 +136,45 @@ def main():
     clear_db.add_argument("-s", "--sql", help="clear sql db", action='store_true')
     clear_db.set_defaults(func=clear_db_func)
 
+    # create tables
+    init_db = subparser.add_parser("init-db")
+    init_db.set_defaults(func=init_db_func)
+
+    # migrate db
+    migrate_db = subparser.add_parser("migrate")
+    migrate_db.set_defaults(func=migrate_db_func)
+
+    # archive and delete old task history
+    prune = subparser.add_parser("prune")
+    prune.set_defaults(func=prune_func)
+
+    # which scheduler shard owns which jobs
+    shards = subparser.add_parser("shards")
+    shards.set_defaults(func=shards_func)
+
+    # run a job for past schedule slots
+    backfill = subparser.add_parser("backfill")
+    backfill.add_argument("-j", "--job", required=True, help="job name")
+    backfill.add_argument("-f", "--from", dest="start", required=True,
+                            help="first run, job's local time")
+    backfill.add_argument("-t", "--to", dest="end", required=True,
+                            help="last run, job's local time")
+    backfill.set_defaults(func=backfill_func)
+
+    # retention policy
+    retention = subparser.add_parser("retention")
+    retention.add_argument("-s", "--scope", choices=["job", "tag"], default="job")
+    retention.add_argument("-n", "--name", required=True, 
+                            help="job or tag name")
+    retention.add_argument("-d", "--days", type=int, default=None,
+                            help="days of task history to keep, "
+                            "omit to remove the policy")
+    retention.set_defaults(func=retention_func)
+
+    # rebuild redis indexes from sql
+    reindex = subparser.add_parser("reindex")
+    reindex.set_defaults(func=reindex_func)
+
     # job info 
     job_info = subparser.add_parser("info")
     job_info.add_argument("-a", "--all", help="get all job names", 
@@ -101,8 +187,36 @@ def main():
 
     # start scheduler 
     start_scheduler = subparser.add_parser("start")
+    start_scheduler.add_argument("-m", "--mode", choices=["poll", "timer"],
+                            default="poll", help="poll db every poll interval, "
+                            "or sleep until the next job is due (timer)")
+    start_scheduler.add_argument("-p", "--poll_interval", type=int, default=20)
+    start_scheduler.add_argument("-s", "--shard", default=None,
+                            help="stable name of this scheduler when "
+                                 "sharding is enabled")
     start_scheduler.set_defaults(func=start_schedule_manager)        
 
+    # celery worker bound to queues
+    start_celery_worker = subparser.add_parser("worker")
+    start_celery_worker.add_argument("-q", "--queues", default="default",
+                            help="comma separated queues to consume")
+    start_celery_worker.add_argument("-c", "--concurrency", type=int, 
+                            default=None, help="default from [queues]")
+    start_celery_worker.add_argument("--prefetch", type=int, default=None,
+                            help="prefetch multiplier, default from [queues]")
+    start_celery_worker.add_argument("-P", "--pool", default=None,
+                            help="celery pool, default from [queues]")
+    start_celery_worker.add_argument("-l", "--loglevel", default="info")
+    start_celery_worker.set_defaults(func=start_worker)
+
+    # watch the scheduler's lease, heartbeat and lag
+    monitor = subparser.add_parser("monitor")
+    monitor.set_defaults(func=start_monitor)
+
+    # mail failure alerts
+    start_alerts = subparser.add_parser("alerts")
+    start_alerts.set_defaults(func=start_alert_dispatcher)
+
     # start web server 
     start_web = subparser.add_parser("webserver")
     start_web.set_defaults(func=start_web_server)
@@ -16,15 +16,169 @@ celery_result_url = redis://localhost:6379/0
 [manager]
 logger = None
 send_heart_beat = redis://localhost:6379/0
+# poll: ask the result backend for every outstanding task
+# stream: apply state events pushed by workers
+task_state_source = stream
+# in stream mode, still poll the result backend this often (seconds)
+# to recover tasks whose events were lost
+task_state_reconcile_interval = 600
+# seconds a task event waits for its task to be committed before
+# it is dropped
+task_event_max_age = 3600
+# seconds an event stays pending on another consumer before it is
+# taken over, e.g. from a stopped shard member; keep it above the
+# scheduler's poll interval (cli.py start -p)
+task_event_claim_idle = 60
+# runs missed while the scheduler was down, unless the job sets its own:
+# all: run every missed slot, latest_only: run the last one,
+# skip: drop the slots before the latest one, which runs as usual
+catchup = all
+# missed runs created per job and pass, the rest follow next pass
+catchup_max_runs = 500
+# catch-up and backfill tasks of one job sent to celery at once,
+# the others wait in task_instances as SCHEDULED
+catchup_concurrency = 4
+# seconds a scheduler keeps the leader lease without renewing it,
+# standby schedulers take over within about this long
+lease_ttl = 10
+# seconds without progress of the main loop (e.g. stuck on a db lock)
+# after which the leader gives its lease up and a shard member leaves,
+# 0 to keep them as long as the process runs
+lease_max_stall = 300
+
+[sharding]
+# run several schedulers that each schedule and poll the state of
+# their own part of the jobs, start each with cli.py start -s <name>
+enabled = False
+# virtual nodes per scheduler on the consistent hash ring
+replicas = 64
+# tag_<tag> = <name> pins jobs with the tag to the named scheduler
+# while it is running
+
+[queues]
+# queues offered in the job form, start workers with
+# cli.py worker -q <queue>
+names = default,bash,sql,python,priority
+default = default
+# a queue set on the job wins, then tag_<tag> = <queue> rules,
+# then operator_<operator> = <queue> rules, then the default queue
+operator_bash = bash
+operator_sql = sql
+operator_python = python
+# worker concurrency and prefetch multiplier,
+# override per queue with concurrency_<queue>/prefetch_<queue>
+concurrency = 4
+prefetch = 4
+concurrency_sql = 8
+# long bash tasks should not hold back reserved ones
+prefetch_bash = 1
+prefetch_priority = 1
+# celery pool per queue, the python queue forks its own processes
+pool = prefork
+pool_python = threads
+
+[bash_operator]
+# seconds before a command's process group is killed and the task
+# ends as TIMEOUT, 0 for none; a job's own timeout wins
+timeout = 0
+# seconds between SIGTERM and SIGKILL of a timed out command
+kill_grace = 5
+# rlimits of the command's processes (posix), 0 for none
+max_memory_mb = 0
+max_cpu_seconds = 0
+
+[python_operator]
+# warm interpreter processes per worker
+pool_size = 4
+# imported once by every pool process
+preload = pandas, numpy
+# a process is replaced after this many calls
+max_tasks_per_child = 100
+# seconds before a call is killed
+timeout = 3600
+
+[task_log]
+# command output is kept in redis as compressed chunks,
+# only the last max_chunks chunks of each task are kept
+chunk_size = 65536
+max_chunks = 16
+# seconds before a partial chunk is flushed for live tailing
+flush_interval = 2
+expire_days = 7
+
+[task_result]
+# results longer than summary_size are stored compressed in
+# task_results, task_instances only keeps the summary
+summary_size = 200
+# zlib or zstd (needs the zstandard package)
+codec = zlib
+# largest result a worker publishes with its task event
+max_size = 16777216
+
+[retention]
+# days of finished task history kept when neither the job nor one of
+# its tags has a retention policy
+default_days = 90
+archive_dir = {DASHBOARD_HOME}/archive
+# rows per DELETE statement
+chunk_size = 1000
+# seconds between two pruning runs of the scheduler
+prune_interval = 3600
+
+[alerts]
+# failure alerts queued within digest_window seconds of the first
+# one are mailed together, one digest per recipient
+digest_window = 30
+max_batch = 1000
+# seconds the dispatcher keeps an unused smtp connection
+smtp_idle_timeout = 60
+# a failed send is retried on a new connection, smtp_retry_delay
+# more seconds apart each time
+smtp_retries = 2
+smtp_retry_delay = 2
+# alerts of a digest that still failed are requeued for the next
+# round, and dropped after max_attempts rounds (about an hour)
+max_attempts = 120
+
+[cache]
+# index, tag and job pages are cached in redis until a write bumps
+# the version of a job, tag or the task list they show
+enabled = True
+# seconds, also bounds staleness if a version bump is lost
+ttl = 600
 
 [monitor]
 logger = None
+# seconds between two checks of cli.py monitor
+interval = 15
+# alert when the scheduler's last pass is older than this (seconds),
+# keep it above the scheduler's poll interval
+max_heartbeat_age = 60
+# alert when an active job is overdue by more than this (seconds)
+max_lag = 300
+# repeat an alert that is not resolved after this many seconds
+realert_interval = 1800
+# comma separated, empty only logs
+alert_to = 
 
 [webserver]
 database = sqlite:///{DASHBOARD_HOME}/dashboard_web.sqlite
 webserver_host = 0.0.0.0
 web_server_port = 5000
 
+[sql_pool]
+# per worker process connections to the [database] databases
+# pyodbc, or sqlite3 with the databases set to file paths
+driver = pyodbc
+# idle connections kept per database and worker process
+size = 4
+# seconds before an idle connection is closed
+max_idle = 600
+# idle seconds after which a connection is checked before reuse
+ping_after = 30
+# databases connected to when a worker process starts
+warmup = 
+
 [database]
 # Since all those databases connections are read-only
 # I will simply use production db for test
@@ -42,6 +196,26 @@ EMBS = DALSCDATA1
 EMBSHIST = DALSCDATA1
 VENDORSC = DALSCDATA1
 
+[sql_slots]
+# sql tasks running at once per database, add <DATABASE> = n
+# to override the default for one server
+default = 4
+# seconds a slot is held at most if its worker dies, extended
+# while the query runs
+lease = 900
+# a task without a slot is retried after defer to 2 * defer seconds,
+# and fails after max_defers tries
+defer = 30
+max_defers = 120
+
+[sql_check]
+# a check passes with no row or a single row starting with 1, so at
+# most preview_rows + 1 rows are read, fetch_size rows at a time
+preview_rows = 20
+fetch_size = 500
+# longest result stored for a failed check
+max_bytes = 65536
+
 [smtp]
 mail_server = smtpmail.hbk.com
 mail_port = 25
@@ -58,10 +232,12 @@ def mkdir_p(path):
             pass
         else:
             raise
-# create 
 relative = os.path.join('~', 'sandbox', 'dashboard')
 DASHBOARD_HOME =  os.path.expanduser(os.path.expandvars(relative))
-mkdir_p(DASHBOARD_HOME)
+
+def ensure_dashboard_home():
+    """ create DASHBOARD_HOME when something is about to write there """
+    mkdir_p(DASHBOARD_HOME)
 
 
 
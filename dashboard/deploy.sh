@@ -1,5 +1,11 @@
 redis-server # should be able to customize port and db
-celery worker -A celery_hook --log-level=debug 
+# one worker per queue, a plain celery worker only consumes the
+# "celery" queue; pool, concurrency and prefetch come from [queues]
+python cli.py worker -q default -l debug &
+python cli.py worker -q priority -l debug &
+python cli.py worker -q bash -l debug &
+python cli.py worker -q sql -l debug &
+python cli.py worker -q python -l debug &
 
 # for debug
 # redis-cli 
@@ -0,0 +1,128 @@
+""" Schema migrations for existing webserver databases.
+
+`Base.metadata.create_all` only creates missing tables, so columns
+added to existing tables are handled here. Every migration is
+idempotent and can be re-run safely.
+"""
+import logging
+
+from sqlalchemy import inspect, select, text
+
+from dashboard.models import Job, RetentionPolicy, TaskResult
+from dashboard.utils.date import convert_to_utc
+from dashboard.utils.db import get_engine
+
+logger = logging.getLogger(__name__)
+
+
+def _has_column(table, column):
+    columns = inspect(get_engine()).get_columns(table)
+    return column in [c['name'] for c in columns]
+
+
+def _has_index(table, index):
+    indexes = inspect(get_engine()).get_indexes(table)
+    return index in [i['name'] for i in indexes]
+
+
+def add_next_run_utc():
+    """ add indexed jobs.next_run_utc and backfill it from
+    next_run_local_ts and timezone """
+    jobs = Job.__table__
+    with get_engine().begin() as conn:
+        if not _has_column('jobs', 'next_run_utc'):
+            logger.info("add column jobs.next_run_utc")
+            conn.execute(text(
+                "ALTER TABLE jobs ADD COLUMN next_run_utc DATETIME"))
+        if not _has_index('jobs', 'ix_jobs_next_run_utc'):
+            logger.info("add index ix_jobs_next_run_utc")
+            conn.execute(text(
+                "CREATE INDEX ix_jobs_next_run_utc ON jobs (next_run_utc)"))
+
+        # only the columns used here, later migrations add the others
+        rows = conn.execute(select([jobs.c.id, jobs.c.next_run_local_ts,
+                jobs.c.timezone]).where(jobs.c.next_run_utc == None).where(
+                jobs.c.next_run_local_ts != None)).fetchall()
+        for job_id, next_run_local_ts, timezone in rows:
+            conn.execute(jobs.update().where(jobs.c.id == job_id).values(
+                    next_run_utc=convert_to_utc(next_run_local_ts, timezone)))
+    logger.info("backfilled next_run_utc for {} jobs".format(len(rows)))
+
+
+def add_task_instance_timestamps():
+    """ add task_instances.started_at/finished_at filled from task
+    state events, and an index on task_id used to apply them """
+    with get_engine().begin() as conn:
+        for column in ('started_at', 'finished_at'):
+            if not _has_column('task_instances', column):
+                logger.info("add column task_instances.{}".format(column))
+                conn.execute(text("ALTER TABLE task_instances "
+                        "ADD COLUMN {} DATETIME".format(column)))
+        if not _has_index('task_instances', 'ix_task_instances_task_id'):
+            logger.info("add index ix_task_instances_task_id")
+            conn.execute(text("CREATE INDEX ix_task_instances_task_id "
+                        "ON task_instances (task_id)"))
+
+
+def add_task_results():
+    """ add the task_results blob table and task_instances.result_digest """
+    TaskResult.__table__.create(bind=get_engine(), checkfirst=True)
+    with get_engine().begin() as conn:
+        if not _has_column('task_instances', 'result_digest'):
+            logger.info("add column task_instances.result_digest")
+            conn.execute(text("ALTER TABLE task_instances "
+                        "ADD COLUMN result_digest VARCHAR(64)"))
+
+
+def add_retention():
+    """ add retention_policies and the task_instances index used to
+    find old tasks of a job """
+    RetentionPolicy.__table__.create(bind=get_engine(), checkfirst=True)
+    with get_engine().begin() as conn:
+        if not _has_index('task_instances', 
+                'ix_task_instances_job_id_execution_date'):
+            logger.info("add index ix_task_instances_job_id_execution_date")
+            conn.execute(text(
+                "CREATE INDEX ix_task_instances_job_id_execution_date "
+                "ON task_instances (job_id, execution_date)"))
+
+
+def add_job_queue():
+    """ add jobs.queue, the celery queue picked for the job """
+    with get_engine().begin() as conn:
+        if not _has_column('jobs', 'queue'):
+            logger.info("add column jobs.queue")
+            conn.execute(text("ALTER TABLE jobs ADD COLUMN queue VARCHAR(50)"))
+
+
+def add_job_timeout():
+    """ add jobs.timeout, seconds before a bash task is killed """
+    with get_engine().begin() as conn:
+        if not _has_column('jobs', 'timeout'):
+            logger.info("add column jobs.timeout")
+            conn.execute(text("ALTER TABLE jobs ADD COLUMN timeout INTEGER"))
+
+
+def add_job_catchup():
+    """ add jobs.catchup, the job's policy for missed runs """
+    with get_engine().begin() as conn:
+        if not _has_column('jobs', 'catchup'):
+            logger.info("add column jobs.catchup")
+            conn.execute(text("ALTER TABLE jobs ADD COLUMN catchup VARCHAR(20)"))
+
+
+MIGRATIONS = [
+    add_next_run_utc,
+    add_task_instance_timestamps,
+    add_task_results,
+    add_retention,
+    add_job_queue,
+    add_job_timeout,
+    add_job_catchup,
+]
+
+
+def upgrade():
+    for migration in MIGRATIONS:
+        logger.info("run migration {}".format(migration.__name__))
+        migration()
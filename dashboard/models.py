@@ -2,27 +2,50 @@ from collections import defaultdict
 from datetime import datetime, timedelta, time
 import functools
 import logging
-import pandas as pd 
 from time import sleep
+import time as time_module
 
 from sqlalchemy import (
-        Column, Integer, String, DateTime, Text, Boolean, Float, Unicode)
-from sqlalchemy import func, or_, and_
+        Column, Integer, String, DateTime, Text, Boolean, Float, Unicode,
+        LargeBinary)
+from sqlalchemy import func, or_, and_, literal, true, Index
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import reconstructor, relationship, synonym
 
+from celery import states as celery_states
+from celery.utils import uuid
+
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from dashboard.celery_worker import execute_command, execute_sql
-from dashboard.utils.date import (convert_to_utc, 
-        get_cron_schedule_interval, get_next_run_ts)
-from dashboard.utils.db import (engine, get_redis_conn, 
+from dashboard.alerts import RECIPIENTS_ENTITY, RecipientsMap, enqueue_alert
+from dashboard.configuration import conf
+from dashboard.utils.date import (convert_to_local, convert_to_utc, 
+        parse_datetime, get_cron_schedule_interval, get_next_run_ts, get_next_run_ts_bulk,
+        get_runs_between)
+from dashboard.utils.db import (get_engine, get_redis_conn, 
         provide_session, get_sql_session)
+from dashboard.utils import live_index
+from dashboard.utils.cache import bump_versions, job_entities
+from dashboard.utils.blobs import (compress, content_digest, 
+        decompress, resolve_codec)
 from dashboard.utils.emails import send_email, valid_email
+from dashboard.utils.leader import LeaderLease, lease_holder
+from dashboard.utils import sharding
+from dashboard.utils.sharding import JobAssigner, ShardMembership
+from dashboard.utils.process import TIMEOUT, is_timeout
+from dashboard.utils.queues import resolve_queue, tag_rules
+from dashboard.utils.task_log import read_task_log
+from dashboard.utils.timer import TimerQueue
 
 
 Base = declarative_base()
 ID_LEN = 250
+# celery's finished states plus bash tasks killed by their timeout
+FINISHED_STATES = celery_states.READY_STATES | frozenset([TIMEOUT])
+# catch-up and backfill tasks waiting to be sent to celery
+SCHEDULED = "SCHEDULED"
+# sent and not finished; RETRY is a sql task deferred for a db slot
+RUNNING_STATES = ("PENDING", "STARTED", "RETRY")
 logger = logging.getLogger(__name__)
 
 
@@ -40,8 +63,18 @@ class TaskInstance(Base):
     operator = Column(String(1000))
     command = Column(String(1000), nullable=False)
     state = Column(String(20))
-    task_id = Column(String(ID_LEN))
-    result = Column(String(1000))
+    task_id = Column(String(ID_LEN), index=True)
+    result = Column(String(1000))    # summary, see result_digest
+    # full output in task_results when it does not fit in the summary
+    result_digest = Column(String(64), nullable=True)
+    started_at = Column(DateTime, nullable=True)    # utc
+    finished_at = Column(DateTime, nullable=True)    # utc
+
+    __table_args__ = (
+        # job page and retention pruning
+        Index('ix_task_instances_job_id_execution_date', 
+                'job_id', 'execution_date'),
+    )
 
     def __init__(self, job, execution_date=None):
         self.job_id = job.id 
@@ -52,6 +85,22 @@ class TaskInstance(Base):
         self.state = 'PENDING'
         self.task_id = None
         self.result = None
+        self.result_digest = None
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def insert_scheduled(cls, session, job, execution_dates):
+        """ SCHEDULED tasks of job in one executemany INSERT, their
+        celery task ids are assigned here and used when sent """
+        if not execution_dates:
+            return
+        session.execute(cls.__table__.insert(), [
+                {'job_id': job.id, 'job_name': job.name, 
+                 'execution_date': ts, 'operator': job.operator, 
+                 'command': job.command, 'state': SCHEDULED,
+                 'task_id': uuid()}
+                for ts in execution_dates])
 
     def __eq__(self, other):
         return ((self.job_name, self.execution_date) == 
@@ -69,6 +118,41 @@ class TaskInstance(Base):
                 self.job_id, self.command, self.execute_ts, self.status)
 
 
+class TaskResult(Base):
+    """ Compressed full task output, content addressed so identical
+    outputs of different runs are stored once. """
+    __tablename__ = 'task_results'
+    digest = Column(String(64), primary_key=True)
+    codec = Column(String(10))
+    size = Column(Integer)    # uncompressed bytes
+    data = Column(LargeBinary)
+    created_at = Column(DateTime)
+
+    @classmethod
+    def store(cls, session, text):
+        """ save text if no identical blob exists, returns its digest """
+        raw = text.encode('utf-8')
+        digest = content_digest(raw)
+        # sessions do not autoflush, a blob added earlier in the same
+        # batch is only in session.new
+        if any(isinstance(obj, cls) and obj.digest == digest 
+                for obj in session.new):
+            return digest
+        if session.query(cls.digest).filter(cls.digest==digest).first():
+            return digest
+        codec = resolve_codec(conf.get('task_result', 'codec'))
+        session.add(cls(digest=digest, codec=codec, size=len(raw), 
+                data=compress(raw, codec), created_at=datetime.utcnow()))
+        return digest
+
+    def text(self):
+        return decompress(self.data, self.codec).decode('utf-8')
+
+    def __repr__(self):
+        return "<TaskResult(digest={}, size={})>".format(
+                self.digest, self.size)
+
+
 @functools.total_ordering
 class Job(Base):
     __tablename__ = "jobs"
@@ -89,8 +173,18 @@ class Job(Base):
 
     operator = Column(String(10)) # bash, python, sql, etc
     database = Column(String(20), nullable=True)
+    # celery queue, None routes by tag/operator rules
+    queue = Column(String(50), nullable=True)
+    # seconds before a bash task is killed, None uses [bash_operator]
+    timeout = Column(Integer, nullable=True)
+    # policy for runs missed while the scheduler was down, one of
+    # CATCHUP_POLICIES, None uses [manager] catchup
+    catchup = Column(String(20), nullable=True)
     command = Column(String)
-    next_run_local_ts = Column(DateTime)    # local dt
+    _next_run_local_ts = Column('next_run_local_ts', DateTime)    # local dt
+    # utc copy of next_run_local_ts, kept in sync by the synonym
+    # below so the scheduler can ask db only for due jobs
+    next_run_utc = Column(DateTime, index=True)
     last_execution_ts = Column(DateTime, nullable=True)
     last_task_result = Column(String(1000))
     status = Column(Integer)
@@ -102,6 +196,8 @@ class Job(Base):
                 1: 'success',
                 2: 'unknown'}
 
+    CATCHUP_POLICIES = ('all', 'latest_only', 'skip')
+
     def __init__(self, name, timezone, 
                 start_dt, end_dt, 
                 schedule_interval,
@@ -110,22 +206,21 @@ class Job(Base):
                 reset_status_at,
                 operator, database,
                 command, active=True,
-                block_till=None, block_by=None, **kwargs):
+                block_till=None, block_by=None, queue=None, timeout=None,
+                catchup=None, **kwargs):
         self.name = name
         self.timezone = timezone
         self.update_time = datetime.utcnow()
 
         if start_dt is None or start_dt == '':
-            self.start_dt = pd.to_datetime(datetime.utcnow()
-                ).tz_localize('UTC').astimezone(timezone
-                ).replace(tzinfo=None)
+            self.start_dt = convert_to_local(datetime.utcnow(), timezone)
         else:
-            self.start_dt = pd.to_datetime(start_dt)
+            self.start_dt = parse_datetime(start_dt)
 
         if end_dt is None or end_dt == '':
             self.end_dt = None 
         else:
-            self.end_dt = pd.to_datetime(self.end_dt)
+            self.end_dt = parse_datetime(end_dt)
 
         self.active = active
         self.block_till = block_till
@@ -138,50 +233,131 @@ class Job(Base):
             self.schedule_interval = get_cron_schedule_interval(
                     schedule_interval, self.start_dt, weekday_to_run)
 
-        self.reset_status_at = pd.to_datetime(reset_status_at)
+        self.reset_status_at = parse_datetime(reset_status_at)
         self.operator = operator
         self.database = database
         self.command = command
+        self.queue = queue or None
+        self.timeout = int(timeout) if timeout not in (None, '') else None
+        self.catchup = catchup or None
 
         self.next_run_local_ts = self.start_dt
         self.status = self.status_enum['unknown']
 
+    def _get_next_run_local_ts(self):
+        return self._next_run_local_ts
+
+    def _set_next_run_local_ts(self, ts):
+        self._next_run_local_ts = ts
+        if ts is None:
+            self.next_run_utc = None
+        else:
+            self.next_run_utc = convert_to_utc(ts, self.timezone)
+
+    next_run_local_ts = synonym('_next_run_local_ts',
+            descriptor=property(_get_next_run_local_ts,
+                                _set_next_run_local_ts))
+
     def set_status(self, session, status='unknown'):
         self.status = self.status_enum.get(status, 
                         self.status_enum['unknown'])
         session.commit()
 
-    def schedule_task(self, session, force_run=False):
+    def schedule_task(self, session, force_run=False, next_run=None,
+                tags=None, rules=None):
+        """ next_run: precomputed next run after next_run_local_ts,
+        e.g. from get_next_run_ts_bulk; tags and queue rules
+        (tag_rules()) can be passed in when scheduling many jobs """
         if force_run:
             # orig_next_run = self.next_run_local_ts
             utcnow = datetime.utcnow()
-            current_run = pd.to_datetime(utcnow
-                ).tz_localize('UTC').astimezone(self.timezone
-                ).replace(tzinfo=None)
+            current_run = convert_to_local(utcnow, self.timezone)
             task = TaskInstance(job=self, execution_date=current_run)
             logger.info("schedule task for job {} at utc {}".format(
                         self.name, utcnow))
 
         else:
-            if datetime.utcnow() < convert_to_utc(
-                    self.next_run_local_ts, self.timezone):
+            if (self.next_run_utc is None or 
+                    datetime.utcnow() < self.next_run_utc):
                 return None
             task = TaskInstance(job=self)
-        if task.operator == 'bash':
-            celery_task = execute_command.apply_async(args=[task.command])
-        elif task.operator == 'sql':
-            # add sql query
-            celery_task = execute_sql.apply_async(args=[task.command, self.database])
+        rules = tag_rules() if rules is None else rules
+        if tags is None and rules:
+            tags = [t for t, in session.query(Tag.name).filter(
+                    Tag.job_name==self.name).all()]
+        queue = resolve_queue(self.operator, tags or (), self.queue, rules)
+        celery_task = self.send_task(task, queue)
         task.task_id = celery_task.id 
         session.add(task)
         if not force_run:
             logger.info("schedule task for job {} at {} {}".format(
                         self.name, self.next_run_local_ts, self.timezone))
-            self.next_run_local_ts = get_next_run_ts(self.schedule_interval, self.next_run_local_ts)
+            self.next_run_local_ts = next_run or get_next_run_ts(
+                    self.schedule_interval, self.next_run_local_ts)
 
         session.commit()
+        live_index.add_running_task(self.name, task.id, task.execution_date)
         return celery_task.id
 
+    def send_task(self, task, queue, task_id=None):
+        """ send task to celery on queue, returns the AsyncResult """
+        # deferred, importing celery_worker builds the celery app
+        from dashboard.celery_worker import (execute_command, 
+                execute_python, execute_sql)
+        if task.operator == 'bash':
+            return execute_command.apply_async(args=[task.command],
+                    kwargs={'timeout': self.timeout}, queue=queue,
+                    task_id=task_id)
+        elif task.operator == 'sql':
+            # add sql query
+            return execute_sql.apply_async(
+                    args=[task.command, self.database], queue=queue,
+                    task_id=task_id)
+        elif task.operator == 'python':
+            return execute_python.apply_async(args=[task.command],
+                    queue=queue, task_id=task_id)
+
+    @property
+    def catchup_policy(self):
+        return self.catchup or conf.get('manager', 'catchup')
+
+    def catch_up(self, session, now_local):
+        """ Handle the runs missed up to now_local (job's local time)
+        by the job's catchup policy in one pass: the tasks are inserted
+        in bulk as SCHEDULED and sent by ScheduleManager.send_scheduled.
+        Moves next_run_local_ts past the handled runs; the caller
+        commits. Returns the number of tasks created. The skip policy
+        is handled by skip_missed. """
+        policy = self.catchup_policy
+        limit = None
+        if policy == 'all':
+            limit = conf.getint('manager', 'catchup_max_runs')
+        missed = get_runs_between(self.schedule_interval, 
+                self.next_run_local_ts, now_local, limit)
+        if policy == 'latest_only':
+            runs = missed[-1:]
+        else:
+            runs = missed
+        logger.info("job {} missed {} runs from {}, {} creates {}".format(
+                    self.name, len(missed), self.next_run_local_ts, 
+                    policy, len(runs)))
+        TaskInstance.insert_scheduled(session, self, runs)
+        self.next_run_local_ts = get_next_run_ts(self.schedule_interval, 
+                missed[-1] if missed else now_local)
+        return len(runs)
+
+    def skip_missed(self, now_local):
+        """ Drop the runs missed before the latest one due by now_local
+        and move next_run_local_ts to that one, so it is scheduled like
+        any due run. Returns the run after it. """
+        missed = get_runs_between(self.schedule_interval,
+                self.next_run_local_ts, now_local)
+        if missed:
+            logger.info("job {} skips {} runs from {}".format(self.name,
+                        len(missed) - 1, self.next_run_local_ts))
+            self.next_run_local_ts = missed[-1]
+        return get_next_run_ts(self.schedule_interval, self.next_run_local_ts)
+
     def initialize_shortcommand(self, max_size=30):
         if len(self.command) > max_size:
             self.short_command = self.command[:max_size] + "..."
@@ -294,7 +470,18 @@ class TagAlert(Base):
     email = Column(String(50))
 
 
-Base.metadata.create_all(engine)
+class RetentionPolicy(Base):
+    """ days of task history to keep for a job or for all jobs of a tag """
+    __tablename__ = 'retention_policies'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    scope = Column(String(10))    # job or tag
+    name = Column(String(100), index=True)
+    keep_days = Column(Integer)
+
+
+def init_db():
+    """ create all tables, run once per webserver db (cli init-db) """
+    Base.metadata.create_all(get_engine())
 
 
 ###############
@@ -304,157 +491,707 @@ Base.metadata.create_all(engine)
 
 
 class ScheduleManager(object):
+    # the leader's lease, see dashboard.utils.leader
     name = "scheduler_manager"
-    redis_conn = get_redis_conn()
+    # hash leader, ts (utc) and pass_seconds, written after every pass
+    heartbeat_key = "scheduler_manager/heartbeat"
+    # RequestHandler publishes job names here when a job's
+    # schedule changes, "*" asks for a full reload
+    wakeup_channel = "scheduler_manager/wakeup"
+    # consumer group reading TASK_EVENTS_STREAM
+    task_events_group = "scheduler_manager"
 
     @classmethod
-    def exists(cls):
-        if cls.redis_conn.exists(cls.name):
-            logger.warning("""A ScheduleManager instance exists, 
-                will not start a new one.""") 
-            return True 
-        return False
+    def notify(cls, job_name="*"):
+        """ wake up a timer-mode scheduler """
+        try:
+            get_redis_conn().publish(cls.wakeup_channel, job_name)
+        except Exception:
+            # scheduler still picks the change up on its next poll
+            logger.exception("Cannot notify scheduler for job {}".format(
+                        job_name))
 
-    def __init__(self):
-        if self.exists():
-            import sys
-            sys.exit()
-        self.redis_conn.set(self.name, datetime.now(), ex=20)
+    @classmethod
+    def exists(cls):
+        """ whether a leader holds the lease """
+        return lease_holder(cls.name) is not None
+
+    def __init__(self, shard_name=None):
+        self.lease = LeaderLease(self.name, 
+                ttl=conf.getint('manager', 'lease_ttl'),
+                max_stall=conf.getint('manager', 'lease_max_stall') or None)
+        # with sharding every process schedules its own jobs and the
+        # leader also does the chores for all jobs (unblock, reset,
+        # prune, heartbeat); without, the leader does everything
+        self.shards = None
+        if sharding.enabled():
+            self.shards = ShardMembership(shard_name or self.lease.identity)
+        self.consumer_name = self.shards.name if self.shards else self.name
+        self.task_state_source = conf.get('manager', 'task_state_source')
+        self.reconcile_interval = conf.getint('manager', 
+                    'task_state_reconcile_interval')
+        self._last_reconcile = None
+        self._events_group_ready = False
+        self.prune_interval = conf.getint('retention', 'prune_interval')
+        self._last_prune = datetime.now()
+        self.recipients = RecipientsMap(self._load_recipients)
         logger.info("Start manager")
 
+    def wait_for_leadership(self):
+        """ hot standby: block until this process holds the lease """
+        logged = False
+        while not self.lease.acquire():
+            if not logged:
+                logger.info("Scheduler {} is leader, {} standing by".format(
+                            lease_holder(self.name), self.lease.identity))
+                logged = True
+            sleep(self.lease.renew_every)
+        self._elected()
+
+    def _elected(self):
+        logger.info("Scheduler {} is leader".format(self.lease.identity))
+        # state kept by the previous leader may be stale
+        self._events_group_ready = False
+        self._last_reconcile = None
+        # reconcile indexes that drifted while no scheduler was running
+        RequestHandler.rebuild_live_indexes()
+
+    def _join(self):
+        """ become leader, or with sharding join the members and try
+        once for the lease """
+        if self.shards is None:
+            return self.wait_for_leadership()
+        self._keep_roles()
+
+    def _keep_roles(self):
+        """ renew the lease and the shard membership, False when this
+        process has to stop scheduling """
+        if self.shards is None:
+            return self.lease.keep()
+        if self.shards.keep():
+            logger.info("Shard members changed to {}, rebalance".format(
+                        self.shards.assigner.members))
+            # timer-mode members reload their queues
+            self.notify("*")
+        if not self.lease.keep() and self.lease.acquire():
+            self._elected()
+        return True
+
+    def _dispatching(self):
+        """ False once the lease (without sharding) or our shard
+        membership was lost during a pass: other schedulers then
+        dispatch the same jobs """
+        # a long pass is still progress
+        self.lease.touch()
+        if self.shards is not None:
+            self.shards.touch()
+        if self.shards is None and not self.lease.is_leader:
+            logger.warning("Scheduler lost its lease, stop the pass")
+            return False
+        if self.shards is not None and not self.shards.alive():
+            logger.warning("Shard membership of {} expired, stop the "
+                    "pass".format(self.shards.name))
+            return False
+        return True
+
+    def _sleep(self, seconds):
+        """ sleep while keeping the roles, False if the lease was lost """
+        end = datetime.now() + timedelta(seconds=seconds)
+        while self._keep_roles():
+            remaining = (end - datetime.now()).total_seconds()
+            if remaining <= 0:
+                return True
+            sleep(min(remaining, self.lease.renew_every))
+        return False
 
     def start(self, poll_interval=20):
+        self._join()
         while True:
+            if not self._keep_roles():
+                logger.warning("Scheduler lost its lease")
+                self._join()
             logger.info("Scheduler working...")
             start = datetime.now()
             with get_sql_session() as session:
                 # schedule tasks
                 self.schedule_and_update_jobs(session)
                 # update running/pending tasks state
-                self.check_tasks_state(session)
-                # check 
-            self.send_heartbeat()
+                self.update_tasks_state(session)
+                # catch-up and backfill runs as slots free up
+                self.send_scheduled(session)
+            if self.lease.is_leader:
+                self.prune_if_due()
+                self.send_heartbeat(start)
             logger.info("Waiting for next poll...")
             sleep_for = max(poll_interval - 
                     (datetime.now() - start).total_seconds(),
                     0)
-            sleep(sleep_for)
+            self._sleep(sleep_for)
 
-    def send_heartbeat(self):
-        # TODO:
-        # should design heartbeat functionality 
-        # for failure recovery/alert
-        self.redis_conn.set(self.name, datetime.now())
+    def start_timer(self, poll_interval=20):
+        """ Sleep exactly until the next job is due instead of polling.
+
+        Next run times are kept in an in-memory TimerQueue; changes made
+        through RequestHandler arrive on `wakeup_channel`. A full pass
+        (task states, resets, heartbeat, queue reload) still runs every
+        poll_interval seconds.
+        """
+        pubsub = get_redis_conn().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.wakeup_channel)
+        queue = TimerQueue()
+        last_poll = None
+        self._join()
+        while True:
+            if not self._keep_roles():
+                logger.warning("Scheduler lost its lease")
+                self._join()
+                last_poll = None
+            now = datetime.now()
+            poll_due = (last_poll is None or 
+                (now - last_poll).total_seconds() >= poll_interval)
+            changed = set()
+            if not poll_due:
+                wait = queue.seconds_until_next(max_wait=min(
+                    poll_interval - (now - last_poll).total_seconds(),
+                    self.lease.renew_every))
+                message = pubsub.get_message(timeout=max(wait, 0))
+                while message is not None:
+                    data = message['data']
+                    changed.add(data.decode() 
+                        if isinstance(data, bytes) else data)
+                    message = pubsub.get_message()
+            due = queue.pop_due()
+            if not (poll_due or due or changed):
+                continue
 
+            with get_sql_session() as session:
+                if due or poll_due:
+                    self.schedule_and_update_jobs(session)
+                if poll_due or "*" in changed:
+                    self._refresh_timer_queue(queue, session)
+                else:
+                    self._refresh_timer_queue(queue, session, 
+                                changed.union(due))
+                self.update_tasks_state(session)
+                self.send_scheduled(session)
+            if poll_due:
+                if self.lease.is_leader:
+                    self.prune_if_due()
+                    self.send_heartbeat(now)
+                last_poll = datetime.now()
+
+    def _refresh_timer_queue(self, queue, session, job_names=None):
+        q = session.query(Job).filter(Job.active==True)
+        if job_names is None:
+            queue.clear()
+        else:
+            if not job_names:
+                return
+            q = q.filter(Job.name.in_(job_names))
+            for name in job_names:
+                queue.remove(name)
+        for name, next_run_utc in self._owned(session, q).with_entities(
+                Job.name, Job.next_run_utc).all():
+            queue.set(name, next_run_utc)
+
+    def prune_if_due(self):
+        """ archive and drop old task history every prune_interval """
+        now = datetime.now()
+        if (now - self._last_prune).total_seconds() < self.prune_interval:
+            return
+        from dashboard.retention import prune_task_history
+        try:
+            if prune_task_history():
+                bump_versions('all')
+        except Exception:
+            logger.exception("Pruning task history failed")
+        self._last_prune = now
+
+    def send_heartbeat(self, pass_started=None):
+        """ leader and time of the last pass, watched by Monitor """
+        utcnow = datetime.utcnow()
+        fields = {'leader': self.lease.identity,
+                  'ts': utcnow.strftime('%Y-%m-%dT%H:%M:%S')}
+        if pass_started is not None:
+            fields['pass_seconds'] = round((datetime.now() - 
+                    pass_started).total_seconds(), 3)
+        tx = get_redis_conn().pipeline()
+        tx.hset(self.heartbeat_key, mapping=fields)
+        tx.expire(self.heartbeat_key, 
+                conf.getint('monitor', 'max_heartbeat_age') * 10)
+        tx.execute()
+
+
+    def _update_jobs_state(self, session, now):
+        """ unblock, expire and reset jobs, for all shards; returns
+        (unblocked jobs, changed job names, reset job names) """
+        blocked_jobs = session.query(Job).filter(
+                        Job.active==False).filter(
+                        Job.block_till != None).filter(
+                        Job.block_till < now).with_for_update().all()
+        for job in blocked_jobs:
+            job.active = True 
+            job.block_till = None
+            job.block_by = None
+            job.block_msg = None
+            # runs missed while blocked are not caught up, the setter
+            # keeps next_run_utc in sync
+            job.next_run_local_ts = get_next_run_ts(job.schedule_interval,
+                    convert_to_local(datetime.utcnow(), job.timezone))
+            logger.info("Job {} is unblocked".format(job.name))
+
+        # deactivate expired jobs in one statement
+        changed = [name for name, in session.query(Job.name).filter(
+                Job.active==True).filter(Job.end_dt != None).filter(
+                Job.end_dt < now).all()]
+        if changed:
+            session.query(Job).filter(Job.name.in_(changed)).update(
+                {Job.active: False}, synchronize_session=False)
+
+        # check if the job state should be reset, 
+        # only narrow columns are loaded here
+        to_reset = []
+        reset_names = []
+        for job_id, name, reset_status_at, last_execution_ts in session.query(
+                Job.id, Job.name, Job.reset_status_at, 
+                Job.last_execution_ts).filter(
+                Job.active==True).filter(
+                Job.status != Job.status_enum['unknown']).filter(
+                Job.last_task_result != None).all():
+            reset_time = datetime.combine(now.date(), reset_status_at.time())
+            if now >= reset_time and last_execution_ts < reset_time:
+                to_reset.append(job_id)
+                reset_names.append(name)
+                changed.append(name)
+        if to_reset:
+            session.query(Job).filter(Job.id.in_(to_reset)).update(
+                {Job.status: Job.status_enum['unknown']},
+                synchronize_session=False)
+        return blocked_jobs, changed, reset_names
 
     @provide_session
     def schedule_and_update_jobs(self, session=None):
         """ check all active jobs and schedule tasks when it's time """
         now = datetime.now()
-        blocked_jobs = session.query(Job).filter(
-                        Job.active==False).filter(
-                        Job.block_till != None).with_for_update().all()
-        if blocked_jobs:
-            for job in blocked_jobs:
-                if now > job.block_till:
-                    job.activate = True 
-                    logger.info("Job {} is unblocked".format(job.name))
-
-        active_jobs = session.query(Job).filter(
-            Job.active==True).with_for_update().all()  
-        logger.info("Find {} active jobs, try to schedule them".format(
-                    len(active_jobs)))      
-        if active_jobs:
-            for job in active_jobs:
-                # check if the job should be deactivate 
-                if job.end_dt and now > job.end_dt:
-                    job.active = False
+        utcnow = datetime.utcnow()
+        blocked_jobs, changed, reset_names = [], [], []
+        if self.lease.is_leader:
+            blocked_jobs, changed, reset_names = self._update_jobs_state(
+                    session, now)
+
+        # only lock and load jobs that are due
+        due_jobs = self._owned(session, session.query(Job).filter(
+            Job.active==True).filter(
+            Job.next_run_utc <= utcnow)).with_for_update().all()
+        logger.info("Find {} due jobs, try to schedule them".format(
+                    len(due_jobs)))      
+        next_runs = get_next_run_ts_bulk(
+                [job.schedule_interval for job in due_jobs],
+                [job.next_run_local_ts for job in due_jobs])
+        rules = tag_rules()
+        job_tags = self._load_job_tags(session, 
+                [job.name for job in due_jobs], rules)
+        for job, next_run in zip(due_jobs, next_runs):
+            if not self._dispatching():
+                break
+            now_local = convert_to_local(utcnow, job.timezone)
+            if next_run <= now_local:
+                # more than one run missed, e.g. the scheduler was down
+                if job.catchup_policy == 'skip':
+                    next_run = job.skip_missed(now_local)
+                else:
+                    job.catch_up(session, now_local)
+                    changed.append(job.name)
                     continue
-                reset_time = datetime.combine(datetime.today(),
-                        job.reset_status_at.time())
-                # check if the job state should be reset
-                if (now >= reset_time and job.last_task_result and 
-                        job.last_execution_ts < reset_time):
-                    job.set_status(session, 'unknown')
-
-                # schedule tasks for each active job
-                task_id = job.schedule_task(session)
-                if task_id is not None:
-                    logger.info("schedule task {} for job {}".format(task_id, job.name))
+            # schedule tasks for each due job
+            task_id = job.schedule_task(session, next_run=next_run,
+                    tags=job_tags[job.name], rules=rules)
+            if task_id is not None:
+                logger.info("schedule task {} for job {}".format(task_id, job.name))
+            changed.append(job.name)
         session.commit()
+        for name in reset_names:
+            live_index.set_job_status(name, 'unknown')
+        if changed or blocked_jobs:
+            bump_versions('jobs', 'tasks', *job_entities(changed + 
+                        [job.name for job in blocked_jobs]))
+
+    def _owned(self, session, q):
+        """ narrow q, a Job query, to the jobs of this shard """
+        if self.shards is None:
+            return q
+        jobs = q.with_entities(Job.id, Job.name).all()
+        return q.filter(Job.id.in_(self._owned_ids(session, jobs)))
+
+    def _owned_ids(self, session, jobs):
+        """ ids of this shard's jobs among (job id, job name) pairs """
+        job_tags = self._load_job_tags(session, [name for _, name in jobs],
+                self.shards.assigner.groups)
+        return [job_id for job_id, name in jobs 
+                if self.shards.owns(job_id, job_tags[name])]
+
+    def _load_job_tags(self, session, job_names, rules):
+        """ {job name: [tags]}, one query for all; tags are only
+        needed for tag routing rules and tag shard groups """
+        job_tags = defaultdict(list)
+        if rules and job_names:
+            for tag_name, job_name in session.query(Tag.name, 
+                    Tag.job_name).filter(Tag.job_name.in_(job_names)).all():
+                job_tags[job_name].append(tag_name)
+        return job_tags
+
+    @provide_session
+    def send_scheduled(self, session=None):
+        """ Send SCHEDULED tasks (catch-up and backfill runs) to celery,
+        oldest first, keeping at most [manager] catchup_concurrency
+        tasks of a job pending or running. Tasks of inactive (e.g.
+        blocked) jobs wait until the job is active again. """
+        waiting = session.query(TaskInstance.job_id, 
+                TaskInstance.job_name).filter(
+                TaskInstance.state==SCHEDULED).distinct().all()
+        if self.shards is not None:
+            owned = set(self._owned_ids(session, waiting))
+            waiting = [(job_id, name) for job_id, name in waiting 
+                    if job_id in owned]
+        waiting = [name for _, name in waiting]
+        if not waiting:
+            return
+        limit = conf.getint('manager', 'catchup_concurrency')
+        active = dict(session.query(TaskInstance.job_name, 
+                func.count(TaskInstance.id)).filter(
+                TaskInstance.job_name.in_(waiting)).filter(
+                TaskInstance.state.in_(RUNNING_STATES)).group_by(
+                TaskInstance.job_name).all())
+        jobs = {job.name: job for job in session.query(Job).filter(
+                Job.name.in_(waiting)).filter(Job.active==True).all()}
+        rules = tag_rules()
+        job_tags = self._load_job_tags(session, waiting, rules)
+        claimed = []
+        for name in waiting:
+            if not self._dispatching():
+                break
+            job = jobs.get(name)
+            free = limit - active.get(name, 0)
+            if job is None or free <= 0:
+                continue
+            queue = resolve_queue(job.operator, job_tags[name], job.queue,
+                    rules)
+            for task in session.query(TaskInstance).filter(
+                    TaskInstance.job_name==name).filter(
+                    TaskInstance.state==SCHEDULED).order_by(
+                    TaskInstance.execution_date).limit(
+                    free).with_for_update().all():
+                task.state = 'PENDING'
+                claimed.append((task, job, queue))
+        # commit before sending, a failed commit must not leave sent
+        # tasks SCHEDULED to be sent again next pass
+        session.commit()
+        sent, failed = [], []
+        for task, job, queue in claimed:
+            try:
+                job.send_task(task, queue, task_id=task.task_id)
+                sent.append(task)
+            except Exception:
+                logger.exception("Cannot send scheduled task {}".format(
+                            task.task_id))
+                failed.append(task)
+        if failed:
+            # sent again next pass
+            for task in failed:
+                task.state = SCHEDULED
+            session.commit()
+        if not sent:
+            return
+        logger.info("Sent {} scheduled tasks".format(len(sent)))
+        for task in sent:
+            live_index.add_running_task(task.job_name, task.id, 
+                    task.execution_date)
+        bump_versions('tasks', *job_entities(set(t.job_name for t in sent)))
+
+    @provide_session
+    def update_tasks_state(self, session=None):
+        """ update running/pending tasks with the configured source """
+        if self.task_state_source != 'stream':
+            return self.check_tasks_state(session)
+        self.ingest_task_events(session)
+        now = datetime.now()
+        if (self._last_reconcile is None or (now - self._last_reconcile
+                ).total_seconds() >= self.reconcile_interval):
+            self.check_tasks_state(session)
+            self._last_reconcile = now
+
+    def _ensure_events_group(self):
+        from dashboard.celery_worker import TASK_EVENTS_STREAM
+        if self._events_group_ready:
+            return
+        try:
+            get_redis_conn().xgroup_create(TASK_EVENTS_STREAM,
+                    self.task_events_group, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._events_group_ready = True
+
+    def _claim_task_events(self, batch_size=1000):
+        """ take over events left pending by a consumer that stopped,
+        e.g. a crashed shard member, they are read with our own
+        pending events """
+        from dashboard.celery_worker import TASK_EVENTS_STREAM
+        min_idle_ms = conf.getint('manager', 'task_event_claim_idle') * 1000
+        start, claimed = '0-0', 0
+        try:
+            while True:
+                resp = get_redis_conn().xautoclaim(TASK_EVENTS_STREAM,
+                        self.task_events_group, self.consumer_name, 
+                        min_idle_ms, start_id=start, count=batch_size,
+                        justid=True)
+                start = resp[0].decode() if isinstance(resp[0], 
+                        bytes) else resp[0]
+                claimed += len(resp[1])
+                if start == '0-0':
+                    break
+        except Exception:
+            # the reconcile pass still recovers their tasks
+            logger.exception("Cannot claim idle task events")
+        if claimed:
+            logger.info("Claimed {} idle task events".format(claimed))
+
+    @provide_session
+    def ingest_task_events(self, session=None, batch_size=1000):
+        """ Apply task state events pushed by workers, one transaction
+        per batch of events.
+
+        An event can arrive before its TaskInstance is committed, as
+        tasks are sent before the commit; it is left pending in the
+        consumer group and retried on the next pass, until it is older
+        than [manager] task_event_max_age seconds. """
+        from dashboard.celery_worker import TASK_EVENTS_STREAM
+        self._ensure_events_group()
+        self._claim_task_events(batch_size)
+        max_age_ms = conf.getint('manager', 'task_event_max_age') * 1000
+        # first the pending events: delivered before a restart but
+        # never acked, or waiting for their task; then new ones
+        read_from = '0'
+        while True:
+            resp = get_redis_conn().xreadgroup(self.task_events_group,
+                    self.consumer_name, {TASK_EVENTS_STREAM: read_from},
+                    count=batch_size)
+            entries = resp[0][1] if resp else []
+            if not entries:
+                if read_from != '>':
+                    read_from = '>'
+                    continue
+                return
+            if read_from != '>':
+                # walk the pending entries, unmatched ones stay pending
+                read_from = entries[-1][0]
+
+            events = defaultdict(list)
+            entry_ids = defaultdict(list)
+            done = []
+            for entry_id, fields in entries:
+                if not fields:
+                    # deleted before it was acked
+                    done.append(entry_id)
+                    continue
+                fields = {(k.decode() if isinstance(k, bytes) else k):
+                          (v.decode() if isinstance(v, bytes) else v)
+                          for k, v in fields.items()}
+                events[fields['task_id']].append(fields)
+                entry_ids[fields['task_id']].append(entry_id)
+            tasks = session.query(TaskInstance).filter(
+                    TaskInstance.task_id.in_(list(events))
+                    ).with_for_update().all()
+            finished = []
+            for task in tasks:
+                for event in events[task.task_id]:
+                    if self._apply_task_event(task, event, session):
+                        finished.append(task)
+                done.extend(entry_ids.pop(task.task_id))
+            jobs = self._update_jobs_last_state(finished, session)
+            session.commit()
+            self._tasks_changed(tasks, finished, jobs)
+
+            now_ms = int(time_module.time() * 1000)
+            waiting = 0
+            for task_id, ids in entry_ids.items():
+                for entry_id in ids:
+                    ms = int((entry_id.decode() if isinstance(entry_id, 
+                            bytes) else entry_id).split('-')[0])
+                    if now_ms - ms > max_age_ms:
+                        logger.warning("Drop event of unknown task {}".format(
+                                    task_id))
+                        done.append(entry_id)
+                    else:
+                        waiting += 1
+            if done:
+                get_redis_conn().xack(TASK_EVENTS_STREAM, 
+                        self.task_events_group, *done)
+                get_redis_conn().xdel(TASK_EVENTS_STREAM, *done)
+            logger.info("Applied {} task events, {} wait for their "
+                    "task".format(len(done), waiting))
+            if len(entries) < batch_size and read_from == '>':
+                return
+
+    def _apply_task_event(self, task, event, session):
+        """ returns True if the event finished the task """
+        if task.state in FINISHED_STATES:
+            # already finished, e.g. picked up by reconcile
+            return False
+        ts = datetime.strptime(event['ts'], '%Y-%m-%dT%H:%M:%S.%f')
+        task.state = event['state']
+        logger.info("Job {} exec time {} task changes to state {}".format(
+                task.job_name, task.execution_date, task.state))
+        if task.state == celery_states.STARTED:
+            task.started_at = ts
+            return False
+        task.finished_at = ts
+        self._set_task_result(task, event.get('result'), session,
+                failed=task.state != celery_states.SUCCESS)
+        return True
+
+    def _set_task_result(self, task, result, session, failed=False):
+        if failed or isinstance(result, Exception):
+            result = str(result)
+        elif result == '1':
+            result = '1, Constraint {} succeeded with no exception'.format(
+                        task.job_name)
+        elif isinstance(result, bytes):
+            result = result.decode(errors='replace')
+        elif result is not None:
+            result = str(result)
+
+        # keep the row narrow, the full output goes to task_results
+        summary_size = conf.getint('task_result', 'summary_size')
+        if result is not None and len(result) > summary_size:
+            task.result_digest = TaskResult.store(session, result)
+            result = result[:summary_size - 3] + '...'
+        task.result = result
 
     @provide_session
     def check_tasks_state(self, session=None):
         """ check celery jobs and change task status """
+        from dashboard.celery_worker import get_task_metas
         # try to recover active tasks
-        active_tasks = session.query(TaskInstance).filter(
-                    TaskInstance.state.in_(("PENDING", "STARTED"))
-                    ).with_for_update().all()
+        q = session.query(TaskInstance).filter(
+                    TaskInstance.state.in_(RUNNING_STATES))
+        if self.shards is not None:
+            owned = self._owned_ids(session, q.with_entities(
+                    TaskInstance.job_id, TaskInstance.job_name
+                    ).distinct().all())
+            q = q.filter(TaskInstance.job_id.in_(owned))
+        active_tasks = q.with_for_update().all()
         if len(active_tasks) == 0:
             logger.info("No active tasks, return")
             return 
 
+        # one MGET against the result backend for all tasks
+        metas = get_task_metas([task.task_id for task in active_tasks])
+        changed = []
+        finished = []
         for task in active_tasks:
-            celery_task = execute_command.AsyncResult(task.task_id)
-            if celery_task.status == task.state:
+            meta = metas[task.task_id]
+            if meta['status'] == task.state:
                 continue 
-            task.state = celery_task.status
+            changed.append(task)
+            task.state = meta['status']
+            if (task.state == celery_states.FAILURE and 
+                    is_timeout(meta['result'])):
+                task.state = TIMEOUT
             logger.info("Job {} exec time {} task changes to state {}".format(
                     task.job_name, task.execution_date, task.state))
-            if celery_task.ready():
-                if isinstance(celery_task.result, Exception):
-                    task.result = str(celery_task.result)
-                else:
-                    if celery_task.result == '1':
-                        task.result = '1, Constraint {} succeeded with no exception'.format(
-                                    task.job_name)
-                    else:
-                        task.result = celery_task.result
-
-                self._update_job_last_state(task, session)
-
-        session.commit()
-
-    def _update_job_last_state(self, task, session):
-        job = session.query(Job).filter(
-                        Job.name==task.job_name
-                        ).with_for_update().first()
-        if not job:
-            logger.error("Cannot find job name {}".format(task.job_name))
-            return 
-        # CAVEAT
-        # This is only for dashboard
-        # if sysout starts with 1, data check passed
-        job.last_execution_ts = task.execution_date
-        job.last_task_result = task.result
-        if (not isinstance(job.last_task_result, str) or 
-                not job.last_task_result.startswith("1")):
-            self._send_alert(job, session)
-            job.set_status(session, 'fail')
-        else:
-            job.set_status(session, 'success')
-
+            if task.state == celery_states.STARTED:
+                task.started_at = datetime.utcnow()
+            if task.state in FINISHED_STATES:
+                task.finished_at = datetime.utcnow()
+                self._set_task_result(task, meta['result'], session)
+                finished.append(task)
+
+        jobs = self._update_jobs_last_state(finished, session)
         session.commit()
-
-    def _send_alert(self, job, session):
-        job_followers = [f[0] for f in session.query(JobAlert.email).filter(
-                JobAlert.job_name==job.name).all()]
-        t = session.query(Tag.name.label("tag_name")).filter(
-                Tag.job_name==job.name)
-
-        tag_followers = [f[0] for f in session.query(TagAlert.email).filter(
-                TagAlert.tag_name.in_(t)).all()]
-        recipients = list(set(job_followers).union(set(tag_followers)))
-        if len(recipients):
-            subject = "Dashboard - Job Failure Alert"
-            body = "Job {} (command {}) status: \nfailed with sysout {}".format(
-                    job.name, job.command, job.last_task_result)
-            send_email(subject=subject, to=recipients, body=body)
+        self._tasks_changed(changed, finished, jobs)
+
+    def _tasks_changed(self, tasks, finished, jobs):
+        """ after commit: update the live indexes and drop cached
+        pages showing tasks, and the job list if a finished task
+        changed its job's status """
+        if not tasks:
+            return
+        live_index.remove_running_tasks(
+                [(t.job_name, t.id) for t in finished])
+        for job in jobs:
+            live_index.set_job_status(job.name, 
+                    Job.status_map.get(job.status, 'unknown'))
+        entities = ['tasks'] + job_entities(set(t.job_name for t in tasks))
+        if finished:
+            entities.append('jobs')
+        bump_versions(*entities)
+
+    def _update_jobs_last_state(self, tasks, session):
+        """ write finished tasks back to their jobs, with one job
+        lookup for all tasks; the caller commits. Returns the jobs. """
+        if not tasks:
+            return []
+        jobs = session.query(Job).filter(Job.name.in_(
+                set(t.job_name for t in tasks))).with_for_update().all()
+        jobs = {job.name: job for job in jobs}
+        recipients_ready = False
+        for task in sorted(tasks, key=lambda t: t.execution_date):
+            job = jobs.get(task.job_name)
+            if not job:
+                logger.error("Cannot find job name {}".format(task.job_name))
+                continue
+            if (job.last_execution_ts is not None and 
+                    task.execution_date < job.last_execution_ts):
+                # a backfilled run older than the job's state
+                logger.info("Job {} backfill {} finished as {}".format(
+                            job.name, task.execution_date, task.state))
+                continue
+            # CAVEAT
+            # This is only for dashboard
+            # if sysout starts with 1, data check passed
+            job.last_execution_ts = task.execution_date
+            job.last_task_result = task.result
+            if (not isinstance(job.last_task_result, str) or 
+                    not job.last_task_result.startswith("1")):
+                if not recipients_ready:
+                    self.recipients.refresh(session)
+                    recipients_ready = True
+                self._send_alert(job)
+                job.status = Job.status_enum['fail']
+            else:
+                job.status = Job.status_enum['success']
+        return list(jobs.values())
+
+    def _load_recipients(self, session):
+        """ {job name: emails} of job followers and tag followers """
+        recipients = defaultdict(set)
+        for job_name, email in session.query(JobAlert.job_name,
+                JobAlert.email).all():
+            recipients[job_name].add(email)
+        for job_name, email in session.query(Tag.job_name, 
+                TagAlert.email).filter(TagAlert.tag_name==Tag.name).all():
+            recipients[job_name].add(email)
+        logger.info("Loaded alert recipients of {} jobs".format(
+                    len(recipients)))
+        return dict(recipients)
+
+    def _send_alert(self, job):
+        # mailed by the alert dispatcher, not while holding job locks
+        enqueue_alert(job.name, job.command, job.last_task_result, 
+                    self.recipients.get(job.name))
 
 
 class RequestHandler:
     """ This is the handlers that takes requests from web/cli """
 
+    @classmethod
+    def _job_changed(cls, job_name):
+        """ after committing a job change: wake up the scheduler
+        and drop the cached pages showing the job """
+        ScheduleManager.notify(job_name)
+        bump_versions('jobs', 'tasks', *job_entities([job_name]))
+
     @classmethod
     def clear_redis(cls):
         """clear celery info"""
@@ -464,13 +1201,31 @@ class RequestHandler:
     @classmethod
     def clear_sql_db(cls):
         """clear all jobs/tasks/tags"""
-        Base.metadata.drop_all(bind=engine)
-        Base.metadata.create_all(bind=engine)
+        Base.metadata.drop_all(bind=get_engine())
+        Base.metadata.create_all(bind=get_engine())
+        cls.rebuild_live_indexes()
+        bump_versions('all')
+
+    @classmethod
+    @provide_session
+    def rebuild_live_indexes(cls, session=None):
+        """ recreate the redis tag/status/running task indexes from sql """
+        job_tags = {name: [] for name, in session.query(Job.name).all()}
+        for tag_name, job_name in session.query(Tag.name, Tag.job_name).all():
+            job_tags.setdefault(job_name, []).append(tag_name)
+        job_status = {name: Job.status_map.get(status, 'unknown') 
+                for name, status in session.query(Job.name, Job.status).all()}
+        running = session.query(TaskInstance.job_name, TaskInstance.id, 
+                TaskInstance.execution_date).filter(
+                TaskInstance.state.in_(RUNNING_STATES)).all()
+        live_index.rebuild(job_tags, job_status, running)
 
     @classmethod
     @provide_session
     def get_tags(cls, session=None):
         """get all distinct tags"""
+        if live_index.ready():
+            return [(name,) for name in live_index.tag_names()]
         return session.query(Tag.name).distinct().order_by(Tag.name).all()
 
     @classmethod
@@ -500,32 +1255,101 @@ class RequestHandler:
             q = q.filter(Job.active==True)
         return q.all()
 
+    @classmethod
+    @provide_session
+    def list_jobs(cls, tag=None, status=None, active=None, name_prefix=None,
+                after=None, limit=50, command_size=30, session=None):
+        """ One page of the job list, ordered by (name, id).
+
+        after: (name, id) of the last job of the previous page.
+        Only the listed columns are selected and the command is cut
+        to command_size characters by the db. Returns (jobs, next)
+        where next is the `after` of the following page or None.
+        """
+        q = session.query(Job.id, Job.name, Job.active, Job.block_by, 
+                Job.timezone, Job.status, Job.next_run_local_ts,
+                func.substr(Job.command, 1, command_size).label('short_command'),
+                (func.length(Job.command) > command_size).label('cut'))
+        if tag is not None:
+            q = q.filter(Job.name.in_(session.query(Tag.job_name).filter(
+                    Tag.name==tag)))
+        if status is not None:
+            q = q.filter(Job.status==Job.status_enum[status])
+        if active is not None:
+            q = q.filter(Job.active==active)
+        if name_prefix:
+            q = q.filter(Job.name.startswith(name_prefix, autoescape=True))
+        if after is not None:
+            after_name, after_id = after
+            q = q.filter(or_(Job.name > after_name, and_(
+                    Job.name == after_name, Job.id > after_id)))
+        rows = q.order_by(Job.name, Job.id).limit(limit + 1).all()
+
+        jobs = []
+        for row in rows[:limit]:
+            jobs.append({'id': row.id,
+                    'name': row.name,
+                    'active': row.active,
+                    'block_by': row.block_by,
+                    'timezone': row.timezone,
+                    'status': Job.status_map.get(row.status, 'unknown'),
+                    'next_run_local_ts': row.next_run_local_ts,
+                    'short_command': (row.short_command or '') + 
+                            ('...' if row.cut else '')})
+        next_page = None
+        if len(rows) > limit:
+            next_page = (jobs[-1]['name'], jobs[-1]['id'])
+        return jobs, next_page
+
     @classmethod
     @provide_session
     def info_job(cls, job_name, max_task_num=20, session=None):
-        """ given a job_name, get all tags and its tasks """
-        job = session.query(Job).filter(Job.name==job_name).first()
-        if job:
-            tags = session.query(Tag.name).filter(
-                    Tag.job_name==job_name).all()
-            tags = [t[0] for t in tags]
-            tasks = session.query(TaskInstance).filter(
-                    TaskInstance.job_id==job.id).order_by(
-                    TaskInstance.execution_date.desc()).limit(
-                    max_task_num).all()
-            tasks = sorted(tasks)
-            alerts = session.query(JobAlert.email).filter(
-                    JobAlert.job_name==job_name).order_by(
-                    JobAlert.email).all()
-            alerts = [a[0] for a in alerts]
-            return job, tags, tasks, alerts
-        return None, None, None
+        """ given a job_name, get all tags and its tasks.
+
+        Two queries: the job joined with its tags and alert emails
+        (one row per tag or email), then its most recent tasks. """
+        extras = session.query(literal('tag').label('kind'), 
+                Tag.name.label('value')).filter(
+                Tag.job_name==job_name).union_all(
+                session.query(literal('alert'), JobAlert.email).filter(
+                JobAlert.job_name==job_name)).subquery()
+        rows = session.query(Job, extras.c.kind, extras.c.value).outerjoin(
+                extras, true()).filter(Job.name==job_name).all()
+        if not rows:
+            return None, None, None, None
+        job = rows[0][0]
+        tags = sorted(set(v for _, kind, v in rows if kind == 'tag'))
+        alerts = sorted(set(v for _, kind, v in rows if kind == 'alert'))
+        tasks = session.query(TaskInstance).filter(
+                TaskInstance.job_id==job.id).order_by(
+                TaskInstance.execution_date.desc()).limit(
+                max_task_num).all()
+        return job, tags, sorted(tasks), alerts
 
     @classmethod
     @provide_session
     def get_jobs_by_tag(cls, only_active=False, tag_name=None, session=None):
         """if given tag_name, will get all jobs that have this tag,
         else return dictionary of tags and their list of jobs"""
+        if tag_name is not None and live_index.ready():
+            names = live_index.jobs_with_tag(tag_name)
+            q = session.query(Job).filter(Job.name.in_(names))
+            if only_active:
+                q = q.filter(Job.active==True)
+            return sorted(q.all()) if names else []
+
+        if tag_name is None and live_index.ready():
+            members = live_index.tag_members()
+            q = session.query(Job).filter(Job.name.in_(
+                    set(name for names in members.values() for name in names)))
+            if only_active:
+                q = q.filter(Job.active==True)
+            jobs = {job.name: job for job in q.all()}
+            tags_dict = defaultdict(list)
+            for tag, names in members.items():
+                tags_dict[tag] = [jobs[n] for n in names if n in jobs]
+            return tags_dict
+
         tj = session.query(Tag, Job).filter(Job.name==Tag.job_name)
         if only_active:
             tj = tj.filter(Job.active==True)
@@ -543,13 +1367,30 @@ class RequestHandler:
             tags_dict[tag.name].append(job)
         return tags_dict
 
+    @classmethod
+    @provide_session
+    def get_tag_status_counts(cls, tag_name, session=None):
+        """ {status name: number of jobs} for jobs with the tag """
+        if live_index.ready():
+            return live_index.tag_status_counts(tag_name)
+        rows = session.query(Job.status, func.count(Job.id)).filter(
+                Job.name.in_(session.query(Tag.job_name).filter(
+                Tag.name==tag_name))).group_by(Job.status).all()
+        return {Job.status_map.get(status, 'unknown'): n for status, n in rows}
+
     @classmethod
     @provide_session
     def info_tasks(cls, only_running=False, job_name=None, session=None):
         """ get all running tasks """
         q = session.query(TaskInstance)
+        if only_running and live_index.ready():
+            ids = live_index.running_task_ids(job_name)
+            if not ids:
+                return []
+            # a finished task may still be indexed for a moment
+            q = q.filter(TaskInstance.id.in_(ids))
         if only_running:
-            q = q.filter(TaskInstance.state.in_(('STARTED', 'PENDING')))
+            q = q.filter(TaskInstance.state.in_(RUNNING_STATES))
         if job_name is not None:
             q = q.filter(TaskInstance.job_name==job_name)
         tasks = sorted(q.all())
@@ -558,11 +1399,8 @@ class RequestHandler:
     @classmethod
     @provide_session    
     def clear_tasks_history(cls, job_name, session=None):
-        tasks = session.query(TaskInstance).filter(
-                TaskInstance.job_name==job_name).with_for_update(
-                ).all()
-        for t in tasks:
-            session.delete(t)
+        from dashboard.retention import delete_task_instances
+        delete_task_instances(session, [TaskInstance.job_name==job_name])
         job = session.query(Job).filter(Job.name==job_name
                 ).with_for_update().first()
         if job:
@@ -570,6 +1408,10 @@ class RequestHandler:
             job.last_task_result = None
             job.set_status(session, 'unknown')
         session.commit()
+        live_index.clear_running_tasks(job_name)
+        if job:
+            live_index.set_job_status(job_name, 'unknown')
+        bump_versions('jobs', 'tasks', *job_entities([job_name]))
         return
 
 
@@ -597,6 +1439,9 @@ class RequestHandler:
         for ja in job_alerts:
             session.add(ja)
         session.commit()
+        bump_versions(RECIPIENTS_ENTITY)
+        live_index.set_job_tags(job_args["name"], tags, 'unknown')
+        cls._job_changed(job_args["name"])
         return True
 
 
@@ -658,6 +1503,9 @@ class RequestHandler:
             session.add(JobAlert(job_name=job.name, email=email))
 
         session.commit()
+        bump_versions(RECIPIENTS_ENTITY)
+        live_index.set_job_tags(job_args['name'], tags)
+        cls._job_changed(job_args['name'])
 
     @classmethod
     @provide_session
@@ -676,7 +1524,7 @@ class RequestHandler:
             elif block_till == '1 week':
                 job.block_till = datetime.now() + timedelta(days=7)
             else:
-                job.block_till = pd.to_datetime(block_till)
+                job.block_till = parse_datetime(block_till)
             print(job.block_till)
         except Exception as e:
             errors.append(str(e))
@@ -692,6 +1540,7 @@ class RequestHandler:
                     job.schedule_interval,
                     job.block_till)
         session.commit()        
+        cls._job_changed(job_name)
         return True
 
 
@@ -711,6 +1560,7 @@ class RequestHandler:
                     if by is not None:
                         job.block_by = by
                     session.commit()
+                    cls._job_changed(job_name)
                     return True
                 else:
                     msg = "Job {} is already inactive".format(job_name)
@@ -726,6 +1576,7 @@ class RequestHandler:
                     job.block_till = None 
                     job.block_msg = None
                     session.commit()
+                    cls._job_changed(job_name)
                     return True 
                 else:
                     msg = "Job {} is already active".format(job_name)
@@ -742,29 +1593,128 @@ class RequestHandler:
         task = session.query(TaskInstance).filter(TaskInstance.id==task_id).first()
         return task
 
+    @classmethod
+    @provide_session
+    def get_task_result(cls, task_id, session=None):
+        """ full result of task instance `task_id` """
+        task = session.query(TaskInstance.result, 
+                TaskInstance.result_digest).filter(
+                TaskInstance.id==task_id).first()
+        if task is None:
+            return None
+        if task.result_digest is None:
+            return task.result
+        blob = session.query(TaskResult).filter(
+                TaskResult.digest==task.result_digest).first()
+        return blob.text() if blob else task.result
+
+    @classmethod
+    @provide_session
+    def tail_task_log(cls, task_id, offset=0, max_bytes=None, session=None):
+        """ output of task instance `task_id` from byte offset on,
+        None if there is no such task """
+        celery_id = session.query(TaskInstance.task_id).filter(
+                TaskInstance.id==task_id).scalar()
+        if celery_id is None:
+            return None
+        return read_task_log(celery_id, offset, max_bytes)
+
 
     @classmethod
     @provide_session
     def remove_job(cls, job_name, session=None):
         """ remove from job table """
+        from dashboard.retention import delete_task_instances
         job = session.query(Job).filter(Job.name==job_name
                     ).with_for_update().first()
-        tags = session.query(Tag).filter(Tag.job_name==job_name
-                    ).with_for_update().all()
-        tasks = session.query(TaskInstance).filter(TaskInstance.job_name
-                    ==job_name).with_for_update().all()
-        job_alerts = session.query(JobAlert).filter(JobAlert.job_name
-                    ==job_name).with_for_update().all()
         # NOTE:
         # not exactly clear whether to delete all tag related alerts
-        session.delete(job)
-        for t in tags:
-            session.delete(t)
-        for t in tasks:
-            session.delete(t)
-        for j in job_alerts:
-            session.delete(j)
+        session.query(Tag).filter(Tag.job_name==job_name).delete(
+                    synchronize_session=False)
+        session.query(JobAlert).filter(JobAlert.job_name==job_name).delete(
+                    synchronize_session=False)
+        session.query(RetentionPolicy).filter(
+                    RetentionPolicy.scope=='job').filter(
+                    RetentionPolicy.name==job_name).delete(
+                    synchronize_session=False)
+        if job:
+            session.delete(job)
         session.commit()
+        # job is gone, so no new tasks show up while deleting in chunks
+        delete_task_instances(session, [TaskInstance.job_name==job_name])
+        bump_versions(RECIPIENTS_ENTITY)
+        live_index.remove_job(job_name)
+        cls._job_changed(job_name)
+
+    @classmethod
+    @provide_session
+    def get_archived_tasks(cls, job_name, month=None, session=None):
+        """ months with archived tasks, or the tasks of one month """
+        from dashboard.retention import archived_months, read_archive
+        job_id = session.query(Job.id).filter(Job.name==job_name).scalar()
+        if job_id is None:
+            return None
+        if month is None:
+            return archived_months(job_id)
+        return read_archive(job_id, month)
+
+    @classmethod
+    @provide_session
+    def set_retention_policy(cls, scope, name, keep_days, session=None):
+        """ keep_days=None removes the job/tag policy """
+        session.query(RetentionPolicy).filter(
+                RetentionPolicy.scope==scope).filter(
+                RetentionPolicy.name==name).delete(synchronize_session=False)
+        if keep_days is not None:
+            session.add(RetentionPolicy(scope=scope, name=name, 
+                    keep_days=int(keep_days)))
+        session.commit()
+
+    @classmethod
+    @provide_session
+    def get_shard_assignment(cls, session=None):
+        """ live scheduler shards and the active jobs each one owns """
+        members = sharding.live_members()
+        assigner = JobAssigner(members)
+        job_tags = defaultdict(list)
+        if assigner.groups:
+            for tag_name, job_name in session.query(Tag.name, 
+                    Tag.job_name).all():
+                job_tags[job_name].append(tag_name)
+        assignment = {member: [] for member in members}
+        for job_id, name in session.query(Job.id, Job.name).filter(
+                Job.active==True).all():
+            owner = assigner.owner(job_id, job_tags[name])
+            if owner is not None:
+                assignment[owner].append(name)
+        return {'enabled': sharding.enabled(), 'members': members,
+                'assignment': {m: sorted(jobs) 
+                               for m, jobs in assignment.items()}}
+
+    @classmethod
+    @provide_session
+    def backfill_job(cls, job_name, start, end, session=None):
+        """ Create SCHEDULED tasks for the runs of the job between
+        start and end (job's local time) that have no task yet, the
+        scheduler sends them. Returns the number of tasks created. """
+        job = session.query(Job).filter(Job.name==job_name).first()
+        if not job:
+            logger.error("Cannot find job name {}".format(job_name))
+            return 0
+        start, end = parse_datetime(start), parse_datetime(end)
+        existing = set(ts for ts, in session.query(
+                TaskInstance.execution_date).filter(
+                TaskInstance.job_id==job.id).filter(
+                TaskInstance.execution_date.between(start, end)).all())
+        runs = [ts for ts in get_runs_between(job.schedule_interval, 
+                start, end) if ts not in existing]
+        TaskInstance.insert_scheduled(session, job, runs)
+        session.commit()
+        logger.info("backfill job {} from {} to {}: {} tasks, {} "
+                "already ran".format(job_name, start, end, len(runs), 
+                len(existing)))
+        bump_versions('tasks', *job_entities([job_name]))
+        return len(runs)
 
     @classmethod
     @provide_session
@@ -773,6 +1723,7 @@ class RequestHandler:
                 ).with_for_update().first()
         if job:
             task_id = job.schedule_task(session, force_run=True)
+            cls._job_changed(job_name)
             return task_id 
         return None
 
@@ -786,6 +1737,7 @@ class RequestHandler:
 
         session.add(alert)
         session.commit()
+        bump_versions('{}:{}'.format(inst_type, name), RECIPIENTS_ENTITY)
 
     @classmethod
     @provide_session
@@ -801,6 +1753,7 @@ class RequestHandler:
         for s in sub:
             session.delete(s)
         session.commit()
+        bump_versions('{}:{}'.format(inst_type, name), RECIPIENTS_ENTITY)
 
     @classmethod
     @provide_session
@@ -814,9 +1767,84 @@ class RequestHandler:
         return sorted([s[0] for s in subs])
 
 
-# class Monitor(object):
-    # this is to check scheduler heartbeat
-    # should be able to give alert if scheduler
-    # stops sending heartbeat
+class Monitor(object):
+    """ Watchdog of the scheduler: alerts when no scheduler holds the
+    lease, the heartbeat is older than [monitor] max_heartbeat_age or
+    an active job is overdue by more than max_lag seconds. """
+
+    def __init__(self):
+        self.interval = conf.getint('monitor', 'interval')
+        self.max_heartbeat_age = conf.getint('monitor', 'max_heartbeat_age')
+        self.max_lag = conf.getint('monitor', 'max_lag')
+        self.realert_interval = conf.getint('monitor', 'realert_interval')
+        self.alert_to = [e.strip() for e in conf.get('monitor', 
+                'alert_to').split(',') if e.strip()]
+        self._alerted = {}    # problem -> last alert time
+
+    @provide_session
+    def status(self, session=None):
+        """ {'leader', 'heartbeat_age', 'pass_seconds', 'lag',
+        'problems': {problem: message}}, ages in seconds """
+        utcnow = datetime.utcnow()
+        leader = lease_holder(ScheduleManager.name)
+        heartbeat = get_redis_conn().hgetall(ScheduleManager.heartbeat_key)
+        age = None
+        if heartbeat.get('ts'):
+            age = (utcnow - datetime.strptime(heartbeat['ts'], 
+                    '%Y-%m-%dT%H:%M:%S')).total_seconds()
+        # the most overdue job, what a working scheduler would run next
+        oldest = session.query(func.min(Job.next_run_utc)).filter(
+                Job.active==True).scalar()
+        lag = max((utcnow - oldest).total_seconds(), 0) if oldest else 0
+
+        problems = {}
+        if leader is None:
+            problems['leader'] = "No scheduler holds the lease"
+        if age is None:
+            problems['heartbeat'] = "No scheduler heartbeat"
+        elif age > self.max_heartbeat_age:
+            problems['heartbeat'] = "Last scheduler heartbeat {:.0f} " \
+                    "seconds ago".format(age)
+        if lag > self.max_lag:
+            problems['lag'] = "Scheduler is {:.0f} seconds behind " \
+                    "schedule".format(lag)
+        return {'leader': leader, 'heartbeat_age': age, 
+                'pass_seconds': heartbeat.get('pass_seconds'), 
+                'lag': lag, 'problems': problems}
+
+    def start(self):
+        logger.info("Start scheduler monitor")
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Scheduler monitor check failed")
+            sleep(self.interval)
+
+    def run_once(self):
+        problems = self.status()['problems']
+        now = datetime.now()
+        for problem, message in problems.items():
+            last = self._alerted.get(problem)
+            if (last is None or (now - last).total_seconds() >= 
+                    self.realert_interval):
+                logger.error(message)
+                self._alert("Dashboard - Scheduler Alert", message)
+                self._alerted[problem] = now
+        for problem in list(self._alerted):
+            if problem not in problems:
+                del self._alerted[problem]
+                message = "Scheduler {} recovered".format(problem)
+                logger.info(message)
+                self._alert("Dashboard - Scheduler Recovered", message)
+        return problems
+
+    def _alert(self, subject, message):
+        if not self.alert_to:
+            return
+        try:
+            send_email(subject, self.alert_to, message)
+        except Exception:
+            logger.exception("Cannot send scheduler alert")
 
 # class Worker(RedisObject): pass
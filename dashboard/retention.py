@@ -0,0 +1,178 @@
+""" Task history retention.
+
+Finished task instances older than their job's retention are appended
+to gzipped JSON-lines archives, one file per job and month
+(<archive_dir>/<job_id>/<YYYY-MM>.jsonl.gz), and then removed with
+chunked set-based DELETEs so no statement holds many row locks.
+"""
+from datetime import datetime, timedelta
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+
+from sqlalchemy import func
+
+from dashboard.configuration import conf, mkdir_p
+from dashboard.models import (RUNNING_STATES, SCHEDULED, Job, 
+        RetentionPolicy, Tag, TaskInstance, TaskResult)
+from dashboard.utils.db import provide_session
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = (SCHEDULED,) + RUNNING_STATES
+# YYYY-MM of the archive files, requested months must match it
+MONTH_RE = re.compile(r'\d{4}-\d{2}')
+ARCHIVE_COLUMNS = ['id', 'job_id', 'job_name', 'execution_date', 'operator',
+        'command', 'state', 'task_id', 'result', 'started_at', 'finished_at']
+
+
+def archive_dir():
+    return conf.get('retention', 'archive_dir')
+
+
+def valid_month(month):
+    return bool(MONTH_RE.fullmatch(month))
+
+
+def _archive_path(job_id, month):
+    if not valid_month(month):
+        raise ValueError("month must be YYYY-MM, not {!r}".format(month))
+    return os.path.join(archive_dir(), str(job_id), month + '.jsonl.gz')
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def write_archive(rows):
+    """ append row dicts to their job/month archive files """
+    files = {}
+    for row in rows:
+        month = row['execution_date'][:7]
+        files.setdefault((row['job_id'], month), []).append(row)
+    for (job_id, month), month_rows in files.items():
+        path = _archive_path(job_id, month)
+        mkdir_p(os.path.dirname(path))
+        # every append adds a gzip member, readers see one stream
+        with gzip.open(path, 'at') as f:
+            for row in month_rows:
+                f.write(json.dumps(row) + '\n')
+
+
+def archived_months(job_id):
+    """ months with archived tasks for a job, newest first """
+    paths = glob.glob(os.path.join(archive_dir(), str(job_id), '*.jsonl.gz'))
+    return sorted((os.path.basename(p)[:-len('.jsonl.gz')] for p in paths),
+                  reverse=True)
+
+
+def read_archive(job_id, month):
+    """ archived task dicts of one job and month, newest first """
+    path = _archive_path(job_id, month)
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, 'rt') as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return sorted(rows, key=lambda r: r['execution_date'], reverse=True)
+
+
+def delete_task_instances(session, criteria, chunk_size=None):
+    """ DELETE task instances matching criteria, chunk_size rows per
+    statement and transaction; returns the number of deleted rows """
+    chunk_size = chunk_size or conf.getint('retention', 'chunk_size')
+    deleted = 0
+    while True:
+        ids = [r[0] for r in session.query(TaskInstance.id).filter(
+                *criteria).order_by(TaskInstance.id).limit(chunk_size).all()]
+        if not ids:
+            return deleted
+        deleted += session.query(TaskInstance).filter(
+                TaskInstance.id.in_(ids)).delete(synchronize_session=False)
+        session.commit()
+
+
+@provide_session
+def get_retention_days(session=None):
+    """ {job_id: days to keep}. A job policy wins over tag policies,
+    among tag policies the longest one wins, otherwise the default. """
+    default = conf.getint('retention', 'default_days')
+    job_days = dict(session.query(RetentionPolicy.name,
+            RetentionPolicy.keep_days).filter(
+            RetentionPolicy.scope=='job').all())
+    tag_days = dict(session.query(Tag.job_name,
+            func.max(RetentionPolicy.keep_days)).filter(
+            RetentionPolicy.scope=='tag').filter(
+            RetentionPolicy.name==Tag.name).group_by(Tag.job_name).all())
+    days = {}
+    for job_id, name in session.query(Job.id, Job.name).all():
+        days[job_id] = job_days.get(name, tag_days.get(name, default))
+    return days
+
+
+def _archive_chunk(session, criteria, chunk_size):
+    rows = session.query(TaskInstance).filter(*criteria).order_by(
+            TaskInstance.id).limit(chunk_size).all()
+    if not rows:
+        return 0
+    digests = set(r.result_digest for r in rows if r.result_digest)
+    blobs = {}
+    if digests:
+        blobs = {b.digest: b for b in session.query(TaskResult).filter(
+                TaskResult.digest.in_(digests)).all()}
+    archived = []
+    for row in rows:
+        item = {c: _to_json(getattr(row, c)) for c in ARCHIVE_COLUMNS}
+        # blobs may be collected after the rows are gone
+        if row.result_digest in blobs:
+            item['result'] = blobs[row.result_digest].text()
+        archived.append(item)
+    write_archive(archived)
+    deleted = session.query(TaskInstance).filter(TaskInstance.id.in_(
+            [r.id for r in rows])).delete(synchronize_session=False)
+    session.commit()
+    return deleted
+
+
+@provide_session
+def prune_task_history(now=None, session=None):
+    """ archive and delete finished tasks past their retention """
+    now = now or datetime.now()
+    chunk_size = conf.getint('retention', 'chunk_size')
+    by_days = {}
+    for job_id, days in get_retention_days(session=session).items():
+        by_days.setdefault(days, []).append(job_id)
+
+    pruned = 0
+    for days, job_ids in by_days.items():
+        cutoff = now - timedelta(days=days)
+        # bounded IN lists, one group of jobs at a time
+        for i in range(0, len(job_ids), chunk_size):
+            criteria = [TaskInstance.job_id.in_(job_ids[i:i + chunk_size]),
+                        TaskInstance.execution_date < cutoff,
+                        ~TaskInstance.state.in_(ACTIVE_STATES)]
+            while True:
+                deleted = _archive_chunk(session, criteria, chunk_size)
+                pruned += deleted
+                if deleted < chunk_size:
+                    break
+    collected = collect_task_results(session=session)
+    logger.info("Pruned {} task instances, {} result blobs".format(
+                pruned, collected))
+    return pruned
+
+
+@provide_session
+def collect_task_results(session=None):
+    """ delete result blobs no task instance points to any more """
+    referenced = session.query(TaskInstance.result_digest).filter(
+            TaskInstance.result_digest != None)
+    deleted = session.query(TaskResult).filter(
+            ~TaskResult.digest.in_(referenced)).delete(
+            synchronize_session=False)
+    session.commit()
+    return deleted
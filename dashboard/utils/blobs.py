@@ -0,0 +1,43 @@
+""" Compression codecs for stored task results.
+
+zlib is always available, zstd needs the optional `zstandard` package
+and falls back to zlib when it is missing.
+"""
+import hashlib
+import logging
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(data):
+    """ sha256 hex digest, identical outputs share one blob """
+    return hashlib.sha256(data).hexdigest()
+
+
+def resolve_codec(codec):
+    if codec == 'zstd' and zstandard is None:
+        logger.warning("zstandard is not installed, use zlib for results")
+        return 'zlib'
+    if codec not in ('zlib', 'zstd'):
+        raise ValueError("Unknown codec {}".format(codec))
+    return codec
+
+
+def compress(data, codec='zlib'):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+
+def decompress(data, codec='zlib'):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read zstd results")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
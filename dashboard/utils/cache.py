@@ -0,0 +1,98 @@
+""" Versioned redis cache for web pages.
+
+Every cached value depends on a few entities ('jobs', 'job:<name>',
+'tag:<name>', 'tasks'), each with a version counter in redis. The
+cache key includes the current versions, so writers invalidate by
+bumping a counter after they commit and stale entries simply stop
+being read (and expire after ttl). Everything depends on 'all' as
+well, bumping it invalidates the whole cache.
+"""
+import logging
+import pickle
+
+from dashboard.configuration import conf
+from dashboard.utils.db import get_redis_conn
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "cache/version/{}"
+VALUE_KEY = "cache/value/{name}/{key}/{versions}"
+STATS_KEY = "cache/stats"
+GLOBAL_ENTITY = "all"
+
+
+def bump_versions(*entities):
+    """ invalidate everything cached for entities, call after commit """
+    if not entities:
+        return
+    try:
+        tx = get_redis_conn().pipeline(transaction=False)
+        for entity in set(entities):
+            tx.incr(VERSION_KEY.format(entity))
+        tx.execute()
+    except Exception:
+        # entries still expire after ttl
+        logger.exception("Cannot bump cache versions {}".format(entities))
+
+
+def get_versions(entities):
+    """ current version of each entity, 0 if never bumped """
+    versions = get_redis_conn().mget([VERSION_KEY.format(e) for e in entities])
+    return tuple(int(v) if v is not None else 0 for v in versions)
+
+
+def job_entities(job_names):
+    return ['job:{}'.format(name) for name in job_names]
+
+
+class VersionedCache(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def enabled(self):
+        return conf.getboolean('cache', 'enabled')
+
+    def get_or_set(self, key, entities, compute, ttl=None):
+        """ cached value of compute() for key under the current versions
+        of entities, computed and stored on a miss """
+        if not self.enabled:
+            return compute()
+        ttl = ttl or conf.getint('cache', 'ttl')
+        entities = [GLOBAL_ENTITY] + list(entities)
+        try:
+            redis_conn = get_redis_conn()
+            value_key = VALUE_KEY.format(name=self.name, key=key,
+                    versions=".".join(str(v) for v in get_versions(entities)))
+            cached = redis_conn.get(value_key)
+        except Exception:
+            logger.exception("Cache lookup failed for {}".format(key))
+            return compute()
+
+        if cached is not None:
+            self._count('hits')
+            return pickle.loads(cached)
+        self._count('misses')
+        value = compute()
+        try:
+            redis_conn.set(value_key, pickle.dumps(value,
+                    pickle.HIGHEST_PROTOCOL), ex=ttl)
+        except Exception:
+            logger.exception("Cannot cache {}".format(key))
+        return value
+
+    def _count(self, outcome):
+        try:
+            get_redis_conn().hincrby(STATS_KEY,
+                    "{}:{}".format(self.name, outcome), 1)
+        except Exception:
+            pass
+
+
+def cache_stats():
+    """ {'<cache>:hits': n, '<cache>:misses': n, ...} """
+    return {k: int(v) for k, v in get_redis_conn().hgetall(STATS_KEY).items()}
+
+
+page_cache = VersionedCache('page')
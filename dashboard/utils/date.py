@@ -1,21 +1,94 @@
+from bisect import bisect_left
+from collections import namedtuple
 import croniter
-from datetime import datetime
-import pandas as pd 
+from datetime import datetime, time, timedelta
+from dateutil import parser as dt_parser
+from functools import lru_cache
 import re
+try:
+    from zoneinfo import ZoneInfo as _get_tz
+except ImportError:    # python < 3.9
+    from dateutil.tz import gettz as _get_tz
 
-# probably should use datetime and dateutils
-# but pandas makes it so simple...
+
+UTC = _get_tz('UTC')
+
+
+@lru_cache(maxsize=None)
+def get_tz(timezone):
+    """ cached tzinfo for a timezone name like 'US/Eastern' """
+    tz = _get_tz(timezone)
+    if tz is None:
+        raise ValueError("Unknown timezone {}".format(timezone))
+    return tz
+
+
+def parse_datetime(value):
+    """ datetime from a datetime or a string such as '2017-01-01 16:00'
+    or '16:00' (today) """
+    if isinstance(value, datetime):
+        return value
+    return dt_parser.parse(value)
+
+
+# Local times are naive datetimes in the job timezone. An ambiguous
+# time (DST ends) resolves to its first occurrence and a nonexistent
+# one (DST starts) is shifted forward by the gap, so the scheduler
+# never raises on a transition day.
 def convert_to_utc(timestamp_str, timezone):
-    return pd.to_datetime(timestamp_str).\
-                tz_localize(timezone).astimezone('UTC').\
+    return parse_datetime(timestamp_str).replace(
+                tzinfo=get_tz(timezone), fold=0).astimezone(UTC).\
                 replace(tzinfo=None)
 
 def convert_to_local(timestamp, timezone):
-	return pd.to_datetime(timestamp).\
-				tz_localize('UTC').astimezone(timezone).\
-				replace(tzinfo=None)
+	return parse_datetime(timestamp).replace(tzinfo=UTC).\
+				astimezone(get_tz(timezone)).replace(tzinfo=None)
+
+
+def _convert_batch(timestamps, convert):
+    """ apply convert to the start and end of each distinct day and
+    shift whole days at once, per timestamp only on transition days.
+    A datetime64 array in gives a datetime64 array out, anything else
+    a list of datetimes. """
+    import numpy as np    # deferred, only batch callers need it
+    as_array = isinstance(timestamps, np.ndarray)
+    if as_array:
+        values = timestamps.astype('datetime64[us]')
+    else:
+        values = np.array([parse_datetime(ts) for ts in timestamps],
+                dtype='datetime64[us]')
+    days, inverse = np.unique(values.astype('datetime64[D]'),
+                return_inverse=True)
+    starts = days.astype('datetime64[us]')
+    ends = starts + np.timedelta64(24 * 3600 * 10 ** 6 - 1, 'us')
+    start_offsets = np.array([convert(ts) - ts for ts in
+                starts.astype(datetime)], dtype='timedelta64[us]')
+    end_offsets = np.array([convert(ts) - ts for ts in
+                ends.astype(datetime)], dtype='timedelta64[us]')
+    offsets = start_offsets[inverse]
+    for i in np.nonzero((start_offsets != end_offsets)[inverse])[0]:
+        ts = values[i].astype(datetime)
+        offsets[i] = convert(ts) - ts
+    if as_array:
+        return values + offsets
+    return list((values + offsets).astype(datetime))
 
 
+def convert_to_utc_batch(timestamps, timezone):
+    """ vectorized convert_to_utc for many local times in one timezone """
+    if not len(timestamps):
+        return []
+    return _convert_batch(timestamps,
+                lambda ts: convert_to_utc(ts, timezone))
+
+
+def convert_to_local_batch(timestamps, timezone):
+    """ vectorized convert_to_local for many utc times """
+    if not len(timestamps):
+        return []
+    return _convert_batch(timestamps,
+                lambda ts: convert_to_local(ts, timezone))
+
 
 cron_presets = {
     '@hourly': '{m} * * * *',
@@ -58,9 +131,188 @@ def get_cron_schedule_interval(schedule_interval, start_dt, weekday_to_run):
             weekday=",".join(weekday_to_run))
     return cron_str
 
+#####################
+# compiled crontabs
+#####################
+
+# longest gap between two runs we search for, e.g. '0 0 29 2 *'
+# only fires every 4 years
+CRON_HORIZON_DAYS = 366 * 5
+
+# bitsets of allowed minutes/hours/days of month/months/days of
+# week (0 is Sunday), day_minutes are the sorted minutes of a day
+# (hour * 60 + minute) at which the crontab fires
+CompiledCron = namedtuple('CompiledCron', ['minutes', 'hours', 'doms',
+        'months', 'dows', 'dom_any', 'dow_any', 'day_minutes'])
+
+
+def _to_bitset(values, offset=0, modulo=None):
+    bits = 0
+    for v in values:
+        v = int(v)
+        if modulo is not None:
+            v %= modulo
+        bits |= 1 << (v - offset)
+    return bits
+
+
+@lru_cache(maxsize=1024)
+def compile_cron(crontab):
+    """ Parse a crontab once into bitsets, cached by crontab string.
+    Returns None for expressions the bitsets cannot represent
+    (seconds field, 'L', 'W', '#'), those go through croniter. """
+    fields = crontab.upper().split()
+    # croniter expands '5#2' to [5] and keeps the nth weekday apart
+    if len(fields) == 5 and (any(c in fields[2] for c in 'LW') or
+            any(c in fields[4] for c in '#L')):
+        return None
+    expanded = croniter.croniter(crontab).expanded
+    if len(expanded) != 5:
+        return None
+    fields = []
+    for values in expanded:
+        if values == ['*']:
+            fields.append(None)
+        elif all(isinstance(v, int) for v in values):
+            fields.append(values)
+        else:
+            return None
+    minutes, hours, doms, months, dows = fields
+    minutes = minutes if minutes is not None else range(60)
+    hours = hours if hours is not None else range(24)
+    return CompiledCron(
+        minutes=_to_bitset(minutes),
+        hours=_to_bitset(hours),
+        doms=_to_bitset(doms if doms is not None else range(1, 32), 1),
+        months=_to_bitset(months if months is not None else range(1, 13), 1),
+        dows=_to_bitset(dows if dows is not None else range(7), modulo=7),
+        dom_any=doms is None,
+        dow_any=dows is None,
+        day_minutes=tuple(sorted(h * 60 + m for h in hours for m in minutes)))
+
+
+def _cron_matches_day(cron, day):
+    if not cron.months >> (day.month - 1) & 1:
+        return False
+    dom_ok = bool(cron.doms >> (day.day - 1) & 1)
+    dow_ok = bool(cron.dows >> ((day.weekday() + 1) % 7) & 1)
+    # cron semantics: if both day fields are restricted either may match
+    if not cron.dom_any and not cron.dow_any:
+        return dom_ok or dow_ok
+    return dom_ok and dow_ok
+
+
 def get_next_run_ts(crontab, current):
-	cron = croniter.croniter(crontab, current)
-	return cron.get_next(datetime)
+    """ first run of crontab strictly after current (naive local dt) """
+    if current is None:
+        current = datetime.now()
+    cron = compile_cron(crontab)
+    if cron is None:
+        return croniter.croniter(crontab, current).get_next(datetime)
+
+    ts = current.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = ts.date()
+    start = ts.hour * 60 + ts.minute
+    for _ in range(CRON_HORIZON_DAYS):
+        if _cron_matches_day(cron, day):
+            i = bisect_left(cron.day_minutes, start)
+            if i < len(cron.day_minutes):
+                return datetime.combine(day, time()) + timedelta(
+                        minutes=cron.day_minutes[i])
+        day += timedelta(days=1)
+        start = 0
+    raise ValueError("crontab {} never fires after {}".format(
+                crontab, current))
+
+
+def _next_run_array(crontab, minutes):
+    """ vectorized get_next_run_ts for one crontab, `minutes` is an
+    int64 array of minutes since epoch; returns the same """
+    import numpy as np
+    cron = compile_cron(crontab)
+    day_minutes = np.array(cron.day_minutes, dtype=np.int64)
+    start = minutes + 1
+    day = start // 1440
+    minute_of_day = start % 1440
+
+    # which days in the horizon the crontab fires on
+    days = np.arange(day.min(), day.max() + CRON_HORIZON_DAYS + 1)
+    dates = days.astype('datetime64[D]')
+    month_start = dates.astype('datetime64[M]')
+    month = month_start.astype(np.int64) % 12 + 1
+    dom = (dates - month_start.astype('datetime64[D]')).astype(np.int64) + 1
+    # 1970-01-01 was a Thursday
+    dow = (days + 4) % 7
+    month_ok = (cron.months >> (month - 1)) & 1 == 1
+    dom_ok = (cron.doms >> (dom - 1)) & 1 == 1
+    dow_ok = (cron.dows >> dow) & 1 == 1
+    if not cron.dom_any and not cron.dow_any:
+        day_ok = month_ok & (dom_ok | dow_ok)
+    else:
+        day_ok = month_ok & dom_ok & dow_ok
+
+    # index of the first firing day at or after each day
+    big = len(days)
+    idx = np.where(day_ok, np.arange(big), big)
+    next_ok = np.minimum.accumulate(idx[::-1])[::-1]
+
+    offset = day - days[0]
+    i = np.searchsorted(day_minutes, minute_of_day)
+    same_day = day_ok[offset] & (i < len(day_minutes))
+    later = np.minimum(offset + 1, big - 1)
+    next_day = next_ok[later]
+    if not same_day.all() and (next_day[~same_day] >= big).any():
+        raise ValueError("crontab {} never fires in horizon".format(crontab))
+    return np.where(same_day,
+        day * 1440 + day_minutes[np.minimum(i, len(day_minutes) - 1)],
+        (days[0] + next_day) * 1440 + day_minutes[0])
+
+
+def get_next_run_ts_bulk(crontabs, currents):
+    """ get_next_run_ts for many (crontab, current) pairs at once.
+
+    Pairs are grouped by crontab and each group is computed with
+    NumPy; returns a list of datetimes in input order.
+    """
+    import numpy as np
+    currents = [datetime.now() if c is None else c for c in currents]
+    results = [None] * len(currents)
+    groups = {}
+    for i, crontab in enumerate(crontabs):
+        groups.setdefault(crontab, []).append(i)
+    for crontab, positions in groups.items():
+        if compile_cron(crontab) is None:
+            for i in positions:
+                results[i] = get_next_run_ts(crontab, currents[i])
+            continue
+        minutes = np.array([currents[i] for i in positions],
+                dtype='datetime64[m]').astype(np.int64)
+        next_runs = _next_run_array(crontab, minutes).astype(
+                'datetime64[m]').astype(datetime)
+        for i, ts in zip(positions, next_runs):
+            results[i] = ts
+    return results
+
+
+def get_runs_between(crontab, start, end, limit=None):
+    """ runs of crontab with start <= run <= end (naive local dts),
+    the first limit of them if limit is given """
+    runs = []
+    current = get_next_run_ts(crontab, start - timedelta(minutes=1))
+    while current <= end and (limit is None or len(runs) < limit):
+        if current >= start:
+            runs.append(current)
+        current = get_next_run_ts(crontab, current)
+    return runs
+
+
+def get_next_n_runs(crontab, current, n=5):
+    """ preview the next n runs of a crontab after current """
+    runs = []
+    for _ in range(n):
+        current = get_next_run_ts(crontab, current)
+        runs.append(current)
+    return runs
 
 
 
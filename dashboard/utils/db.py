@@ -1,13 +1,12 @@
 from contextlib import contextmanager
 from functools import wraps
 import logging
-import pyodbc
 import re
 from redis import StrictRedis
 from sqlalchemy import create_engine 
 from sqlalchemy.orm import scoped_session, sessionmaker
 
-from dashboard.configuration import conf
+from dashboard.configuration import conf, ensure_dashboard_home
 from dashboard.utils.miscellaneous import Singleton
 
 logger = logging.getLogger(__name__)
@@ -30,11 +29,13 @@ class RedisConn(StrictRedis):
         v = v.decode() if isinstance(v, bytes) else v
         return v
 
+# created on first use, not at import, so every process
+# (and every forked celery worker) builds its own
 _redis_conn = None 
 engine = None 
 session_factory = None
 
-def configure_databases():
+def configure_redis():
     # config manager heart beat 
     manager_heart_beat = conf.get('manager', 'send_heart_beat')
     global _redis_conn
@@ -49,6 +50,7 @@ def configure_databases():
             logger.exception('Cannot config redis with {}'.format(
                         manager_heart_beat))
 
+def configure_sql():
     # config webserver db 
     global engine
     global session_factory    
@@ -60,12 +62,17 @@ def configure_databases():
         engine_args['pool_size'] = conf.getint('core', 'sqlalchemy_pool_size')
         engine_args['pool_recycle'] = conf.getint('core',
                                                   'sqlalchemy_pool_recycle')
+    else:
+        # default sqlite db lives in dashboard home
+        ensure_dashboard_home()
 
     engine = create_engine(web_db, **engine_args)
     session_factory = scoped_session(
         sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
-configure_databases()
+def configure_databases():
+    configure_redis()
+    configure_sql()
 
 
 #####################
@@ -73,12 +80,24 @@ configure_databases()
 #####################
 
 def get_redis_conn():
+    if _redis_conn is None:
+        configure_redis()
     return _redis_conn
 
+def get_engine():
+    if engine is None:
+        configure_sql()
+    return engine
+
+def get_session_factory():
+    if session_factory is None:
+        configure_sql()
+    return session_factory
+
 @contextmanager
 def get_sql_session():
     """ This webserver db connect session """
-    session = session_factory()
+    session = get_session_factory()()
     session._model_changes = {}
     try:
         yield session
@@ -92,26 +111,36 @@ def get_sql_session():
 
 @contextmanager
 def open_sql_server_session(db, commit=False):
-    """ This is data sql server session """
-    driver = conf.get('database', 'DRIVER')
-    server = conf.get('database', db)
-    conn_str = "Driver={%s};Server=%s;Database=%s;Trusted_Connection=Yes;" %(driver, server, db)
-
-    conn = pyodbc.connect(conn_str)
-    cursor = conn.cursor()
+    """ This is data sql server session, on a pooled connection """
+    from dashboard.utils.sql_pool import get_pool, publish_stats
+    pool = get_pool(db)
+    conn = pool.checkout()
+    discard = False
+    cursor = None
     try:
+        # checked out from here on, checked in by finally
+        cursor = conn.cursor()
         yield cursor
-    except pyodbc.DatabaseError as e:
-        error, = e.args
-        cursor.execute("ROLLBACK")
-        raise e 
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            # broken connection, do not pool it
+            discard = True
+        raise
     else:
         if commit:
-            cursor.execute("COMMIT")
+            conn.commit()
         else:
-            cursor.execute("ROLLBACK")
+            conn.rollback()
     finally:
-        conn.close()
+        try:
+            if cursor is not None:
+                cursor.close()
+        except Exception:
+            discard = True
+        pool.checkin(conn, discard=discard)
+        publish_stats()
 
 
 def provide_session(func):
@@ -130,7 +159,7 @@ def provide_session(func):
             func_params.index(arg_session) < len(args)
         if not (arg_session in kwargs or session_in_args):
             needs_session = True
-            session = session_factory()
+            session = get_session_factory()()
             session._model_changes = {}
             kwargs[arg_session] = session
         result = func(*args, **kwargs)
@@ -1,6 +1,8 @@
 from email.mime.text import MIMEText
+import logging
 import re
 import smtplib
+import time
 
 from dashboard.configuration import conf 
 
@@ -9,26 +11,107 @@ SMTP_SERVER = conf.get('smtp', 'mail_server')
 SMTP_PORT = int(conf.get('smtp', 'mail_port'))
 SMTP_FROM = conf.get('smtp', 'mail_from')
 
+logger = logging.getLogger(__name__)
+
 # TODO:
 # should have a better email util...
-def send_email(subject, to, body): 
-    s = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+def _build_message(subject, to, body):
+    """ (mime message, recipient list) """
     msg = MIMEText(body)
     msg["Subject"] = subject 
     msg["From"] = SMTP_FROM
 
     if isinstance(to, list):
-        to = ", ".join(to)
         recipients = to
+        to = ", ".join(to)
     else:
         recipients = [to]
     msg["To"] = to
+    return msg, recipients
+
+
+def send_email(subject, to, body): 
+    s = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+    msg, recipients = _build_message(subject, to, body)
     try:
         s.sendmail(SMTP_FROM, recipients, msg.as_string())
     finally:
         s.quit()
 
 
+def transient_error(e):
+    """ whether sending again later may succeed: dropped or refused
+    connections and 4xx replies, not 5xx replies """
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in e.recipients.values())
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    # socket errors: refused, reset, timed out, unknown host
+    return (isinstance(e, OSError) and 
+            not isinstance(e, smtplib.SMTPException))
+
+
+class SMTPConnection(object):
+    """ One smtp connection kept open across messages.
+
+    Reconnects when the server dropped it or it was idle for longer
+    than idle_timeout seconds (servers close idle sessions anyway).
+    A send failing with a transient error is retried up to retries
+    times on a new connection, retry_delay more seconds apart each time.
+    """
+
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, idle_timeout=60,
+                retries=2, retry_delay=1):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._smtp = None
+        self._last_used = 0
+
+    def _connect(self):
+        self.close()
+        self._smtp = smtplib.SMTP(self.host, self.port)
+        self._last_used = time.time()
+        logger.info("Connected to smtp server {}:{}".format(
+                    self.host, self.port))
+
+    def _usable(self):
+        if self._smtp is None:
+            return False
+        # a connection dropped sooner fails the send and is retried
+        return time.time() - self._last_used <= self.idle_timeout
+
+    def send(self, subject, to, body):
+        msg, recipients = _build_message(subject, to, body)
+        for attempt in range(self.retries + 1):
+            try:
+                if not self._usable():
+                    self._connect()
+                self._smtp.sendmail(SMTP_FROM, recipients, msg.as_string())
+                self._last_used = time.time()
+                return
+            except Exception as e:
+                # the connection may be half broken, start over
+                self.close()
+                if attempt == self.retries or not transient_error(e):
+                    raise
+                logger.warning("Sending mail failed ({}), retry".format(e))
+                # a dropped idle connection is retried at once
+                time.sleep(self.retry_delay * attempt)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
 EMAIL_REGEX = re.compile(r"[^@]+@[^@]+\.[^@]+")
 
 def valid_email(email_str):
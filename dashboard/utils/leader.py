@@ -0,0 +1,156 @@
+""" Leader election on a redis lease.
+
+The leader holds `key` set to its identity with a ttl (SET NX PX) and
+a background thread extends it every renew_every seconds, so a pass
+longer than the ttl does not lose it; standbys retry the SET until the
+key expires, so a crashed leader is replaced within one ttl. Renewal
+and release only touch the key while it still holds our identity.
+
+The main loop reports progress with touch() (keep() does too). A
+leader that made none for max_stall seconds, e.g. stuck on a db lock,
+stops renewing and gives the lease up so a standby replaces it.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+from dashboard.utils.db import get_redis_conn
+
+logger = logging.getLogger(__name__)
+
+# KEYS: lease key; ARGV: identity, ttl ms
+_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: lease key; ARGV: identity
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_scripts = {}
+
+
+def _script(name, source):
+    if name not in _scripts:
+        _scripts[name] = get_redis_conn().register_script(source)
+    return _scripts[name]
+
+
+def process_identity():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def lease_holder(key):
+    """ identity of the current leader, None if there is none """
+    holder = get_redis_conn().get(key)
+    return holder.decode() if isinstance(holder, bytes) else holder
+
+
+class LeaderLease(object):
+
+    def __init__(self, key, ttl=10, renew_every=None, identity=None,
+                max_stall=None):
+        """ ttl, renew_every and max_stall in seconds, renew well
+        within ttl; max_stall None renews as long as the process runs """
+        self.key = key
+        self.ttl_ms = int(ttl * 1000)
+        self.renew_every = renew_every or ttl / 3.
+        self.identity = identity or process_identity()
+        self.max_stall = max_stall
+        self.is_leader = False
+        self._renewed_at = None
+        self._progress_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._renewer = None
+
+    def acquire(self):
+        """ try once to become the leader, renewed in the background
+        from then on """
+        if get_redis_conn().set(self.key, self.identity, nx=True,
+                px=self.ttl_ms):
+            with self._lock:
+                self.is_leader = True
+                self._renewed_at = time.time()
+            self.touch()
+            self._start_renewer()
+        return self.is_leader
+
+    def _start_renewer(self):
+        if self._renewer is not None:
+            self._stop.set()
+            self._renewer.join()
+        self._stop = threading.Event()
+        self._renewer = threading.Thread(target=self._renew_loop,
+                args=(self._stop,), name="lease-" + self.key)
+        self._renewer.daemon = True
+        self._renewer.start()
+
+    def _renew_loop(self, stop):
+        while not stop.wait(self.renew_every):
+            if self.stalled():
+                logger.warning("No progress for {:.0f} seconds, give up "
+                        "lease {}".format(time.time() - self._progress_at,
+                        self.key))
+                try:
+                    self.release()
+                except Exception:
+                    # expires after the ttl
+                    logger.exception("Cannot release lease {}".format(
+                                self.key))
+                return
+            if not self.renew():
+                return
+
+    def touch(self):
+        """ the main loop is making progress """
+        self._progress_at = time.time()
+
+    def stalled(self):
+        return (self.max_stall is not None and
+                time.time() - self._progress_at > self.max_stall)
+
+    def renew(self):
+        """ extend the lease, False once it was lost """
+        with self._lock:
+            if not self.is_leader:
+                return False
+            try:
+                renewed = _script('renew', _RENEW)(keys=[self.key],
+                        args=[self.identity, self.ttl_ms])
+            except Exception:
+                # cannot tell if another process took over, step down
+                renewed = 0
+            self.is_leader = bool(renewed)
+            if self.is_leader:
+                self._renewed_at = time.time()
+            return self.is_leader
+
+    def keep(self):
+        """ renew if renew_every has passed, returns is_leader """
+        self.touch()
+        if not self.is_leader:
+            return False
+        if time.time() - self._renewed_at >= self.renew_every:
+            return self.renew()
+        return True
+
+    def release(self):
+        """ give up the lease at once, standbys take over on their
+        next try instead of after the ttl """
+        self._stop.set()
+        with self._lock:
+            if not self.is_leader:
+                return
+            self.is_leader = False
+        _script('release', _RELEASE)(keys=[self.key],
+                args=[self.identity])
@@ -0,0 +1,248 @@
+""" Redis indexes the dashboard pages read instead of scanning sql.
+
+    index/tags                  zset tag -> number of jobs with the tag
+    index/tag/<tag>             set of job names with the tag
+    index/tag/<tag>/status      hash status -> number of jobs of the tag
+    index/job/<job>/tags        set of the job's tags
+    index/job_status            hash job -> status name
+    index/running               zset task instance id -> execution ts
+    index/job/<job>/running     zset of the job's running task ids
+
+They are kept up to date by RequestHandler writes and the scheduler,
+each change is one lua script call so counters and sets move together.
+`rebuild` recreates all of them from sql rows, readers fall back to
+sql while `index/ready` is missing.
+"""
+import calendar
+import logging
+
+from dashboard.utils.db import get_redis_conn
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "index/"
+READY_KEY = "index/ready"
+TAGS_KEY = "index/tags"
+TAG_KEY = "index/tag/{}"
+TAG_STATUS_KEY = "index/tag/{}/status"
+JOB_TAGS_KEY = "index/job/{}/tags"
+JOB_STATUS_KEY = "index/job_status"
+RUNNING_KEY = "index/running"
+JOB_RUNNING_KEY = "index/job/{}/running"
+
+# KEYS: job tags set, job status hash
+# ARGV: job, status ('' keeps the current one), tags...
+_SET_JOB_TAGS = """
+local job = ARGV[1]
+local old_status = redis.call('HGET', KEYS[2], job)
+local status = ARGV[2]
+if status == '' then status = old_status end
+local new_tags = {}
+for i = 3, #ARGV do new_tags[ARGV[i]] = true end
+for _, tag in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    if new_tags[tag] then
+        new_tags[tag] = nil
+        if old_status ~= status then
+            local counts = 'index/tag/' .. tag .. '/status'
+            if old_status then redis.call('HINCRBY', counts, old_status, -1) end
+            if status then redis.call('HINCRBY', counts, status, 1) end
+        end
+    else
+        redis.call('SREM', KEYS[1], tag)
+        redis.call('SREM', 'index/tag/' .. tag, job)
+        if old_status then
+            redis.call('HINCRBY', 'index/tag/' .. tag .. '/status', old_status, -1)
+        end
+        if tonumber(redis.call('ZINCRBY', 'index/tags', -1, tag)) <= 0 then
+            redis.call('ZREM', 'index/tags', tag)
+        end
+    end
+end
+for tag, _ in pairs(new_tags) do
+    redis.call('SADD', KEYS[1], tag)
+    redis.call('SADD', 'index/tag/' .. tag, job)
+    if status then
+        redis.call('HINCRBY', 'index/tag/' .. tag .. '/status', status, 1)
+    end
+    redis.call('ZINCRBY', 'index/tags', 1, tag)
+end
+if status then redis.call('HSET', KEYS[2], job, status) end
+return 1
+"""
+
+# KEYS: job tags set, job status hash; ARGV: job, status
+_SET_JOB_STATUS = """
+local old_status = redis.call('HGET', KEYS[2], ARGV[1])
+if old_status == ARGV[2] then return 0 end
+for _, tag in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+    local counts = 'index/tag/' .. tag .. '/status'
+    if old_status then redis.call('HINCRBY', counts, old_status, -1) end
+    redis.call('HINCRBY', counts, ARGV[2], 1)
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+_scripts = {}
+
+
+def _script(source):
+    if source not in _scripts:
+        _scripts[source] = get_redis_conn().register_script(source)
+    return _scripts[source]
+
+
+def _ts(dt):
+    return calendar.timegm(dt.timetuple()) if dt is not None else 0
+
+
+def _guard(func):
+    """ index writes never fail the sql write they follow,
+    a lost update is fixed by the next rebuild """
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            logger.exception("Cannot update live index ({})".format(
+                        func.__name__))
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+#########
+# writes
+#########
+
+@_guard
+def set_job_tags(job_name, tags, status=None):
+    """ replace the job's tags, status None keeps the current one """
+    _script(_SET_JOB_TAGS)(
+            keys=[JOB_TAGS_KEY.format(job_name), JOB_STATUS_KEY],
+            args=[job_name, status or ''] + list(tags))
+
+
+@_guard
+def set_job_status(job_name, status):
+    _script(_SET_JOB_STATUS)(
+            keys=[JOB_TAGS_KEY.format(job_name), JOB_STATUS_KEY],
+            args=[job_name, status])
+
+
+@_guard
+def remove_job(job_name):
+    set_job_tags(job_name, [])
+    redis_conn = get_redis_conn()
+    task_ids = redis_conn.zrange(JOB_RUNNING_KEY.format(job_name), 0, -1)
+    tx = redis_conn.pipeline()
+    if task_ids:
+        tx.zrem(RUNNING_KEY, *task_ids)
+    tx.delete(JOB_RUNNING_KEY.format(job_name), JOB_TAGS_KEY.format(job_name))
+    tx.hdel(JOB_STATUS_KEY, job_name)
+    tx.execute()
+
+
+@_guard
+def add_running_task(job_name, task_id, execution_date):
+    tx = get_redis_conn().pipeline()
+    tx.zadd(RUNNING_KEY, {task_id: _ts(execution_date)})
+    tx.zadd(JOB_RUNNING_KEY.format(job_name), {task_id: _ts(execution_date)})
+    tx.execute()
+
+
+@_guard
+def remove_running_tasks(tasks):
+    """ tasks: [(job_name, task id)] """
+    if not tasks:
+        return
+    tx = get_redis_conn().pipeline()
+    tx.zrem(RUNNING_KEY, *[task_id for _, task_id in tasks])
+    for job_name, task_id in tasks:
+        tx.zrem(JOB_RUNNING_KEY.format(job_name), task_id)
+    tx.execute()
+
+
+@_guard
+def clear_running_tasks(job_name):
+    redis_conn = get_redis_conn()
+    task_ids = redis_conn.zrange(JOB_RUNNING_KEY.format(job_name), 0, -1)
+    tx = redis_conn.pipeline()
+    if task_ids:
+        tx.zrem(RUNNING_KEY, *task_ids)
+    tx.delete(JOB_RUNNING_KEY.format(job_name))
+    tx.execute()
+
+
+def rebuild(job_tags, job_status, running):
+    """ recreate every index from sql rows.
+
+    job_tags: {job: [tags]}, job_status: {job: status name},
+    running: [(job, task id, execution date)]
+    """
+    redis_conn = get_redis_conn()
+    old_keys = list(redis_conn.scan_iter(match=PREFIX + '*'))
+    tx = redis_conn.pipeline()
+    if old_keys:
+        tx.delete(*old_keys)
+    tags = {}
+    for job, job_tag_names in job_tags.items():
+        status = job_status.get(job)
+        for tag in set(job_tag_names):
+            tags[tag] = tags.get(tag, 0) + 1
+            tx.sadd(TAG_KEY.format(tag), job)
+            tx.sadd(JOB_TAGS_KEY.format(job), tag)
+            if status is not None:
+                tx.hincrby(TAG_STATUS_KEY.format(tag), status, 1)
+    if tags:
+        tx.zadd(TAGS_KEY, tags)
+    if job_status:
+        tx.hmset(JOB_STATUS_KEY, job_status)
+    for job, task_id, execution_date in running:
+        tx.zadd(RUNNING_KEY, {task_id: _ts(execution_date)})
+        tx.zadd(JOB_RUNNING_KEY.format(job), {task_id: _ts(execution_date)})
+    tx.set(READY_KEY, 1)
+    tx.execute()
+    logger.info("Rebuilt live indexes: {} jobs, {} tags, {} running "
+                "tasks".format(len(job_tags), len(tags), len(running)))
+
+
+########
+# reads
+########
+
+def ready():
+    """ False until the first rebuild, or while redis is unreachable """
+    try:
+        return bool(get_redis_conn().exists(READY_KEY))
+    except Exception:
+        logger.exception("Cannot read live index, fall back to sql")
+        return False
+
+
+def tag_names():
+    return sorted(t.decode() for t in get_redis_conn().zrange(TAGS_KEY, 0, -1))
+
+
+def jobs_with_tag(tag):
+    return sorted(j.decode() for j in get_redis_conn().smembers(
+                TAG_KEY.format(tag)))
+
+
+def tag_members():
+    """ {tag: [job names]} """
+    tags = tag_names()
+    tx = get_redis_conn().pipeline(transaction=False)
+    for tag in tags:
+        tx.smembers(TAG_KEY.format(tag))
+    return {tag: sorted(j.decode() for j in jobs)
+            for tag, jobs in zip(tags, tx.execute())}
+
+
+def tag_status_counts(tag):
+    counts = get_redis_conn().hgetall(TAG_STATUS_KEY.format(tag))
+    return {status: int(n) for status, n in counts.items() if int(n) > 0}
+
+
+def running_task_ids(job_name=None):
+    key = RUNNING_KEY if job_name is None else JOB_RUNNING_KEY.format(job_name)
+    return [int(t) for t in get_redis_conn().zrange(key, 0, -1)]
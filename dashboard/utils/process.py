@@ -0,0 +1,102 @@
+""" Child process limits for bash tasks.
+
+On posix the command runs in its own session (process group) with
+optional address space and cpu time rlimits, so a timeout can kill
+the command together with everything it spawned. Elsewhere output
+reads block, so timeouts are only noticed between reads, only the
+direct child is killed and no rlimits are applied.
+"""
+import errno
+import os
+import select
+import signal
+import subprocess
+import time
+
+try:
+    import resource
+except ImportError:    # windows
+    resource = None
+
+POSIX = os.name == 'posix'
+# task state of a command killed by its timeout
+TIMEOUT = "TIMEOUT"
+
+
+class CommandTimeout(Exception):
+    """ raised by execute_command when a command hits its timeout,
+    recorded as the TIMEOUT task state """
+    pass
+
+
+def is_timeout(result):
+    """ whether a failed task's result (the exception, or its
+    serialized form from the result backend) is a CommandTimeout """
+    if isinstance(result, dict):
+        return result.get('exc_type') == CommandTimeout.__name__
+    return type(result).__name__ == CommandTimeout.__name__
+
+
+def _limit_child(max_memory_mb, max_cpu_seconds):
+    """ preexec_fn: runs in the child between fork and exec """
+    os.setsid()
+    if max_memory_mb:
+        size = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    if max_cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU,
+                (max_cpu_seconds, max_cpu_seconds))
+
+
+def start_command(args, shell=True, max_memory_mb=0, max_cpu_seconds=0):
+    """ Popen with stdout+stderr piped, in a new process group """
+    kwargs = {}
+    if POSIX and resource is not None:
+        kwargs['preexec_fn'] = lambda: _limit_child(max_memory_mb,
+                max_cpu_seconds)
+    return subprocess.Popen(args, shell=shell, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, **kwargs)
+
+
+def read_output(proc, size, deadline=None):
+    """ next chunk of output, b'' at end of output; raises
+    CommandTimeout once deadline (time.time()) has passed """
+    fd = proc.stdout.fileno()
+    if deadline is not None and POSIX:
+        remaining = deadline - time.time()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            raise CommandTimeout()
+    return os.read(fd, size)
+
+
+def wait_command(proc, deadline=None):
+    """ returncode once proc exits; raises CommandTimeout once
+    deadline (time.time()) has passed """
+    if deadline is None:
+        return proc.wait()
+    try:
+        return proc.wait(max(deadline - time.time(), 0))
+    except subprocess.TimeoutExpired:
+        raise CommandTimeout()
+
+
+def kill_process_group(proc, grace=5):
+    """ SIGTERM the command's process group, SIGKILL what is left
+    after grace seconds """
+    if not POSIX:
+        proc.kill()
+        proc.wait()
+        return
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+            break
+        if sig == signal.SIGTERM:
+            end = time.time() + grace
+            while time.time() < end and proc.poll() is None:
+                time.sleep(0.1)
+        # SIGKILL also reaches children that outlived the leader
+    proc.wait()
@@ -0,0 +1,192 @@
+""" Warm interpreter processes for the python operator.
+
+A python job's command is `package.module:function` optionally
+followed by JSON arguments, a list for positional or an object for
+keyword arguments:
+
+    reports.daily:check_positions {"book": "MBS", "days": 3}
+
+Calls run in pre-started child processes that already imported the
+[python_operator] preload modules (pandas, db drivers...), so a run
+costs neither an interpreter start nor those imports. A call that
+exceeds its timeout gets its process killed and replaced, and every
+process is replaced after max_tasks_per_child calls so leaks in job
+code do not pile up.
+
+Processes are started by a forkserver rather than forked from the
+celery worker: the worker runs threads (broker connection, heartbeats,
+the threads pool) and a fork could copy a lock held by one of them.
+The forkserver is a fresh single-threaded interpreter that imports the
+preload modules once and forks every pool process from there. The
+python queue's worker must still not be a daemonic prefork child: run
+it with the threads or solo pool ([queues] pool_python).
+"""
+import importlib
+import json
+import logging
+import multiprocessing
+import threading
+import traceback
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from dashboard.configuration import conf
+
+logger = logging.getLogger(__name__)
+
+_context = multiprocessing.get_context('forkserver')
+
+
+class PythonTaskTimeout(Exception):
+    pass
+
+
+def parse_python_command(command):
+    """ (module, function, args, kwargs), ValueError if malformed """
+    parts = command.strip().split(None, 1)
+    if not parts or ':' not in parts[0]:
+        raise ValueError("python command must start with module:function")
+    module, function = parts[0].split(':', 1)
+    if not module or not function:
+        raise ValueError("python command must start with module:function")
+    args, kwargs = [], {}
+    if len(parts) == 2:
+        params = json.loads(parts[1])
+        if isinstance(params, list):
+            args = params
+        elif isinstance(params, dict):
+            kwargs = params
+        else:
+            raise ValueError("python arguments must be a JSON list or object")
+    return module, function, args, kwargs
+
+
+def _preload(modules):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            logger.exception("Cannot preload module {}".format(name))
+
+
+def _serve(conn, preload):
+    """ child loop: run (module, function, args, kwargs) requests """
+    _preload(preload)
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        module, function, args, kwargs = request
+        try:
+            func = getattr(importlib.import_module(module), function)
+            result = func(*args, **kwargs)
+            conn.send((True, None if result is None else str(result)))
+        except BaseException:
+            conn.send((False, traceback.format_exc()))
+
+
+class _WarmProcess(object):
+
+    def __init__(self, preload):
+        self.conn, child_conn = _context.Pipe()
+        self.process = _context.Process(target=_serve,
+                args=(child_conn, preload))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.terminate()
+        else:
+            try:
+                self.conn.send(None)
+            except Exception:
+                self.process.terminate()
+        self.process.join(5)
+        self.conn.close()
+
+
+class PythonProcessPool(object):
+
+    def __init__(self, size=4, preload=(), max_tasks_per_child=100):
+        self.preload = list(preload)
+        self.max_tasks_per_child = max_tasks_per_child
+        # only used when this starts the forkserver, which imports
+        # them once for all processes
+        _context.set_forkserver_preload(self.preload)
+        self.idle = Queue()
+        for _ in range(size):
+            self.idle.put(_WarmProcess(self.preload))
+        self.stats = {'calls': 0, 'timeouts': 0, 'recycled': 0, 'died': 0}
+
+    def run(self, command, timeout=None):
+        """ run a python command in a warm process, returns the result
+        as a string; raises PythonTaskTimeout or RuntimeError """
+        module, function, args, kwargs = parse_python_command(command)
+        proc = self.idle.get()
+        self.stats['calls'] += 1
+        try:
+            proc.conn.send((module, function, args, kwargs))
+            if not proc.conn.poll(timeout):
+                self.stats['timeouts'] += 1
+                proc.stop(kill=True)
+                proc = _WarmProcess(self.preload)
+                raise PythonTaskTimeout("{}:{} did not finish in {} "
+                        "seconds".format(module, function, timeout))
+            ok, result = proc.conn.recv()
+        except (EOFError, IOError, OSError):
+            # the child died, e.g. killed by the os
+            self.stats['died'] += 1
+            proc.stop(kill=True)
+            proc = _WarmProcess(self.preload)
+            raise RuntimeError("process running {}:{} died".format(
+                        module, function))
+        finally:
+            proc.tasks += 1
+            if proc.tasks >= self.max_tasks_per_child:
+                self.stats['recycled'] += 1
+                proc.stop()
+                proc = _WarmProcess(self.preload)
+            self.idle.put(proc)
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_python_pool():
+    """ this worker's pool, started on the first python task """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            preload = [m.strip() for m in conf.get('python_operator',
+                    'preload').split(',') if m.strip()]
+            _pool = PythonProcessPool(
+                    size=conf.getint('python_operator', 'pool_size'),
+                    preload=preload,
+                    max_tasks_per_child=conf.getint('python_operator',
+                            'max_tasks_per_child'))
+        return _pool
+
+
+def close_python_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,46 @@
+""" Which celery queue a task goes to.
+
+A queue set on the job wins, then the first of the job's tags with a
+`tag_<tag>` rule, then the `operator_<operator>` rule, then the
+default queue. All rules live in the [queues] section.
+"""
+from dashboard.configuration import conf
+
+TAG_RULE = "tag_"
+OPERATOR_RULE = "operator_"
+
+
+def queue_names():
+    return [q.strip() for q in conf.get('queues', 'names').split(',')
+            if q.strip()]
+
+
+def tag_rules():
+    """ {tag: queue}, tags are lower case like all config options """
+    return {option[len(TAG_RULE):]: conf.get('queues', option)
+            for option in conf.options('queues')
+            if option.startswith(TAG_RULE)}
+
+
+def resolve_queue(operator, tags=(), job_queue=None, rules=None):
+    """ rules: tag_rules(), pass it in when routing many tasks """
+    if job_queue:
+        return job_queue
+    rules = tag_rules() if rules is None else rules
+    for tag in sorted(tags):
+        if tag.lower() in rules:
+            return rules[tag.lower()]
+    option = OPERATOR_RULE + operator
+    if conf.has_option('queues', option):
+        return conf.get('queues', option)
+    return conf.get('queues', 'default')
+
+
+def worker_options(queue):
+    """ (concurrency, prefetch multiplier, pool) for a worker of queue """
+    def get(name):
+        option = '{}_{}'.format(name, queue)
+        if conf.has_option('queues', option):
+            return conf.get('queues', option)
+        return conf.get('queues', name)
+    return int(get('concurrency')), int(get('prefetch')), get('pool')
@@ -0,0 +1,176 @@
+""" Partition jobs across several scheduler processes.
+
+Every scheduler started with [sharding] enabled is a member: a
+background thread keeps its name in a redis sorted set scored by a
+lease expiry and drops expired members, so all members see the same
+live member list within one renewal, however long a pass takes. A
+member whose main loop made no progress for [manager] lease_max_stall
+seconds stops renewing and leaves, so the others take its jobs. Jobs are placed on a consistent hash ring of that list by
+job id, so a member joining or leaving only moves about 1/N of the
+jobs. A job with a tag listed as `tag_<tag> = <member>` belongs to
+that member while it is alive.
+
+    scheduler_manager/members     zset member -> lease expiry (epoch)
+"""
+from bisect import bisect
+import hashlib
+import logging
+import threading
+import time
+
+from dashboard.configuration import conf
+from dashboard.utils.db import get_redis_conn
+
+logger = logging.getLogger(__name__)
+
+MEMBERS_KEY = "scheduler_manager/members"
+TAG_GROUP = "tag_"
+
+
+def enabled():
+    return conf.getboolean('sharding', 'enabled')
+
+
+def tag_groups():
+    """ {tag: member}, tags are lower case like all config options """
+    return {option[len(TAG_GROUP):]: conf.get('sharding', option)
+            for option in conf.options('sharding')
+            if option.startswith(TAG_GROUP)}
+
+
+def live_members():
+    """ sorted names of the members whose lease has not expired """
+    members = get_redis_conn().zrangebyscore(MEMBERS_KEY, time.time(),
+            '+inf')
+    return sorted(m.decode() if isinstance(m, bytes) else m
+            for m in members)
+
+
+def _hash(key):
+    return int(hashlib.md5(str(key).encode()).hexdigest()[:15], 16)
+
+
+class HashRing(object):
+
+    def __init__(self, members, replicas=None):
+        """ replicas: virtual nodes per member """
+        replicas = replicas or conf.getint('sharding', 'replicas')
+        points = sorted((_hash("{}#{}".format(member, i)), member)
+                for member in members for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._members = [m for _, m in points]
+
+    def get(self, key):
+        """ member owning key, None for an empty ring """
+        if not self._members:
+            return None
+        i = bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._members[i]
+
+
+class JobAssigner(object):
+    """ which member schedules a job, for a given member list """
+
+    def __init__(self, members, groups=None):
+        self.members = list(members)
+        self.groups = tag_groups() if groups is None else groups
+        self.ring = HashRing(self.members)
+
+    def owner(self, job_id, tags=()):
+        live = set(self.members)
+        for tag in sorted(tags):
+            member = self.groups.get(tag.lower())
+            if member in live:
+                return member
+        return self.ring.get(job_id)
+
+
+class ShardMembership(object):
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self.ttl = ttl or conf.getint('manager', 'lease_ttl')
+        self.renew_every = self.ttl / 3.
+        self.max_stall = conf.getint('manager', 'lease_max_stall') or None
+        self.assigner = JobAssigner([])
+        self._renewed_at = None
+        self._progress_at = time.time()
+        self._changed = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._renewer = None
+
+    def _renew(self):
+        """ renew the membership and refresh the member list """
+        now = time.time()
+        try:
+            tx = get_redis_conn().pipeline()
+            tx.zadd(MEMBERS_KEY, {self.name: now + self.ttl})
+            tx.zremrangebyscore(MEMBERS_KEY, '-inf', now)
+            tx.execute()
+            members = live_members()
+        except Exception:
+            # keep the last assignment until redis is back
+            logger.exception("Cannot renew shard membership of {}".format(
+                        self.name))
+            return
+        with self._lock:
+            self._renewed_at = now
+            if members != self.assigner.members:
+                self.assigner = JobAssigner(members)
+                self._changed = True
+
+    def _renew_loop(self, stop):
+        while not stop.wait(self.renew_every):
+            if self.stalled():
+                logger.warning("No progress for {:.0f} seconds, {} leaves "
+                        "the shard members".format(
+                        time.time() - self._progress_at, self.name))
+                self._renewed_at = None
+                self._renewer = None
+                try:
+                    self.leave()
+                except Exception:
+                    # expires after the ttl
+                    logger.exception("Cannot leave the shard members")
+                return
+            self._renew()
+
+    def touch(self):
+        """ the main loop is making progress """
+        self._progress_at = time.time()
+
+    def stalled(self):
+        return (self.max_stall is not None and
+                time.time() - self._progress_at > self.max_stall)
+
+    def keep(self):
+        """ renew the membership if renew_every has passed and keep
+        renewing it in the background; True when the member list
+        changed since the last call """
+        self.touch()
+        if (self._renewed_at is None or
+                time.time() - self._renewed_at >= self.renew_every):
+            self._renew()
+        if self._renewer is None:
+            self._stop = threading.Event()
+            self._renewer = threading.Thread(target=self._renew_loop,
+                    args=(self._stop,), name="shard-" + self.name)
+            self._renewer.daemon = True
+            self._renewer.start()
+        with self._lock:
+            changed, self._changed = self._changed, False
+        return changed
+
+    def alive(self):
+        """ False once our entry expired, the other members then
+        schedule our jobs """
+        return (self._renewed_at is not None and
+                time.time() - self._renewed_at < self.ttl)
+
+    def owns(self, job_id, tags=()):
+        return self.assigner.owner(job_id, tags) == self.name
+
+    def leave(self):
+        self._stop.set()
+        get_redis_conn().zrem(MEMBERS_KEY, self.name)
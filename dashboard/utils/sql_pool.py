@@ -0,0 +1,199 @@
+""" Per-process pools of connections to the data sql servers.
+
+Each celery worker process keeps idle connections per database and
+hands them to `open_sql_server_session` instead of connecting for
+every sql task. A connection idle for more than ping_after seconds is
+checked with a trivial query before reuse, one idle for more than
+max_idle seconds is closed. Pools are filled at worker_process_init
+for the databases listed in [sql_pool] warmup.
+
+The driver is pyodbc, or sqlite3 with [database] <name> set to a file
+path to stand in for a sql server. Each process publishes its pool
+counters to its own redis key, expired a day after the last update
+and removed when the process exits.
+"""
+from collections import deque
+import json
+import logging
+import os
+import socket
+import time
+
+from dashboard.configuration import conf
+from dashboard.utils.db import get_redis_conn
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = "sql_pool/stats/{}"
+# seconds between two publications of a process's pool stats
+STATS_INTERVAL = 60
+STATS_EXPIRE = 24 * 3600
+
+
+def _pool_conf():
+    return {'driver': conf.get('sql_pool', 'driver'),
+            'size': conf.getint('sql_pool', 'size'),
+            'max_idle': conf.getint('sql_pool', 'max_idle'),
+            'ping_after': conf.getint('sql_pool', 'ping_after')}
+
+
+def connect(db, driver='pyodbc'):
+    """ new connection to database `db` of the [database] section """
+    server = conf.get('database', db)
+    if driver == 'sqlite3':
+        import sqlite3
+        return sqlite3.connect(server)
+    import pyodbc    # only needed by sql tasks on workers
+    conn_str = "Driver={%s};Server=%s;Database=%s;Trusted_Connection=Yes;" % (
+            conf.get('database', 'DRIVER'), server, db)
+    return pyodbc.connect(conn_str)
+
+
+class ConnectionPool(object):
+    """ idle connections to one database, newest last """
+
+    def __init__(self, db, driver='pyodbc', size=4, max_idle=600,
+                ping_after=30):
+        self.db = db
+        self.driver = driver
+        self.size = size
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.idle = deque()    # (connection, returned at)
+        self.in_use = 0
+        self.stats = {'created': 0, 'reused': 0, 'evicted': 0,
+                      'ping_failed': 0, 'discarded': 0}
+
+    def warm_up(self, n=1):
+        while len(self.idle) < min(n, self.size):
+            self.idle.append((self._connect(), time.time()))
+
+    def _connect(self):
+        self.stats['created'] += 1
+        return connect(self.db, self.driver)
+
+    def _alive(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1").fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            self.stats['ping_failed'] += 1
+            return False
+
+    def evict_idle(self):
+        now = time.time()
+        # oldest first, keep the recently used ones
+        while self.idle and now - self.idle[0][1] > self.max_idle:
+            conn, _ = self.idle.popleft()
+            self._close(conn)
+            self.stats['evicted'] += 1
+
+    def checkout(self):
+        self.evict_idle()
+        while self.idle:
+            conn, returned_at = self.idle.pop()
+            if time.time() - returned_at <= self.ping_after or \
+                    self._alive(conn):
+                self.stats['reused'] += 1
+                self.in_use += 1
+                return conn
+            self._close(conn)
+        conn = self._connect()
+        self.in_use += 1
+        return conn
+
+    def checkin(self, conn, discard=False):
+        self.in_use -= 1
+        if discard or len(self.idle) >= self.size:
+            self.stats['discarded'] += 1
+            self._close(conn)
+        else:
+            self.idle.append((conn, time.time()))
+
+    def close(self):
+        while self.idle:
+            self._close(self.idle.pop()[0])
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def snapshot(self):
+        snap = dict(self.stats)
+        snap.update(idle=len(self.idle), in_use=self.in_use)
+        return snap
+
+
+_pools = {}
+_last_publish = [0]
+
+
+def get_pool(db):
+    if db not in _pools:
+        cfg = _pool_conf()
+        _pools[db] = ConnectionPool(db, cfg['driver'], cfg['size'],
+                cfg['max_idle'], cfg['ping_after'])
+    return _pools[db]
+
+
+def warm_up():
+    """ open one connection to every database in [sql_pool] warmup """
+    names = [n.strip().upper() for n in
+             conf.get('sql_pool', 'warmup').split(',') if n.strip()]
+    for db in names:
+        try:
+            get_pool(db).warm_up()
+        except Exception:
+            # the first task connects again
+            logger.exception("Cannot warm up sql pool for {}".format(db))
+
+
+def close_all():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+
+
+def pool_stats():
+    """ {db: counters} of this process """
+    return {db: pool.snapshot() for db, pool in _pools.items()}
+
+
+def publish_stats(force=False):
+    """ write this process's pool stats to redis, rate limited """
+    now = time.time()
+    if not force and now - _last_publish[0] < STATS_INTERVAL:
+        return
+    _last_publish[0] = now
+    try:
+        get_redis_conn().set(_stats_key(), json.dumps(pool_stats()),
+                ex=STATS_EXPIRE)
+    except Exception:
+        logger.exception("Cannot publish sql pool stats")
+
+
+def remove_stats():
+    """ drop this process's stats when it exits """
+    try:
+        get_redis_conn().delete(_stats_key())
+    except Exception:
+        logger.exception("Cannot remove sql pool stats")
+
+
+def _stats_key():
+    return STATS_KEY.format("{}:{}".format(socket.gethostname(),
+            os.getpid()))
+
+
+def all_pool_stats():
+    """ {'<host>:<pid>': {db: counters}} of every worker process """
+    redis_conn = get_redis_conn()
+    prefix = STATS_KEY.format('')
+    keys = list(redis_conn.scan_iter(match=prefix + '*'))
+    values = redis_conn.mget(keys) if keys else []
+    return {key.decode()[len(prefix):]: json.loads(value)
+            for key, value in zip(keys, values) if value is not None}
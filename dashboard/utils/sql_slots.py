@@ -0,0 +1,132 @@
+""" Per-database concurrency slots for sql tasks, shared in redis.
+
+The slots of a database are a sorted set of lease tokens scored by
+their expiry, so a worker that dies while holding a slot only keeps
+it until the lease runs out. Acquiring drops expired leases and adds
+one if fewer than the database's limit are held, in one lua call.
+While the query runs a background thread extends the lease every
+third of it, so queries may run longer than the lease.
+
+    db_slots/<DB>          zset token -> lease expiry (epoch seconds)
+    db_slots/<DB>/stats    hash acquired, deferred, expired, busy_ms
+"""
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+from dashboard.configuration import conf
+from dashboard.utils.db import get_redis_conn
+
+logger = logging.getLogger(__name__)
+
+SLOTS_KEY = "db_slots/{}"
+STATS_KEY = "db_slots/{}/stats"
+
+# KEYS: slots zset, stats hash; ARGV: token, limit, now, lease seconds
+_ACQUIRE = """
+local expired = redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+if expired > 0 then redis.call('HINCRBY', KEYS[2], 'expired', expired) end
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    redis.call('ZADD', KEYS[1], ARGV[3] + ARGV[4], ARGV[1])
+    return 1
+end
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3] + ARGV[4], ARGV[1])
+    redis.call('HINCRBY', KEYS[2], 'acquired', 1)
+    return 1
+end
+redis.call('HINCRBY', KEYS[2], 'deferred', 1)
+return 0
+"""
+
+_scripts = {}
+
+
+def slot_limit(db):
+    if conf.has_option('sql_slots', db):
+        return conf.getint('sql_slots', db)
+    return conf.getint('sql_slots', 'default')
+
+
+def acquire(db, token, lease=None):
+    """ take a slot of db for token, False if all are held """
+    lease = lease or conf.getint('sql_slots', 'lease')
+    if 'acquire' not in _scripts:
+        _scripts['acquire'] = get_redis_conn().register_script(_ACQUIRE)
+    return bool(_scripts['acquire'](
+            keys=[SLOTS_KEY.format(db), STATS_KEY.format(db)],
+            args=[token, slot_limit(db), time.time(), lease]))
+
+
+def release(db, token, held_for=None):
+    """ give the slot back, held_for seconds go into busy_ms """
+    tx = get_redis_conn().pipeline()
+    tx.zrem(SLOTS_KEY.format(db), token)
+    if held_for is not None:
+        tx.hincrby(STATS_KEY.format(db), 'busy_ms', int(held_for * 1000))
+    tx.execute()
+
+
+def renew(db, token, lease=None):
+    """ extend a held slot's lease, False if it already expired """
+    lease = lease or conf.getint('sql_slots', 'lease')
+    tx = get_redis_conn().pipeline()
+    tx.zadd(SLOTS_KEY.format(db), {token: time.time() + lease}, xx=True)
+    tx.zscore(SLOTS_KEY.format(db), token)
+    return tx.execute()[-1] is not None
+
+
+def _renew_loop(db, token, lease, stop):
+    while not stop.wait(lease / 3.):
+        try:
+            if not renew(db, token, lease):
+                logger.warning("Slot lease of {} on {} expired while its "
+                        "query ran".format(token, db))
+                return
+        except Exception:
+            # retried a third of a lease later
+            logger.exception("Cannot renew slot of {} on {}".format(
+                        token, db))
+
+
+@contextmanager
+def sql_slot(db, token):
+    """ with sql_slot(db, token) as acquired: ... """
+    lease = conf.getint('sql_slots', 'lease')
+    acquired = acquire(db, token, lease)
+    start = time.time()
+    stop = threading.Event()
+    if acquired:
+        renewer = threading.Thread(target=_renew_loop,
+                args=(db, token, lease, stop), name="slot-" + token)
+        renewer.daemon = True
+        renewer.start()
+    try:
+        yield acquired
+    finally:
+        stop.set()
+        if acquired:
+            release(db, token, time.time() - start)
+
+
+def known_databases():
+    """ database names of the [database] section """
+    return [o.upper() for o in conf.options('database') if o != 'driver']
+
+
+def slot_stats(databases=None):
+    """ {db: {'limit', 'in_use', 'utilization', counters...}} """
+    databases = databases or known_databases()
+    redis_conn = get_redis_conn()
+    now = time.time()
+    stats = {}
+    for db in databases:
+        counters = {k: int(v) for k, v in redis_conn.hgetall(
+                STATS_KEY.format(db)).items()}
+        in_use = redis_conn.zcount(SLOTS_KEY.format(db), now, '+inf')
+        limit = slot_limit(db)
+        counters.update(limit=limit, in_use=in_use,
+                utilization=float(in_use) / limit if limit else 0.)
+        stats[db] = counters
+    return stats
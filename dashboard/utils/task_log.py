@@ -0,0 +1,145 @@
+""" Per-task output log kept in redis.
+
+Output is appended in zlib-compressed chunks to a sorted set scored by
+the byte offset of each chunk, so readers can tail it from any offset.
+Only the last `max_chunks` chunks are kept: the set is a ring buffer
+over the end of the output and memory per task stays bounded however
+verbose the command is.
+"""
+import time
+import zlib
+
+from dashboard.configuration import conf
+from dashboard.utils.db import get_redis_conn
+
+LOG_KEY = "task_log/{task_id}"
+META_KEY = "task_log/{task_id}/meta"
+# chunk member is '<offset>:' + compressed bytes, offset keeps it unique
+OFFSET_SEP = b':'
+
+
+def _log_conf():
+    return {'chunk_size': conf.getint('task_log', 'chunk_size'),
+            'max_chunks': conf.getint('task_log', 'max_chunks'),
+            'flush_interval': conf.getfloat('task_log', 'flush_interval'),
+            'expire': conf.getint('task_log', 'expire_days') * 24 * 3600}
+
+
+class TaskLogWriter(object):
+    """ Buffers output of one task and flushes it to redis whenever a
+    chunk is full or flush_interval seconds passed. Also keeps the head
+    and tail of the output in memory for the task result. """
+
+    def __init__(self, task_id, result_size=1000):
+        cfg = _log_conf()
+        self.chunk_size = cfg['chunk_size']
+        self.max_chunks = cfg['max_chunks']
+        self.flush_interval = cfg['flush_interval']
+        self.expire = cfg['expire']
+        self.log_key = LOG_KEY.format(task_id=task_id)
+        self.meta_key = META_KEY.format(task_id=task_id)
+        self.offset = 0    # bytes flushed so far
+        self.buffer = bytearray()
+        self.last_flush = time.time()
+        self.head_size = result_size // 2
+        self.head = bytearray()
+        self.tail_size = result_size - self.head_size
+        self.tail = bytearray()
+        self.redis_conn = get_redis_conn()
+
+    def write(self, data):
+        if len(self.head) < self.head_size:
+            self.head.extend(data[:self.head_size - len(self.head)])
+        self.tail.extend(data[-self.tail_size:])
+        del self.tail[:-self.tail_size]
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.chunk_size:
+            self._flush_chunk(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        if self.buffer and time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self._flush_chunk(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self._set_meta(done=1)
+
+    @property
+    def total_bytes(self):
+        return self.offset + len(self.buffer)
+
+    def summary(self):
+        """ whole output if it is short, head and tail otherwise """
+        tail = bytes(self.tail)
+        overlap = len(self.head) + len(tail) - self.total_bytes
+        if overlap >= 0:
+            out = bytes(self.head) + tail[overlap:]
+            return out.decode(errors='replace')
+        return "{}\n...({} bytes skipped)...\n{}".format(
+                bytes(self.head).decode(errors='replace'),
+                self.total_bytes - len(self.head) - len(tail),
+                tail.decode(errors='replace'))
+
+    def _flush_chunk(self, chunk):
+        member = str(self.offset).encode() + OFFSET_SEP + zlib.compress(chunk)
+        self.offset += len(chunk)
+        tx = self.redis_conn.pipeline()
+        tx.zadd(self.log_key, {member: self.offset - len(chunk)})
+        # ring buffer, drop everything but the last max_chunks
+        tx.zremrangebyrank(self.log_key, 0, -self.max_chunks - 1)
+        tx.expire(self.log_key, self.expire)
+        tx.execute()
+        self._set_meta(done=0)
+        self.last_flush = time.time()
+
+    def _set_meta(self, done):
+        tx = self.redis_conn.pipeline()
+        tx.hset(self.meta_key, 'size', self.offset)
+        tx.hset(self.meta_key, 'done', done)
+        tx.expire(self.meta_key, self.expire)
+        tx.execute()
+
+
+def read_task_log(task_id, offset=0, max_bytes=None):
+    """ Read a task's output from byte `offset` on.
+
+    Returns a dict with the decoded `data`, its starting `offset`
+    (moved forward if the requested bytes already left the ring
+    buffer), `next_offset` to pass in on the next call, `truncated`
+    and `done`.
+    """
+    cfg = _log_conf()
+    redis_conn = get_redis_conn()
+    meta = redis_conn.hgetall(META_KEY.format(task_id=task_id))
+    size = int(meta.get('size', 0))
+    done = meta.get('done') == '1'
+    offset = min(max(offset, 0), size)
+    # a chunk holds at most chunk_size bytes, so the one that contains
+    # `offset` starts at most chunk_size bytes before it
+    members = redis_conn.zrangebyscore(LOG_KEY.format(task_id=task_id),
+            offset - cfg['chunk_size'] + 1, '+inf')
+    start = None
+    data = bytearray()
+    for member in members:
+        chunk_offset, compressed = member.split(OFFSET_SEP, 1)
+        chunk_offset = int(chunk_offset)
+        chunk = zlib.decompress(compressed)
+        if chunk_offset + len(chunk) <= offset:
+            continue
+        if start is None:
+            start = max(chunk_offset, offset)
+        data.extend(chunk[max(offset - chunk_offset, 0):])
+        if max_bytes is not None and len(data) >= max_bytes:
+            data = data[:max_bytes]
+            break
+    if start is None:
+        start = offset
+    return {'data': bytes(data).decode(errors='replace'),
+            'offset': start,
+            'next_offset': start + len(data),
+            'truncated': start > offset,
+            'done': done and start + len(data) >= size}
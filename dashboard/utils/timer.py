@@ -0,0 +1,73 @@
+from datetime import datetime
+import heapq
+
+
+class TimerQueue(object):
+    """ In-memory priority queue of job next run times (utc).
+
+    Each job has at most one live entry; rescheduling a job pushes a
+    new entry and the outdated one is dropped lazily when it reaches
+    the top of the heap.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._next_run = {}
+
+    def __len__(self):
+        return len(self._next_run)
+
+    def set(self, name, next_run_utc):
+        """ (re)schedule job `name`, None removes it """
+        if next_run_utc is None:
+            self._next_run.pop(name, None)
+            return
+        if self._next_run.get(name) == next_run_utc:
+            return
+        self._next_run[name] = next_run_utc
+        heapq.heappush(self._heap, (next_run_utc, name))
+
+    def remove(self, name):
+        self.set(name, None)
+
+    def clear(self):
+        self._heap = []
+        self._next_run = {}
+
+    def _drop_stale(self):
+        while self._heap:
+            ts, name = self._heap[0]
+            if self._next_run.get(name) == ts:
+                return
+            heapq.heappop(self._heap)
+
+    def peek(self):
+        """ earliest next run time, or None if the queue is empty """
+        self._drop_stale()
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def seconds_until_next(self, utcnow=None, max_wait=None):
+        """ how long to sleep before the earliest job is due """
+        next_run = self.peek()
+        if next_run is None:
+            return max_wait
+        utcnow = utcnow or datetime.utcnow()
+        wait = max((next_run - utcnow).total_seconds(), 0)
+        if max_wait is not None:
+            wait = min(wait, max_wait)
+        return wait
+
+    def pop_due(self, utcnow=None):
+        """ remove and return names of all jobs that are due """
+        utcnow = utcnow or datetime.utcnow()
+        due = []
+        while True:
+            next_run = self.peek()
+            if next_run is None or next_run > utcnow:
+                break
+            _, name = heapq.heappop(self._heap)
+            del self._next_run[name]
+            due.append(name)
+        return due
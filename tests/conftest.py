@@ -0,0 +1,21 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from dashboard.utils import db
+
+
+@pytest.fixture
+def sqlite_db():
+    """ swap the webserver db for an empty in-memory sqlite,
+    get_engine() and provide_session use it; yields the engine """
+    saved = db.engine, db.session_factory
+    db.engine = create_engine('sqlite://', poolclass=StaticPool,
+                    connect_args={'check_same_thread': False})
+    db.session_factory = scoped_session(sessionmaker(
+                    autocommit=False, autoflush=False, bind=db.engine))
+    yield db.engine
+    db.session_factory.remove()
+    db.engine.dispose()
+    db.engine, db.session_factory = saved
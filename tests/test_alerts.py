@@ -0,0 +1,164 @@
+import json
+import smtplib
+import socket
+import threading
+
+import pytest
+
+from dashboard import alerts
+from dashboard.alerts import (ALERT_PROCESSING, ALERT_QUEUE, 
+        AlertDispatcher, enqueue_alert)
+from dashboard.utils.emails import SMTPConnection, transient_error
+
+smtpd = pytest.importorskip('smtpd')
+asyncore = pytest.importorskip('asyncore')
+
+
+class _Server(smtpd.SMTPServer):
+
+    def __init__(self, *args, **kwargs):
+        smtpd.SMTPServer.__init__(self, *args, **kwargs)
+        self.messages = []
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.messages.append((sorted(rcpttos), data))
+
+
+@pytest.fixture
+def smtp_server():
+    """ local smtp server on a free port, collects received mails """
+    server = _Server(('127.0.0.1', 0), None, decode_data=True)
+    thread = threading.Thread(target=asyncore.loop, 
+            kwargs={'timeout': 0.05})
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.close()
+    thread.join(2)
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class FakeRedis(object):
+    """ the list and hash commands AlertDispatcher uses """
+
+    def __init__(self):
+        self.lists = {}
+        self.hashes = {}
+
+    def lpush(self, key, *values):
+        self.lists.setdefault(key, [])[:0] = list(reversed(values))
+
+    def rpoplpush(self, src, dst):
+        if self.lists.get(src):
+            value = self.lists[src].pop()
+            self.lpush(dst, value)
+            return value
+
+    def brpoplpush(self, src, dst, timeout=0):
+        return self.rpoplpush(src, dst)
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    def delete(self, key):
+        self.lists.pop(key, None)
+
+    def hincrby(self, key, field, amount):
+        h = self.hashes.setdefault(key, {})
+        h[field] = h.get(field, 0) + amount
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    redis_conn = FakeRedis()
+    monkeypatch.setattr(alerts, 'get_redis_conn', lambda: redis_conn)
+    monkeypatch.setattr(alerts.time, 'sleep', lambda seconds: None)
+    dispatcher = AlertDispatcher()
+    dispatcher.smtp.host = '127.0.0.1'
+    dispatcher.smtp.retry_delay = 0
+    return dispatcher
+
+
+def test_connection_sends_to_local_server(smtp_server):
+    conn = SMTPConnection('127.0.0.1', smtp_server.socket.getsockname()[1])
+    conn.send('subject', ['a@example.com', 'b@example.com'], 'body 1')
+    conn.send('subject', 'c@example.com', 'body 2')
+    conn.close()
+    assert [to for to, _ in smtp_server.messages] == [
+            ['a@example.com', 'b@example.com'], ['c@example.com']]
+    assert 'body 2' in smtp_server.messages[1][1]
+
+
+def test_connection_retries_refused_connection(monkeypatch):
+    attempts = []
+    real_smtp = smtplib.SMTP
+
+    def connect(host, port):
+        attempts.append(port)
+        return real_smtp(host, port)
+
+    monkeypatch.setattr(smtplib, 'SMTP', connect)
+    conn = SMTPConnection('127.0.0.1', free_port(), retries=2, 
+            retry_delay=0)
+    with pytest.raises(ConnectionRefusedError):
+        conn.send('subject', 'a@example.com', 'body')
+    assert len(attempts) == 3
+
+
+def test_transient_errors():
+    assert transient_error(ConnectionRefusedError())
+    assert transient_error(smtplib.SMTPServerDisconnected())
+    assert transient_error(smtplib.SMTPDataError(421, b'try later'))
+    assert not transient_error(smtplib.SMTPDataError(554, b'rejected'))
+    assert not transient_error(smtplib.SMTPRecipientsRefused(
+            {'a@example.com': (550, b'no such user')}))
+
+
+def test_failed_digests_are_requeued(smtp_server, dispatcher):
+    dispatcher.smtp.port = free_port()
+    enqueue_alert('job_a', 'echo 0', '0', ['a@example.com'])
+    enqueue_alert('job_b', 'echo 0', '0', ['a@example.com', 'b@example.com'])
+    assert dispatcher.run_once() == 2
+
+    redis_conn = alerts.get_redis_conn()
+    assert redis_conn.llen(ALERT_PROCESSING) == 0
+    requeued = [json.loads(a) for a in redis_conn.lists[ALERT_QUEUE]]
+    assert sorted((a['job_name'], tuple(a['recipients']), a['attempts'])
+            for a in requeued) == [
+            ('job_a', ('a@example.com',), 1),
+            ('job_b', ('a@example.com',), 1),
+            ('job_b', ('b@example.com',), 1)]
+
+    # the server is back
+    dispatcher.smtp.port = smtp_server.socket.getsockname()[1]
+    assert dispatcher.run_once() == 3
+    assert redis_conn.llen(ALERT_QUEUE) == 0
+    assert sorted(to for to, _ in smtp_server.messages) == [
+            ['a@example.com'], ['b@example.com']]
+
+
+def test_alerts_dropped_after_max_attempts(dispatcher):
+    dispatcher.smtp.port = free_port()
+    dispatcher.max_attempts = 2
+    enqueue_alert('job_a', 'echo 0', '0', ['a@example.com'])
+    dispatcher.run_once()
+    dispatcher.run_once()
+    redis_conn = alerts.get_redis_conn()
+    assert redis_conn.llen(ALERT_QUEUE) == 0
+    assert redis_conn.hashes[alerts.ALERT_STATS]['dropped'] == 1
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from dashboard.models import Job
+
+
+def hourly_job(catchup):
+    return Job('hourly', 'UTC', '2021-07-01 00:00:00', '', '', None,
+            '0 * * * *', '2021-07-01 00:00:00', 'bash', None, 'echo 1',
+            catchup=catchup)
+
+
+def test_skip_keeps_the_latest_due_run():
+    job = hourly_job('skip')
+    next_run = job.skip_missed(datetime(2021, 7, 1, 5, 30))
+    assert job.next_run_local_ts == datetime(2021, 7, 1, 5, 0)
+    assert next_run == datetime(2021, 7, 1, 6, 0)
+
+
+def test_skip_without_missed_runs():
+    job = hourly_job('skip')
+    next_run = job.skip_missed(datetime(2021, 7, 1, 0, 10))
+    assert job.next_run_local_ts == datetime(2021, 7, 1, 0, 0)
+    assert next_run == datetime(2021, 7, 1, 1, 0)
+
+
+def test_job_policy_wins_over_the_default():
+    assert hourly_job('latest_only').catchup_policy == 'latest_only'
+    assert hourly_job(None).catchup_policy == 'all'
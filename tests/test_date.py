@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+import croniter
+import pytest
+
+from dashboard.utils.date import (compile_cron, get_next_run_ts,
+        get_next_run_ts_bulk)
+
+CURRENTS = [datetime(2021, 7, 1) + timedelta(days=d, hours=h)
+            for d in range(0, 60, 7) for h in (0, 9, 13)]
+
+
+def croniter_next(crontab, current):
+    return croniter.croniter(crontab, current).get_next(datetime)
+
+
+@pytest.mark.parametrize('crontab', [
+    '0 9 * * 5#2',
+    '30 8 * * 1#1,5#3',
+    '0 9 * * L5',
+    '0 0 L * *',
+    '0 12 15W * *',
+])
+def test_special_days_match_croniter(crontab):
+    assert compile_cron(crontab) is None
+    expected = [croniter_next(crontab, c) for c in CURRENTS]
+    assert [get_next_run_ts(crontab, c) for c in CURRENTS] == expected
+    assert get_next_run_ts_bulk([crontab] * len(CURRENTS),
+            CURRENTS) == expected
+
+
+@pytest.mark.parametrize('crontab', [
+    '0 9 * * 5',
+    '*/15 8-17 * * mon-fri',
+    '0 0 1 jul *',
+    '0 6 1,15 * wed',
+])
+def test_compiled_crontabs_match_croniter(crontab):
+    assert compile_cron(crontab) is not None
+    expected = [croniter_next(crontab, c) for c in CURRENTS]
+    assert [get_next_run_ts(crontab, c) for c in CURRENTS] == expected
+    assert get_next_run_ts_bulk([crontab] * len(CURRENTS),
+            CURRENTS) == expected
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from dashboard.models import (Job, JobAlert, RequestHandler, Tag,
+        TaskInstance, init_db)
+from dashboard.utils import db
+
+JOB_NAME = 'page_job'
+
+
+@pytest.fixture
+def job_page(sqlite_db):
+    init_db()
+    session = db.session_factory()
+    job = Job(name=JOB_NAME, timezone='US/Eastern', start_dt='',
+            end_dt='', schedule_interval='@hourly', weekday_to_run=None,
+            schedule_interval_crontab='', reset_status_at='0:00',
+            operator='bash', database=None, command='echo 1')
+    session.add(job)
+    session.flush()
+    for i in range(50):
+        session.add(TaskInstance(job,
+                execution_date=datetime.now() - timedelta(hours=i)))
+    for tag in ('tag_a', 'tag_b', 'tag_c'):
+        session.add(Tag(tag, JOB_NAME))
+    for i in range(5):
+        session.add(JobAlert(job_name=JOB_NAME,
+                email='user{}@example.com'.format(i)))
+    session.commit()
+    session.close()
+
+    statements = []
+    event.listen(sqlite_db, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(
+                statement))
+    return statements
+
+
+def test_info_job_runs_two_statements(job_page):
+    job, tags, tasks, alerts = RequestHandler.info_job(JOB_NAME)
+    assert len(job_page) == 2
+    assert job.name == JOB_NAME
+    assert tags == ['tag_a', 'tag_b', 'tag_c']
+    assert len(tasks) == 20
+    assert alerts == ['user{}@example.com'.format(i) for i in range(5)]
+
+
+def test_info_job_missing_job(job_page):
+    assert RequestHandler.info_job('no_such_job') == (None, None, None, None)
+    assert len(job_page) == 1
+
+
+def test_list_jobs_runs_one_statement(job_page):
+    jobs, next_page = RequestHandler.list_jobs(tag='tag_a')
+    assert len(job_page) == 1
+    assert [j['name'] for j in jobs] == [JOB_NAME]
+    assert next_page is None
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from dashboard.utils import leader
+from dashboard.utils.leader import LeaderLease
+
+
+class FakeRedis(object):
+    """ SET NX PX and the renew/release scripts on one key space """
+
+    def __init__(self):
+        self.keys = {}
+
+    def _alive(self, key):
+        value, expires = self.keys.get(key, (None, 0))
+        return value if expires > time.time() else None
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and self._alive(key) is not None:
+            return None
+        self.keys[key] = (value, time.time() + px / 1000.)
+        return True
+
+    def register_script(self, source):
+        def run(keys, args):
+            if self._alive(keys[0]) != args[0]:
+                return 0
+            if 'PEXPIRE' in source:
+                self.keys[keys[0]] = (args[0], time.time() + args[1] / 1000.)
+            else:
+                del self.keys[keys[0]]
+            return 1
+        return run
+
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    redis_conn = FakeRedis()
+    monkeypatch.setattr(leader, 'get_redis_conn', lambda: redis_conn)
+    monkeypatch.setattr(leader, '_scripts', {})
+    return redis_conn
+
+
+def test_lease_is_renewed_during_a_long_pass(redis_conn):
+    lease = LeaderLease('lease', ttl=0.3, identity='a')
+    assert lease.acquire()
+    # no keep() while the pass runs, well past the ttl
+    time.sleep(1)
+    assert lease.is_leader
+    assert not LeaderLease('lease', ttl=0.3, identity='b').acquire()
+    lease.release()
+    other = LeaderLease('lease', ttl=0.3, identity='b')
+    assert other.acquire()
+    other.release()
+
+
+def test_lost_lease_is_noticed_in_the_background(redis_conn):
+    lease = LeaderLease('lease', ttl=0.3, identity='a')
+    assert lease.acquire()
+    redis_conn.keys['lease'] = ('b', time.time() + 10)
+    time.sleep(0.5)
+    assert not lease.is_leader
+    assert not lease.keep()
+
+
+def test_stalled_leader_gives_the_lease_up(redis_conn):
+    lease = LeaderLease('lease', ttl=0.3, identity='a', max_stall=0.5)
+    assert lease.acquire()
+    for _ in range(4):
+        time.sleep(0.2)
+        assert lease.keep()
+    # the main loop hangs
+    time.sleep(1)
+    assert not lease.is_leader
+    other = LeaderLease('lease', ttl=0.3, identity='b')
+    assert other.acquire()
+    other.release()
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from dashboard.migrations import upgrade
+from dashboard.models import Job, init_db
+from dashboard.utils.db import provide_session
+
+# jobs and task_instances as created before any migration existed
+ORIGINAL_SCHEMA = [
+    """CREATE TABLE jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(100),
+        timezone VARCHAR(20),
+        update_time DATETIME,
+        start_dt DATETIME,
+        end_dt DATETIME,
+        active BOOLEAN,
+        block_till DATETIME,
+        block_by VARCHAR(50),
+        block_msg VARCHAR(200),
+        schedule_interval VARCHAR(20),
+        reset_status_at DATETIME,
+        operator VARCHAR(10),
+        database VARCHAR(20),
+        command VARCHAR,
+        next_run_local_ts DATETIME,
+        last_execution_ts DATETIME,
+        last_task_result VARCHAR(1000),
+        status INTEGER)""",
+    "CREATE INDEX ix_jobs_name ON jobs (name)",
+    """CREATE TABLE task_instances (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id INTEGER NOT NULL,
+        job_name VARCHAR(100) NOT NULL,
+        execution_date DATETIME NOT NULL,
+        operator VARCHAR(1000),
+        command VARCHAR(1000) NOT NULL,
+        state VARCHAR(20),
+        task_id VARCHAR(250),
+        result VARCHAR(1000))""",
+]
+
+
+def create_original_schema(engine):
+    with engine.begin() as conn:
+        for ddl in ORIGINAL_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text(
+            "INSERT INTO jobs (name, timezone, active, schedule_interval, "
+            "operator, command, next_run_local_ts) VALUES ('nightly', "
+            "'Europe/Paris', 1, '0 2 * * *', 'bash', 'echo 1', "
+            "'2021-07-01 02:00:00.000000')"))
+
+
+def test_upgrade_original_schema(sqlite_db):
+    create_original_schema(sqlite_db)
+
+    init_db()
+    upgrade()
+
+    columns = [c['name'] for c in inspect(sqlite_db).get_columns('jobs')]
+    for column in ('next_run_utc', 'queue', 'timeout', 'catchup'):
+        assert column in columns
+
+    @provide_session
+    def load(session=None):
+        return session.query(Job).filter(Job.name == 'nightly').one()
+
+    job = load()
+    assert job.next_run_utc == datetime(2021, 7, 1, 0, 0)
+
+
+def test_upgrade_is_idempotent(sqlite_db):
+    create_original_schema(sqlite_db)
+    upgrade()
+    upgrade()
+
+    with sqlite_db.connect() as conn:
+        assert conn.execute(text(
+            "SELECT count(*) FROM jobs WHERE next_run_utc IS NOT NULL")
+            ).scalar() == 1
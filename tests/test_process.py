@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from dashboard.utils.process import (CommandTimeout, kill_process_group,
+        read_output, start_command, wait_command)
+
+
+def read_all(proc, deadline=None):
+    chunks = []
+    while True:
+        data = read_output(proc, 4096, deadline)
+        if not data:
+            return b''.join(chunks)
+        chunks.append(data)
+
+
+def test_shell_runs_the_whole_command():
+    proc = start_command('echo one && echo two | tr a-z A-Z', shell=True)
+    assert read_all(proc) == b'one\nTWO\n'
+    assert wait_command(proc, time.time() + 10) == 0
+    proc.stdout.close()
+
+
+def test_wait_times_out_after_output_is_closed():
+    proc = start_command('exec >/dev/null 2>&1; sleep 30', shell=True)
+    deadline = time.time() + 0.5
+    assert read_all(proc, deadline) == b''
+    with pytest.raises(CommandTimeout):
+        wait_command(proc, deadline)
+    kill_process_group(proc, grace=1)
+    assert proc.returncode is not None
+    proc.stdout.close()
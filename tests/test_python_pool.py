@@ -0,0 +1,28 @@
+import threading
+
+import pytest
+
+from dashboard.utils.python_pool import PythonProcessPool, PythonTaskTimeout
+
+
+@pytest.fixture
+def pool():
+    pool = PythonProcessPool(size=1, preload=['json'])
+    yield pool
+    pool.close()
+
+
+def test_run_from_a_worker_thread(pool):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+            pool.run('json:dumps [[1, 2]]', timeout=30)))
+    thread.start()
+    thread.join(60)
+    assert results == ['[1, 2]']
+
+
+def test_timeout_replaces_the_process(pool):
+    with pytest.raises(PythonTaskTimeout):
+        pool.run('time:sleep [30]', timeout=0.5)
+    assert pool.stats['timeouts'] == 1
+    assert pool.run('json:dumps {"obj": 3}', timeout=30) == '3'
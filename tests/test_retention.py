@@ -0,0 +1,26 @@
+import pytest
+
+from dashboard import retention
+from dashboard.retention import read_archive, valid_month, write_archive
+
+
+@pytest.mark.parametrize('month', ['2021-07', '1999-12'])
+def test_valid_month(month):
+    assert valid_month(month)
+
+
+@pytest.mark.parametrize('month', ['2021-7', '../../etc/passwd',
+        '2021-07/../../x', '2021-07\n', '', '21-07'])
+def test_invalid_month(month):
+    assert not valid_month(month)
+    with pytest.raises(ValueError):
+        read_archive(1, month)
+
+
+def test_read_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(retention, 'archive_dir', lambda: str(tmp_path))
+    rows = [{'job_id': 1, 'execution_date': '2021-07-0{}T00:00:00'.format(d)}
+            for d in (1, 2)]
+    write_archive(rows)
+    assert read_archive(1, '2021-07') == rows[::-1]
+    assert read_archive(1, '2021-08') == []
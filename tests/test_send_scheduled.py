@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+
+from dashboard import models
+from dashboard.models import (SCHEDULED, Job, ScheduleManager, TaskInstance,
+        init_db)
+from dashboard.utils.db import provide_session
+
+
+def add_job(session, name, active=True):
+    job = Job(name, 'UTC', '2021-07-01 00:00:00', '', '', None,
+            '0 * * * *', '2021-07-01 00:00:00', 'bash', None, 'echo 1',
+            active=active)
+    session.add(job)
+    session.flush()
+    TaskInstance.insert_scheduled(session, job,
+            [datetime(2021, 7, 1, h) for h in range(3)])
+    session.commit()
+
+
+@pytest.fixture
+def manager(sqlite_db, monkeypatch):
+    init_db()
+    monkeypatch.setattr(models.live_index, 'add_running_task',
+            lambda *args: None)
+    monkeypatch.setattr(models, 'bump_versions', lambda *args: None)
+    manager = ScheduleManager()
+    manager.shards = None
+    manager.lease.is_leader = True
+    return manager
+
+
+@provide_session
+def states(session=None):
+    return sorted((t.job_name, t.state) for t in session.query(TaskInstance))
+
+
+def test_inactive_jobs_keep_their_backlog(manager, monkeypatch):
+    sent = []
+    monkeypatch.setattr(Job, 'send_task',
+            lambda job, task, queue, task_id=None: sent.append(task_id))
+
+    @provide_session
+    def setup(session=None):
+        add_job(session, 'running')
+        add_job(session, 'blocked', active=False)
+
+    setup()
+    manager.send_scheduled()
+    assert len(sent) == 3
+    assert states() == [('blocked', SCHEDULED)] * 3 + [
+            ('running', 'PENDING')] * 3
+
+
+def test_failed_send_is_retried(manager, monkeypatch):
+    def send_task(job, task, queue, task_id=None):
+        raise ConnectionError("broker is down")
+
+    monkeypatch.setattr(Job, 'send_task', send_task)
+
+    @provide_session
+    def setup(session=None):
+        add_job(session, 'running')
+
+    setup()
+    manager.send_scheduled()
+    assert states() == [('running', SCHEDULED)] * 3
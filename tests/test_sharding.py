@@ -0,0 +1,91 @@
+import time
+
+import pytest
+
+from dashboard.utils import sharding
+from dashboard.utils.sharding import ShardMembership, live_members
+
+
+class FakeRedis(object):
+    """ the sorted set commands ShardMembership uses """
+
+    def __init__(self):
+        self.zsets = {}
+        self.down = False
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+    def zadd(self, key, mapping):
+        if self.down:
+            raise ConnectionError("redis is down")
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self.zsets.get(key, {})
+        for member, score in list(zset.items()):
+            if score <= high:
+                del zset[member]
+
+    def zrangebyscore(self, key, low, high):
+        return sorted(m for m, score in self.zsets.get(key, {}).items()
+                if score >= low)
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    redis_conn = FakeRedis()
+    monkeypatch.setattr(sharding, 'get_redis_conn', lambda: redis_conn)
+    return redis_conn
+
+
+def test_membership_is_renewed_during_a_long_pass(redis_conn):
+    member = ShardMembership('a', ttl=0.3)
+    assert member.keep()
+    # no keep() while the pass runs, well past the ttl
+    time.sleep(1)
+    assert member.alive()
+    assert live_members() == ['a']
+    member.leave()
+    assert live_members() == []
+
+
+def test_membership_expires_when_it_cannot_be_renewed(redis_conn):
+    member = ShardMembership('a', ttl=0.3)
+    member.keep()
+    redis_conn.down = True
+    time.sleep(0.5)
+    assert not member.alive()
+    member.leave()
+
+
+def test_keep_reports_member_changes_once(redis_conn):
+    member = ShardMembership('a', ttl=0.3)
+    assert member.keep()
+    redis_conn.zadd(sharding.MEMBERS_KEY, {'b': time.time() + 10})
+    time.sleep(0.3)
+    assert member.assigner.members == ['a', 'b']
+    assert member.keep()
+    assert not member.keep()
+    member.leave()
+
+
+def test_stalled_member_leaves(redis_conn, monkeypatch):
+    member = ShardMembership('a', ttl=0.3)
+    monkeypatch.setattr(member, 'max_stall', 0.5)
+    member.keep()
+    # the main loop hangs
+    time.sleep(1)
+    assert not member.alive()
+    assert live_members() == []
+    # and joins again once it makes progress
+    assert not member.keep()
+    assert member.alive()
+    assert live_members() == ['a']
+    member.leave()
@@ -0,0 +1,90 @@
+import pytest
+
+from dashboard.configuration import conf
+from dashboard.utils import sql_pool
+from dashboard.utils.db import open_sql_server_session
+
+DB = 'TESTDB'
+
+
+class FakeRedis(object):
+    """ the string commands the pool stats use """
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.expires[key] = ex
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def scan_iter(self, match):
+        return [k.encode() for k in self.values if k.startswith(match[:-1])]
+
+    def mget(self, keys):
+        return [self.values.get(k.decode()) for k in keys]
+
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    redis_conn = FakeRedis()
+    monkeypatch.setattr(sql_pool, 'get_redis_conn', lambda: redis_conn)
+    return redis_conn
+
+
+@pytest.fixture
+def pool(tmp_path, redis_conn):
+    conf.set('sql_pool', 'driver', 'sqlite3')
+    conf.set('database', DB, str(tmp_path / 'test.db'))
+    yield sql_pool.get_pool(DB)
+    sql_pool.close_all()
+    conf.remove_option('database', DB)
+    conf.set('sql_pool', 'driver', 'pyodbc')
+
+
+def test_pool_settings_are_not_databases():
+    from dashboard.utils.sql_slots import known_databases
+    assert not [db for db in known_databases() if 'POOL' in db]
+
+
+def test_connection_is_reused(pool):
+    for _ in range(3):
+        with open_sql_server_session(DB) as cursor:
+            assert cursor.execute("SELECT 1").fetchall() == [(1,)]
+    assert pool.stats['created'] == 1
+    assert pool.stats['reused'] == 2
+    assert pool.in_use == 0
+
+
+def test_failed_cursor_is_checked_in(pool, monkeypatch):
+    class Broken(object):
+        def cursor(self):
+            raise RuntimeError("connection is broken")
+
+        def rollback(self):
+            raise RuntimeError("connection is broken")
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(pool, '_connect', Broken)
+    with pytest.raises(RuntimeError):
+        with open_sql_server_session(DB):
+            pass
+    assert pool.in_use == 0
+    assert not pool.idle
+
+
+def test_stats_expire_and_are_removed(pool, redis_conn):
+    with open_sql_server_session(DB) as cursor:
+        cursor.execute("SELECT 1")
+    sql_pool.publish_stats(force=True)
+    key, = redis_conn.values
+    assert redis_conn.expires[key] == sql_pool.STATS_EXPIRE
+    stats, = sql_pool.all_pool_stats().values()
+    assert stats[DB]['created'] == 1
+    sql_pool.remove_stats()
+    assert sql_pool.all_pool_stats() == {}
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from dashboard.configuration import conf
+from dashboard.utils import sql_slots
+from dashboard.utils.sql_slots import SLOTS_KEY, sql_slot
+
+
+class FakeRedis(object):
+    """ the sorted set commands of a held slot """
+
+    def __init__(self):
+        self.zsets = {}
+        self.results = []
+
+    def pipeline(self):
+        self.results = []
+        return self
+
+    def execute(self):
+        return self.results
+
+    def zadd(self, key, mapping, xx=False):
+        zset = self.zsets.setdefault(key, {})
+        changed = [m for m in mapping if m in zset or not xx]
+        zset.update((m, mapping[m]) for m in changed)
+        self.results.append(len(changed))
+
+    def zscore(self, key, member):
+        self.results.append(self.zsets.get(key, {}).get(member))
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def hincrby(self, key, field, amount):
+        pass
+
+
+@pytest.fixture
+def redis_conn(monkeypatch):
+    redis_conn = FakeRedis()
+    monkeypatch.setattr(sql_slots, 'get_redis_conn', lambda: redis_conn)
+
+    def acquire(db, token, lease=None):
+        redis_conn.zadd(SLOTS_KEY.format(db), {token: time.time() + lease})
+        return True
+
+    monkeypatch.setattr(sql_slots, 'acquire', acquire)
+    saved = conf.get('sql_slots', 'lease')
+    conf.set('sql_slots', 'lease', '1')
+    yield redis_conn
+    conf.set('sql_slots', 'lease', saved)
+
+
+def test_lease_is_extended_while_the_query_runs(redis_conn):
+    slots = redis_conn.zsets.setdefault(SLOTS_KEY.format('DB'), {})
+    with sql_slot('DB', 'task') as acquired:
+        assert acquired
+        # a query longer than the lease
+        time.sleep(1.5)
+        assert slots['task'] > time.time()
+    assert 'task' not in slots
+
+
+def test_renew_does_not_bring_back_an_expired_slot(redis_conn):
+    assert not sql_slots.renew('DB', 'gone', 1)
+    assert 'gone' not in redis_conn.zsets[SLOTS_KEY.format('DB')]
@@ -0,0 +1,59 @@
+import pytest
+
+from dashboard import models
+from dashboard.models import ScheduleManager, init_db
+
+
+class FakeRedis(object):
+    """ a stream whose pending entries sit on a stopped consumer """
+
+    def __init__(self, pending):
+        self.pending = pending    # entry id -> (consumer, fields)
+        self.claims = []
+
+    def xgroup_create(self, *args, **kwargs):
+        pass
+
+    def xautoclaim(self, stream, group, consumer, min_idle_time,
+                start_id='0-0', count=None, justid=False):
+        self.claims.append((consumer, min_idle_time, start_id))
+        ids = sorted(self.pending)
+        ids = [i for i in ids if i >= start_id][:count]
+        for entry_id in ids:
+            self.pending[entry_id] = (consumer, self.pending[entry_id][1])
+        rest = [i for i in sorted(self.pending) if ids and i > ids[-1]]
+        return [rest[0] if rest else '0-0', ids, []]
+
+    def xreadgroup(self, group, consumer, streams, count=None):
+        read_from, = streams.values()
+        if read_from == '>':
+            return []
+        entries = [(i, fields) for i, (owner, fields) in 
+                   sorted(self.pending.items())
+                   if owner == consumer and i > read_from][:count]
+        return [['stream', entries]] if entries else []
+
+    def xack(self, stream, group, *ids):
+        for entry_id in ids:
+            self.pending.pop(entry_id, None)
+
+    def xdel(self, stream, *ids):
+        pass
+
+
+@pytest.fixture
+def manager(sqlite_db):
+    init_db()
+    manager = ScheduleManager()
+    manager.shards = None
+    return manager
+
+
+def test_events_of_a_stopped_consumer_are_claimed(manager, monkeypatch):
+    # events without a task, old enough to be dropped once read
+    redis_conn = FakeRedis({'1-{}'.format(i): ('dead', {'task_id': str(i),
+            'state': 'SUCCESS'}) for i in range(5)})
+    monkeypatch.setattr(models, 'get_redis_conn', lambda: redis_conn)
+    manager.ingest_task_events(batch_size=2)
+    assert [c[0] for c in redis_conn.claims] == [manager.consumer_name] * 3
+    assert redis_conn.pending == {}
@@ -0,0 +1,24 @@
+from dashboard.models import TaskResult, init_db
+from dashboard.utils.db import provide_session
+
+
+def test_same_output_twice_in_one_batch(sqlite_db):
+    init_db()
+    output = 'x' * 10000
+
+    @provide_session
+    def store_twice(session=None):
+        digests = [TaskResult.store(session, output) for _ in range(2)]
+        session.commit()
+        return digests
+
+    first, second = store_twice()
+    assert first == second
+
+    @provide_session
+    def load(session=None):
+        return [(r.digest, r.text()) for r in session.query(TaskResult)]
+
+    assert load() == [(first, output)]
+    # a later batch finds the committed blob
+    assert store_twice() == [first, first]
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from dashboard.utils.timer import TimerQueue
+
+NOW = datetime(2021, 7, 1, 12, 0)
+
+
+def at(seconds):
+    return NOW + timedelta(seconds=seconds)
+
+
+def test_set_and_remove():
+    queue = TimerQueue()
+    queue.set('a', at(10))
+    queue.set('b', at(5))
+    assert len(queue) == 2
+    assert queue.peek() == at(5)
+    queue.remove('b')
+    assert len(queue) == 1
+    assert queue.peek() == at(10)
+    queue.set('a', None)
+    assert len(queue) == 0
+    assert queue.peek() is None
+
+
+def test_rescheduled_job_drops_its_stale_entry():
+    queue = TimerQueue()
+    queue.set('a', at(5))
+    queue.set('a', at(30))
+    queue.set('a', at(30))
+    assert len(queue) == 1
+    assert queue.peek() == at(30)
+    assert queue.pop_due(at(10)) == []
+    assert queue.pop_due(at(30)) == ['a']
+    assert queue.peek() is None
+
+
+def test_pop_due_in_time_order():
+    queue = TimerQueue()
+    for name, seconds in [('c', 3), ('a', 1), ('late', 60), ('b', 2)]:
+        queue.set(name, at(seconds))
+    assert queue.pop_due(at(3)) == ['a', 'b', 'c']
+    assert len(queue) == 1
+    assert queue.pop_due(at(3)) == []
+
+
+def test_clear():
+    queue = TimerQueue()
+    queue.set('a', at(1))
+    queue.clear()
+    assert len(queue) == 0
+    assert queue.pop_due(at(10)) == []
+
+
+def test_seconds_until_next():
+    queue = TimerQueue()
+    assert queue.seconds_until_next(NOW) is None
+    assert queue.seconds_until_next(NOW, max_wait=20) == 20
+    queue.set('a', at(30))
+    assert queue.seconds_until_next(NOW) == 30
+    assert queue.seconds_until_next(NOW, max_wait=20) == 20
+    assert queue.seconds_until_next(NOW, max_wait=60) == 30
+    # overdue jobs do not wait
+    assert queue.seconds_until_next(at(45), max_wait=20) == 0